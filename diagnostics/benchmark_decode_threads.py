@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Compare inline frame decoding with the parallel decode thread pool.
+#
+# Run it once with a regular build and once with a free-threaded build
+# (e.g. python3.13t) to compare GIL and no-GIL throughput:
+#
+#   python    diagnostics/benchmark_decode_threads.py --threads 1 2 4
+#   python3.13t diagnostics/benchmark_decode_threads.py --threads 1 2 4
+import argparse
+import os
+import platform
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from optitrack_python.streaming.NatNetClient import NatNetClient
+from synthetic_frames import build_frame, build_server_info
+
+
+def make_client(num_threads, queue_size):
+    client = NatNetClient()
+    client.set_decode_threads(num_threads, queue_size=queue_size)
+    delivered = []
+    client.new_frame_listener = lambda data_dict: delivered.append(data_dict["frame_number"])
+    client.process_datagram(build_server_info())
+    client.start_processing()
+    return client, delivered
+
+
+def benchmark(frames, num_threads):
+    client, delivered = make_client(num_threads, queue_size=len(frames))
+    t_start = time.perf_counter()
+    for frame in frames:
+        client.process_datagram(frame)
+    client.wait_until_decoded()
+    elapsed = time.perf_counter() - t_start
+    client.shutdown()
+    in_order = all(a < b for a, b in zip(delivered, delivered[1:]))
+    return len(delivered) / elapsed, in_order, len(delivered)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel frame decoding on decode threads")
+    parser.add_argument("--frames", type=int, default=2000, help="Number of frames to decode")
+    parser.add_argument("--rigid-bodies", type=int, default=50, help="Rigid bodies per frame")
+    parser.add_argument("--markers", type=int, default=500, help="Labeled markers per frame")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="Decode thread counts to test")
+    args = parser.parse_args()
+
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {platform.python_version()} ({'GIL enabled' if is_gil_enabled else 'free-threaded, GIL disabled'})")
+
+    frames = [build_frame(i + 1, n_rigid_bodies=args.rigid_bodies, n_labeled_markers=args.markers)
+              for i in range(args.frames)]
+    print(f"{args.frames} frames, {args.rigid_bodies} rigid bodies, {args.markers} labeled markers")
+
+    inline_rate, in_order, count = benchmark(frames, 0)
+    print(f"  inline       : {inline_rate:8.1f} frames/s")
+    for num_threads in args.threads:
+        rate, in_order, count = benchmark(frames, num_threads)
+        print(f"  {num_threads:2d} threads   : {rate:8.1f} frames/s  ({rate/inline_rate:4.2f}x, "
+              f"{count} delivered, in order: {in_order})")
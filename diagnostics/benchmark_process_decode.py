@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Compare single-thread frame decoding with the shared memory process pool.
+#
+#   python diagnostics/benchmark_process_decode.py --markers 1000 --workers 1 2 4
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from optitrack_python.streaming.NatNetClient import NatNetClient
+from optitrack_python.streaming.ProcessDecoder import ProcessDecoder
+from synthetic_frames import build_frame
+
+
+def benchmark_single_thread(frames):
+    decoder = NatNetClient()
+    t_start = time.perf_counter()
+    for frame in frames:
+        decoder.unpack_frame_of_data(frame, 4, 1)
+    return len(frames) / (time.perf_counter() - t_start)
+
+
+def benchmark_processes(frames, num_workers, n_rigid_bodies, n_markers):
+    delivered = []
+    decoder = ProcessDecoder(lambda frame: delivered.append(frame["frame_number"]),
+                             num_workers=num_workers,
+                             max_rigid_bodies=n_rigid_bodies,
+                             max_labeled_markers=n_markers)
+    decoder.start()
+    try:
+        # warm up the workers before timing
+        for frame in frames[:num_workers * 4]:
+            decoder.submit(frame, 4, 1, block=True)
+        decoder.wait_idle()
+        delivered.clear()
+
+        t_start = time.perf_counter()
+        for frame in frames:
+            decoder.submit(frame, 4, 1, block=True)
+        decoder.wait_idle()
+        elapsed = time.perf_counter() - t_start
+    finally:
+        decoder.shutdown()
+    in_order = all(a < b for a, b in zip(delivered, delivered[1:]))
+    return len(delivered) / elapsed, in_order
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark process-pool frame decoding")
+    parser.add_argument("--frames", type=int, default=2000, help="Number of frames to decode")
+    parser.add_argument("--rigid-bodies", type=int, default=50, help="Rigid bodies per frame")
+    parser.add_argument("--markers", type=int, default=1000, help="Labeled markers per frame")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to test")
+    args = parser.parse_args()
+
+    frames = [build_frame(i + 1, n_rigid_bodies=args.rigid_bodies, n_labeled_markers=args.markers)
+              for i in range(args.frames)]
+    print(f"{args.frames} frames, {args.rigid_bodies} rigid bodies, {args.markers} labeled markers, "
+          f"{len(frames[0])} bytes per frame")
+
+    single = benchmark_single_thread(frames)
+    print(f"  single thread : {single:8.1f} frames/s")
+    for num_workers in args.workers:
+        rate, in_order = benchmark_processes(frames, num_workers, args.rigid_bodies, args.markers)
+        print(f"  {num_workers:2d} processes  : {rate:8.1f} frames/s  ({rate/single:4.2f}x, "
+              f"in order: {in_order})")
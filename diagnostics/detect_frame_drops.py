@@ -90,6 +90,10 @@ if __name__ == "__main__":
                         status_line_content = f"Status: {status_str} (Waiting for first frame) | Elapsed: {formatted_elapsed_time}"
                     else:
                         status_line_content = f"Status: {status_str} | Last Frame: {frame_to_display} | Elapsed: {formatted_elapsed_time}"
+
+                    # Split the drops into our own socket overflowing (kernel) and frames that never arrived (sender/network)
+                    stats = streaming_client.get_stats()
+                    status_line_content += f" | Kernel drops: {stats['kernel_dropped_frames']} | Sender gaps: {stats['sender_dropped_frames']}"
                     
                     print(status_line_content) # Print as a new line
                     last_status_print_time = current_time
@@ -114,6 +118,10 @@ if __name__ == "__main__":
         else:
             print("NatNet client was not started, no shutdown needed.")
         print("NatNet client stopped.")
+        if is_running_initially:
+            stats = streaming_client.get_stats()
+            print(f"Frames received: {stats['frames_received']}, missing: {stats['frames_missing']} "
+                  f"(kernel socket drops: {stats['kernel_dropped_frames']}, sender gaps: {stats['sender_dropped_frames']})")
         if dropped_frames_detected:
             print("Summary: Dropped frames WERE detected during this session.")
         else:
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Check import times against a budget with python -X importtime.
+#
+# Every target is imported in a fresh interpreter (best of --repeat runs, after
+# one warm-up run that writes the bytecode cache). The script exits with status 1
+# if a target exceeds its budget or loads a module it must not load, or if a
+# lazily exported class of the streaming package resolves to something other
+# than the class after its module was imported first, so it can run in CI:
+#
+#   python diagnostics/import_time_budget.py
+#   python diagnostics/import_time_budget.py --scale 2.0   # slow CI machines
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (import statement, budget in ms, modules that must not be loaded by it)
+BUDGETS = [
+    ("import optitrack_python", 10.0,
+     ["optitrack_python.streaming", "numpy", "lunar_tools", "socket"]),
+    ("import optitrack_python.streaming", 15.0,
+     ["optitrack_python.streaming.NatNetClient", "hashlib", "random", "numpy"]),
+    ("from optitrack_python.streaming.NatNetClient import NatNetClient", 40.0,
+     ["concurrent.futures", "json", "hashlib", "numpy", "lunar_tools"]),
+]
+
+
+def measure(statement):
+    """Return (total import time in ms of the statement, set of loaded module names)"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    code = "import sys\n%s\nprint('\\n'.join(sys.modules))" % statement
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            env=env, capture_output=True, text=True, check=True)
+    # Lines read "import time: self | cumulative | name"; top level imports of
+    # the statement have no indentation and come after the interpreter startup.
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue
+        if name.strip().startswith("optitrack_python"):
+            total_us += int(cumulative_us)
+    return total_us / 1000.0, set(result.stdout.split())
+
+
+# Imports run before the lazy classes of optitrack_python.streaming are looked up;
+# "{module}" is the module of the class.
+LAZY_IMPORT_ORDERS = [
+    "",
+    "import optitrack_python.streaming{module}",
+    "from optitrack_python.streaming{module} import {name}",
+    "import optitrack_python.motive_receiver",
+    "import optitrack_python.streaming.NatNetClient",
+]
+
+
+def check_lazy_classes():
+    """Return the (import order, name, resolved value) of lazy streaming exports that are not classes"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    names = subprocess.run([sys.executable, "-c", "import optitrack_python.streaming as s\n"
+                            "print('\\n'.join('%s %s' % item for item in s._lazy_classes.items()))"],
+                           env=env, capture_output=True, text=True, check=True).stdout.split("\n")
+    failures = []
+    for line in filter(None, names):
+        name, module = line.split()
+        for order in LAZY_IMPORT_ORDERS:
+            first = order.format(module=module, name=name)
+            code = ("%s\nfrom optitrack_python.streaming import %s as value\n"
+                    "import optitrack_python.streaming as package\n"
+                    "print(isinstance(value, type) and package.%s is value, repr(value))" % (first, name, name))
+            result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                failures.append((first, name, (result.stderr.strip().splitlines() or [""])[-1]))
+            elif not result.stdout.startswith("True"):
+                failures.append((first, name, result.stdout.split(" ", 1)[1].strip()))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check import times of optitrack_python against a budget")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per target, the fastest counts")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply all budgets, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    for statement, budget_ms, forbidden in BUDGETS:
+        budget_ms *= args.scale
+        measure(statement)
+        times = []
+        for _ in range(args.repeat):
+            elapsed_ms, modules = measure(statement)
+            times.append(elapsed_ms)
+        best_ms = min(times)
+        loaded = [name for name in forbidden if name in modules]
+        ok = best_ms <= budget_ms and not loaded
+        failed = failed or not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {best_ms:6.1f} ms (budget {budget_ms:5.1f} ms)  {statement}")
+        if loaded:
+            print(f"      loads {', '.join(loaded)}")
+
+    failures = check_lazy_classes()
+    failed = failed or bool(failures)
+    print(f"{'PASS' if not failures else 'FAIL'}  lazy streaming exports resolve to their classes")
+    for first, name, value in failures:
+        print(f"      {name} after {first or 'nothing'!r}: {value}")
+    sys.exit(1 if failed else 0)
@@ -4,7 +4,6 @@ import argparse
 from optitrack_python.streaming.NatNetClient import NatNetClient
 import sys
 import datetime
-import traceback
 
 # Configuration
 TARGET_RB_NAME = "A"  # The name of the rigid body to track
@@ -21,9 +20,7 @@ verbose_mode = True
 show_frame_info = False
 stats_interval = 1
 
-# Add tracking for connection health
-connection_dropped = False
-last_frame_time = 0
+# Connection health is watched by the client itself, see NatNetClient.get_connection_state()
 max_frame_gap = 5  # seconds without frames before considering connection lost
 
 # Global variables for tracking
@@ -74,35 +71,11 @@ def receive_new_frame(data_dict):
         if verbose_mode:
             print(f"Error processing frame: {e}")
 
-def check_connection_health(streaming_client):
-    """Check if we're still receiving frames and try to reconnect if needed"""
-    global connection_dropped, last_frame_time
-    
-    current_time = time.time()
-    
-    # If we haven't received a frame for a while, consider the connection dropped
-    if last_frame_time > 0 and current_time - last_frame_time > max_frame_gap:
-        if not connection_dropped:
-            connection_dropped = True
-            print(f"\nWARNING: No frames received for {max_frame_gap}+ seconds at {datetime.datetime.now().strftime('%H:%M:%S')}")
-            print(f"Last frame count: {total_frames_received}")
-            
-            # Attempt to reconnect
-            try:
-                print("Attempting to reconnect...")
-                streaming_client.shutdown()
-                time.sleep(1)  # Wait briefly before restarting
-                
-                # Restart the client
-                success = streaming_client.run()
-                if success:
-                    print("Reconnection successful.")
-                else:
-                    print("Reconnection failed.")
-            except Exception as e:
-                print(f"Error during reconnection attempt: {str(e)}")
-                if verbose_mode:
-                    traceback.print_exc()
+def connection_state_changed(old_state, new_state):
+    """Report the reconnects done by the client"""
+    print(f"\nConnection {old_state} -> {new_state} at {datetime.datetime.now().strftime('%H:%M:%S')}")
+    if new_state == NatNetClient.STATE_STALLED:
+        print(f"WARNING: No frames received for {max_frame_gap}+ seconds, last frame count: {total_frames}")
 
 if __name__ == "__main__":
     # Parse command line arguments
@@ -120,6 +93,8 @@ if __name__ == "__main__":
     # Set up client
     print("Connecting to NatNet server...")
     client.new_frame_listener = receive_new_frame
+    client.connection_state_listener = connection_state_changed
+    client.stall_timeout = max_frame_gap
     success = client.run()
     
     if not success:
@@ -148,7 +123,8 @@ if __name__ == "__main__":
                 # Print status
                 status_line = f"Status: Frames={total_frames} (+{frames_interval}/s), "
                 status_line += f"Identical: {identical_count_interval} (interval) / {identical_count_total} (total), "
-                status_line += f"Runtime={hours:02d}:{minutes:02d}:{seconds:02d}"
+                status_line += f"Runtime={hours:02d}:{minutes:02d}:{seconds:02d}, "
+                status_line += f"Connection={client.get_connection_state()}"
                 print(status_line)
                 
                 # Reset interval counters
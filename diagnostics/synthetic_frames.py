@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Build synthetic NatNet 4.1 datagrams for offline benchmarks and diagnostics.
+#
+# The layout mirrors what NatNetClient.__unpack_mocap_data and
+# __unpack_data_descriptions expect, so the packets can be fed straight into
+# the normal decode path without a running Motive server.
+
+import struct
+
+NAT_SERVERINFO = 1
+NAT_MODELDEF = 5
+NAT_FRAMEOFDATA = 7
+
+
+def _message(message_id, payload):
+    # packet size is 16 bit on the wire, large frames wrap just like Motive's do
+    return struct.pack('<hH', message_id, len(payload) & 0xffff) + payload
+
+
+def build_server_info(application_name="Motive", server_version=(3, 1, 0, 0), natnet_version=(4, 1, 0, 0)):
+    name = application_name.encode('utf-8')[:255]
+    payload = name + b'\0' * (256 - len(name))
+    payload += bytes(server_version) + bytes(natnet_version)
+    return _message(NAT_SERVERINFO, payload)
+
+
+def build_model_def(n_rigid_bodies=10, name_format="RB%d", first_id=1):
+    body = b''
+    for i in range(n_rigid_bodies):
+        rb_id = first_id + i
+        rb = (name_format % rb_id).encode('utf-8') + b'\0'
+        rb += struct.pack('<ii', rb_id, -1)
+        rb += struct.pack('<fff', 0.0, 0.0, 0.0)
+        # no markers
+        rb += struct.pack('<i', 0)
+        body += struct.pack('<ii', 1, len(rb)) + rb
+    payload = struct.pack('<i', n_rigid_bodies) + body
+    return _message(NAT_MODELDEF, payload)
+
+
+def build_frame(frame_number, n_rigid_bodies=10, n_labeled_markers=0, n_skeletons=0,
+                bones_per_skeleton=0, timestamp=None, tracked_models_changed=False,
+                first_id=1):
+    if timestamp is None:
+        timestamp = frame_number / 240.0
+    out = [struct.pack('<i', frame_number)]
+
+    # markersets, legacy other markers
+    out.append(struct.pack('<ii', 0, 0))
+    out.append(struct.pack('<ii', 0, 0))
+
+    # rigid bodies
+    rb_struct = struct.Struct('<ifffffffh')
+    rbs = b''.join(
+        struct.pack('<i', first_id + i) +
+        struct.pack('<fffffff', 0.01*i, 1.0 + 0.001*frame_number, -0.01*i, 0.0, 0.0, 0.0, 1.0) +
+        struct.pack('<fh', 0.0005, 1)
+        for i in range(n_rigid_bodies))
+    out.append(struct.pack('<ii', n_rigid_bodies, len(rbs)) + rbs)
+
+    # skeletons
+    skel = b''
+    for s in range(n_skeletons):
+        skel += struct.pack('<ii', s + 1, bones_per_skeleton)
+        for b in range(bones_per_skeleton):
+            skel += struct.pack('<i', b + 1)
+            skel += struct.pack('<fffffff', 0.1*b, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0)
+            skel += struct.pack('<fh', 0.0, 1)
+    out.append(struct.pack('<ii', n_skeletons, len(skel)) + skel)
+
+    # assets
+    out.append(struct.pack('<ii', 0, 0))
+
+    # labeled markers
+    lms = b''.join(
+        struct.pack('<iffffhf', (1 << 16) | (i + 1), 0.001*i, 0.5, 0.002*i, 0.014, 0, 0.0001)
+        for i in range(n_labeled_markers))
+    out.append(struct.pack('<ii', n_labeled_markers, len(lms)) + lms)
+
+    # force plates, devices
+    out.append(struct.pack('<ii', 0, 0))
+    out.append(struct.pack('<ii', 0, 0))
+
+    # suffix
+    param = 0x02 if tracked_models_changed else 0
+    stamp = int(timestamp * 1e7)
+    out.append(struct.pack('<iidqqqiih', 0, 0, timestamp, stamp, stamp + 10, stamp + 20,
+                           int(timestamp), 0, param))
+    return _message(NAT_FRAMEOFDATA, b''.join(out))
@@ -192,12 +192,9 @@ if __name__ == "__main__":
     
     # Wait for initial connection
     print("Waiting for data connection...")
-    for i in range(50):  # Try for 5 seconds
+    if motive.wait_until_ready(timeout=5.0):
         latest_data = motive.get_last()
-        if latest_data:
-            print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
-            break
-        time.sleep(0.1)
+        print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
     else:
         print("✗ No data received. Check OptiTrack connection.")
         motive.stop()
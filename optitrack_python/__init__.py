@@ -1,2 +1,15 @@
-# Make streaming package available
-from . import streaming
+# Make the subpackages available on first use (PEP 562), so importing the
+# package does not pull in numpy, lunar_tools or the socket layer until needed.
+import importlib
+
+_submodules = ("streaming", "motive_receiver", "rigid_body", "export", "batch")
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
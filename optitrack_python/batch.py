@@ -0,0 +1,414 @@
+# Batch processing of directories of recordings.
+#
+# run_batch() finds the recordings (*.natrec) below an input directory and runs
+# jobs on them in a ProcessPoolExecutor:
+#
+#   index    complete or rebuild <recording>.idx next to the recording
+#   summary  frames, frame gaps, duration and per rigid body tracking statistics,
+#            written to <output directory>/<recording name>.summary.json
+#   archive  compressed columnar archive (see streaming/Archive.py),
+#            written to <output directory>/<recording name>.natarc
+#
+# Every recording is first hashed and indexed by one worker. Summary and archive
+# jobs are then split at index entries into work units of about unit_frames
+# frames, which run in parallel; their results are merged when the last unit
+# of a job is done. A state file in the output directory keeps the content hash
+# of every recording and the options each output was made with, so a repeated
+# or interrupted run skips the outputs that are up to date. Recordings whose
+# size and modification time did not change are not hashed again.
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+
+from optitrack_python.streaming.Archive import ArchiveReader, ArchiveWriter, merge_archives, CHUNK_FRAMES
+from optitrack_python.streaming.Archive import FILE_EXTENSION as ARCHIVE_EXTENSION
+from optitrack_python.streaming.Recording import RecordingReader, FILE_EXTENSION, DATA_CHANNEL, NAT_FRAMEOFDATA, index_path_of
+
+JOBS = ("index", "summary", "archive")
+
+STATE_FILE_NAME = "batch_state.json"
+SUMMARY_EXTENSION = ".summary.json"
+
+# Frames per work unit of summary and archive jobs
+UNIT_FRAMES = 32 * CHUNK_FRAMES
+
+HASH_BLOCK_SIZE = 4*1024*1024
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_recordings(directory):
+    """Paths of the recordings below directory, sorted"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(FILE_EXTENSION):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+# Work units, run in the worker processes. Each one returns a dictionary with
+# the worker's pid, the recording bytes and frames it processed and its run time.
+
+def _unit_result(start, bytes_processed, frames, **values):
+    result = {"worker": os.getpid(), "bytes": bytes_processed, "frames": frames,
+              "elapsed": time.monotonic() - start}
+    result.update(values)
+    return result
+
+
+def _scan_unit(path, compute_hash):
+    start = time.monotonic()
+    digest = file_hash(path) if compute_hash else None
+    # opening the reader completes or rebuilds the index
+    with RecordingReader(path) as reader:
+        frame_offsets = list(reader.frame_offsets)
+        index_interval = reader.index_interval
+        file_size = reader.file_size
+    return _unit_result(start, file_size if compute_hash else 0, 0, hash=digest,
+                        frame_offsets=frame_offsets, index_interval=index_interval)
+
+
+def _decoded_frames(reader, start_offset, end_offset):
+    """(client, MoCapData) of the frames from start_offset to end_offset, decoded
+    by a client that has seen the command records before them"""
+    from optitrack_python.streaming.NatNetClient import NatNetClient
+    client = NatNetClient()
+    client.set_print_level(0)
+    if start_offset is not None:
+        for record in reader.context_records(start_offset):
+            client.process_command_datagram(record[4])
+    for channel, message_id, monotonic_ns, time_ns, data in reader.records(start_offset, end_offset):
+        if channel != DATA_CHANNEL:
+            client.process_command_datagram(data)
+        elif message_id == NAT_FRAMEOFDATA:
+            mocap_data = client.unpack_frame_of_data(data)
+            mocap_data.rx_timestamp_ns = time_ns
+            yield client, mocap_data
+
+
+def _unit_bytes(reader, start_offset, end_offset):
+    if start_offset is None:
+        start_offset = reader.data_offset
+    if end_offset is None:
+        end_offset = reader.file_size
+    return end_offset - start_offset
+
+
+def _summary_unit(path, start_offset, end_offset):
+    start = time.monotonic()
+    summary = {"frames": 0, "first_frame": None, "last_frame": None, "missing_frames": 0,
+               "first_time_ns": None, "last_time_ns": None, "rigid_bodies": {}}
+    bodies = summary["rigid_bodies"]
+    with RecordingReader(path) as reader:
+        for client, mocap_data in _decoded_frames(reader, start_offset, end_offset):
+            frame_number = mocap_data.prefix_data.frame_number
+            if summary["last_frame"] is None:
+                summary["first_frame"] = frame_number
+                summary["first_time_ns"] = mocap_data.rx_timestamp_ns
+            elif frame_number > summary["last_frame"] + 1:
+                summary["missing_frames"] += frame_number - summary["last_frame"] - 1
+            summary["last_frame"] = frame_number
+            summary["last_time_ns"] = mocap_data.rx_timestamp_ns
+            summary["frames"] += 1
+            for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+                key = str(rigid_body.id_num)
+                body = bodies.get(key)
+                if body is None:
+                    name = None
+                    if client.data_descriptions is not None:
+                        name = client.data_descriptions.get_rigid_body_name(rigid_body.id_num)
+                    body = bodies[key] = {"name": name, "frames": 0, "valid_frames": 0, "error_sum": 0.0}
+                body["frames"] += 1
+                if rigid_body.tracking_valid:
+                    body["valid_frames"] += 1
+                    body["error_sum"] += rigid_body.error
+        unit_bytes = _unit_bytes(reader, start_offset, end_offset)
+    return _unit_result(start, unit_bytes, summary["frames"], summary=summary)
+
+
+def _archive_unit(path, start_offset, end_offset, part_path, options):
+    start = time.monotonic()
+    frames = 0
+    with RecordingReader(path) as reader:
+        with ArchiveWriter(part_path, **options) as writer:
+            for client, mocap_data in _decoded_frames(reader, start_offset, end_offset):
+                writer.data_descriptions = client.data_descriptions
+                writer.add_frame(mocap_data)
+                frames += 1
+        unit_bytes = _unit_bytes(reader, start_offset, end_offset)
+    return _unit_result(start, unit_bytes, frames)
+
+
+# Merging, in the main process
+
+def merge_summaries(parts):
+    """Summary of a recording from the summaries of its units, in order"""
+    total = {"frames": 0, "first_frame": None, "last_frame": None, "missing_frames": 0,
+             "first_time_ns": None, "last_time_ns": None, "rigid_bodies": {}}
+    for part in parts:
+        if part["frames"] == 0:
+            continue
+        if total["last_frame"] is None:
+            total["first_frame"] = part["first_frame"]
+            total["first_time_ns"] = part["first_time_ns"]
+        elif part["first_frame"] > total["last_frame"] + 1:
+            total["missing_frames"] += part["first_frame"] - total["last_frame"] - 1
+        total["last_frame"] = part["last_frame"]
+        total["last_time_ns"] = part["last_time_ns"]
+        total["frames"] += part["frames"]
+        total["missing_frames"] += part["missing_frames"]
+        for key, part_body in part["rigid_bodies"].items():
+            body = total["rigid_bodies"].setdefault(key, {"name": part_body["name"], "frames": 0,
+                                                          "valid_frames": 0, "error_sum": 0.0})
+            body["frames"] += part_body["frames"]
+            body["valid_frames"] += part_body["valid_frames"]
+            body["error_sum"] += part_body["error_sum"]
+    duration = 0.0
+    if total["first_time_ns"] is not None and total["last_time_ns"] is not None:
+        duration = (total["last_time_ns"] - total["first_time_ns"]) / 1e9
+    total["duration_seconds"] = duration
+    total["frames_per_second"] = (total["frames"] - 1) / duration if duration > 0 else 0.0
+    for body in total["rigid_bodies"].values():
+        error_sum = body.pop("error_sum")
+        body["valid_ratio"] = body["valid_frames"] / total["frames"]
+        body["mean_error"] = error_sum / body["valid_frames"] if body["valid_frames"] else None
+    return total
+
+
+def _write_json(path, value):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def _load_state(output_directory):
+    try:
+        with open(os.path.join(output_directory, STATE_FILE_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def _job_signature(digest, job, options):
+    return hashlib.sha1(json.dumps([digest, job, options], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _split(frame_offsets, index_interval, unit_frames):
+    """(start_offset, end_offset) work units at index entries, None for the file ends"""
+    step = max(1, unit_frames // index_interval)
+    starts = [None] + list(frame_offsets[step::step])
+    return [(starts[i], starts[i + 1] if i + 1 < len(starts) else None) for i in range(len(starts))]
+
+
+class _File:
+    """Batch progress of one recording"""
+    def __init__(self, path, relative_path, stat, output_base):
+        self.path = path
+        self.relative_path = relative_path
+        self.stat = stat
+        self.output_base = output_base
+        self.hash = None
+        # job -> signature of the outputs made in this run
+        self.done = {}
+        # job -> list of unit results, in unit order
+        self.units = {}
+        self.pending = {}
+        self.failed = False
+
+    def output_path(self, job):
+        if job == "index":
+            return index_path_of(self.path)
+        if job == "summary":
+            return self.output_base + SUMMARY_EXTENSION
+        return self.output_base + ARCHIVE_EXTENSION
+
+
+def run_batch(input_directory, output_directory, jobs=JOBS, workers=None, unit_frames=UNIT_FRAMES,
+              archive_options=None, force=False, progress=None):
+    """Run jobs (see JOBS) on all recordings below input_directory in workers
+    processes (default: one per CPU), writing outputs below output_directory.
+
+    archive_options are passed to ArchiveWriter (chunk_frames, precision,
+    compression, level). Outputs made from the same recording content with
+    the same options are skipped unless force. progress(done_units,
+    total_units, relative_path, job) is called after every work unit.
+    Returns a report with per worker throughput.
+    """
+    for job in jobs:
+        if job not in JOBS:
+            raise ValueError("unknown job %r" % job)
+    archive_options = dict(archive_options or {})
+    options = {"index": {}, "summary": {}, "archive": archive_options}
+    os.makedirs(output_directory, exist_ok=True)
+    state = _load_state(output_directory)
+    state_files = state.setdefault("files", {})
+
+    report = {"recordings": 0, "up_to_date": 0, "outputs": 0, "units": 0, "bytes": 0, "frames": 0,
+              "errors": [], "workers": {}}
+    start = time.monotonic()
+    units_total = 0
+    units_done = 0
+
+    def up_to_date(file, job, digest):
+        entry = state_files.get(file.relative_path)
+        return (not force and entry is not None and
+                entry.get("outputs", {}).get(job) == _job_signature(digest, job, options[job]) and
+                os.path.exists(file.output_path(job)))
+
+    def account(result):
+        worker = report["workers"].setdefault(result["worker"], {"units": 0, "bytes": 0, "frames": 0, "busy_seconds": 0.0})
+        worker["units"] += 1
+        worker["bytes"] += result["bytes"]
+        worker["frames"] += result["frames"]
+        worker["busy_seconds"] += result["elapsed"]
+        report["units"] += 1
+        report["bytes"] += result["bytes"]
+        report["frames"] += result["frames"]
+
+    def save_file_state(file):
+        outputs = dict(state_files.get(file.relative_path, {}).get("outputs", {}))
+        if state_files.get(file.relative_path, {}).get("hash") != file.hash:
+            outputs = {}
+        outputs.update(file.done)
+        state_files[file.relative_path] = {"size": file.stat.st_size, "mtime_ns": file.stat.st_mtime_ns,
+                                           "hash": file.hash, "outputs": outputs}
+        _write_json(os.path.join(output_directory, STATE_FILE_NAME), state)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for path in find_recordings(input_directory):
+            report["recordings"] += 1
+            relative_path = os.path.relpath(path, input_directory)
+            stat = os.stat(path)
+            output_base = os.path.join(output_directory, os.path.splitext(relative_path)[0])
+            file = _File(path, relative_path, stat, output_base)
+            entry = state_files.get(relative_path)
+            known = entry is not None and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns
+            if known and all(up_to_date(file, job, entry["hash"]) for job in jobs):
+                report["up_to_date"] += 1
+                continue
+            if known:
+                file.hash = entry["hash"]
+            futures[executor.submit(_scan_unit, path, not known)] = (file, "scan", None)
+            units_total += 1
+
+        while futures:
+            finished, unfinished = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                file, job, unit = futures.pop(future)
+                units_done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    file.failed = True
+                    report["errors"].append({"recording": file.relative_path, "job": job, "error": repr(e)})
+                    if job != "scan":
+                        file.pending[job] -= 1
+                        if file.pending[job] == 0:
+                            _discard_job(file, job)
+                    if progress is not None:
+                        progress(units_done, units_total, file.relative_path, job)
+                    continue
+                account(result)
+
+                if job == "scan":
+                    if result["hash"] is not None:
+                        file.hash = result["hash"]
+                    if "index" in jobs and not up_to_date(file, "index", file.hash):
+                        file.done["index"] = _job_signature(file.hash, "index", options["index"])
+                        report["outputs"] += 1
+                    work_units = _split(result["frame_offsets"], result["index_interval"], unit_frames)
+                    for stale_job in ("summary", "archive"):
+                        if stale_job not in jobs or up_to_date(file, stale_job, file.hash):
+                            continue
+                        os.makedirs(os.path.dirname(file.output_base) or ".", exist_ok=True)
+                        file.units[stale_job] = [None] * len(work_units)
+                        file.pending[stale_job] = len(work_units)
+                        for i, (start_offset, end_offset) in enumerate(work_units):
+                            if stale_job == "summary":
+                                unit_future = executor.submit(_summary_unit, file.path, start_offset, end_offset)
+                            else:
+                                part_path = "%s.part%04d" % (file.output_path("archive"), i)
+                                unit_future = executor.submit(_archive_unit, file.path, start_offset, end_offset,
+                                                              part_path, archive_options)
+                            futures[unit_future] = (file, stale_job, i)
+                            units_total += 1
+                else:
+                    file.units[job][unit] = result
+                    file.pending[job] -= 1
+                    if file.pending[job] == 0 and file.failed:
+                        # another unit or job of the recording failed
+                        _discard_job(file, job)
+                    elif file.pending[job] == 0:
+                        try:
+                            _finish_job(file, job)
+                        except Exception as e:
+                            file.failed = True
+                            report["errors"].append({"recording": file.relative_path, "job": job, "error": repr(e)})
+                            _discard_job(file, job)
+                        else:
+                            file.done[job] = _job_signature(file.hash, job, options[job])
+                            report["outputs"] += 1
+
+                if progress is not None:
+                    progress(units_done, units_total, file.relative_path, job)
+                if not file.failed and not any(file.pending.values()):
+                    save_file_state(file)
+                    file.pending = {}
+
+    report["elapsed"] = time.monotonic() - start
+    report["mb_per_second"] = report["bytes"] / 1e6 / report["elapsed"] if report["elapsed"] > 0 else 0.0
+    report["frames_per_second"] = report["frames"] / report["elapsed"] if report["elapsed"] > 0 else 0.0
+    for worker in report["workers"].values():
+        busy = worker["busy_seconds"]
+        worker["mb_per_second"] = worker["bytes"] / 1e6 / busy if busy > 0 else 0.0
+        worker["frames_per_second"] = worker["frames"] / busy if busy > 0 else 0.0
+    return report
+
+
+def _finish_job(file, job):
+    if job == "summary":
+        summary = merge_summaries([result["summary"] for result in file.units[job]])
+        summary["recording"] = file.relative_path
+        summary["hash"] = file.hash
+        _write_json(file.output_path("summary"), summary)
+    elif job == "archive":
+        path = file.output_path("archive")
+        part_paths = ["%s.part%04d" % (path, i) for i in range(len(file.units[job]))]
+        with ArchiveReader(part_paths[0]) as first_part:
+            header = dict(first_part.header)
+        with RecordingReader(file.path) as reader:
+            header["recording"] = reader.header
+        header["source"] = file.relative_path
+        merge_archives(part_paths, path + ".tmp", header)
+        os.replace(path + ".tmp", path)
+        for part_path in part_paths:
+            os.remove(part_path)
+
+
+def _discard_job(file, job):
+    """Remove the intermediate files of a job that failed, once none of its units runs"""
+    if job != "archive":
+        return
+    path = file.output_path("archive")
+    temp_paths = ["%s.part%04d" % (path, i) for i in range(len(file.units[job]))] + [path + ".tmp"]
+    for temp_path in temp_paths:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,199 @@
+# Export recordings to NumPy arrays for offline analysis.
+#
+# export_recording() decodes a recording (see streaming/Recording.py) once and
+# writes one directory of .npy files per rigid body plus the per frame time
+# bases, all aligned on the recording's frames:
+#
+#   manifest.json            frame count, source, arrays and bodies (by directory)
+#   frame_number.npy         int64   (n,)
+#   time_ns.npy              int64   (n,)    receive time, ns since the epoch
+#   timestamp.npy            float64 (n,)    Motive timestamp in seconds
+#   <body>/pos.npy           float32 (n, 3)  NaN in frames without the body
+#   <body>/rot.npy           float32 (n, 4)  qx, qy, qz, qw
+#   <body>/error.npy         float32 (n,)    mean marker error
+#   <body>/valid.npy         bool    (n,)    tracking valid
+#
+# load_rigid_body() opens them as read-only memory maps: loading takes
+# milliseconds whatever the size, and processes opening the same export
+# share the pages through the page cache.
+import json
+import os
+import re
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from optitrack_python.streaming.Recording import RecordingReader
+
+MANIFEST = "manifest.json"
+
+# Frames decoded before their rigid bodies are copied into the memory maps at once
+EXPORT_BLOCK_FRAMES = 4096
+
+_BODY_ARRAYS = (
+    ("pos", np.float32, (3,)),
+    ("rot", np.float32, (4,)),
+    ("error", np.float32, ()),
+    ("valid", np.bool_, ()),
+)
+
+
+def _directory_name(name, id_num, used):
+    directory = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("._") if name else ""
+    if not directory or directory in used:
+        directory = "%s_%d" % (directory or "rigid_body", id_num)
+    used.add(directory)
+    return directory
+
+
+class _BodyExport:
+    """Memory maps of one rigid body and the rows of the current block"""
+    def __init__(self, directory, frame_count, filled_frames):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.arrays = {}
+        for name, dtype, shape in _BODY_ARRAYS:
+            array = open_memmap(os.path.join(directory, name + ".npy"), mode="w+",
+                                dtype=dtype, shape=(frame_count,) + shape)
+            if name != "valid":
+                # frames already exported, before the body appeared
+                array[:filled_frames] = np.nan
+            self.arrays[name] = array
+        self.valid_frames = 0
+        self.reset_block()
+
+    def reset_block(self):
+        self.rows = []
+        self.pos = []
+        self.rot = []
+        self.error = []
+        self.valid = []
+
+    def flush_block(self, start, end):
+        arrays = self.arrays
+        arrays["pos"][start:end] = np.nan
+        arrays["rot"][start:end] = np.nan
+        arrays["error"][start:end] = np.nan
+        arrays["valid"][start:end] = False
+        if self.rows:
+            rows = np.asarray(self.rows, dtype=np.int64) + start
+            arrays["pos"][rows] = self.pos
+            arrays["rot"][rows] = self.rot
+            arrays["error"][rows] = self.error
+            arrays["valid"][rows] = self.valid
+            self.valid_frames += int(np.count_nonzero(self.valid))
+        self.reset_block()
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = {}
+
+
+def export_recording(recording_path, directory, rigid_bodies=None, progress=None):
+    """Write the rigid bodies of a recording as .npy arrays to directory.
+
+    rigid_bodies limits the export to these names or ids. progress(done, total)
+    is called after every block of frames. Returns the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with RecordingReader(recording_path) as reader:
+        frames = reader.frames()
+        frame_count = len(frames)
+        data_descriptions = frames.client.data_descriptions
+        wanted = None if rigid_bodies is None else set(rigid_bodies)
+
+        frame_numbers = open_memmap(os.path.join(directory, "frame_number.npy"), mode="w+",
+                                    dtype=np.int64, shape=(frame_count,))
+        times_ns = open_memmap(os.path.join(directory, "time_ns.npy"), mode="w+",
+                               dtype=np.int64, shape=(frame_count,))
+        timestamps = open_memmap(os.path.join(directory, "timestamp.npy"), mode="w+",
+                                 dtype=np.float64, shape=(frame_count,))
+
+        bodies = {}
+        skipped = set()
+        used_directories = set()
+        manifest_bodies = {}
+        block_start = 0
+        for index in range(frame_count):
+            mocap_data = frames[index]
+            frame_numbers[index] = mocap_data.prefix_data.frame_number
+            times_ns[index] = mocap_data.rx_timestamp_ns
+            timestamps[index] = mocap_data.suffix_data.timestamp
+            row = index - block_start
+            for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+                id_num = rigid_body.id_num
+                body = bodies.get(id_num)
+                if body is None:
+                    if id_num in skipped:
+                        continue
+                    name = None
+                    if data_descriptions is not None:
+                        name = data_descriptions.get_rigid_body_name(id_num)
+                    if wanted is not None and id_num not in wanted and name not in wanted:
+                        skipped.add(id_num)
+                        continue
+                    body_directory = _directory_name(name, id_num, used_directories)
+                    body = bodies[id_num] = _BodyExport(os.path.join(directory, body_directory),
+                                                        frame_count, block_start)
+                    # names need not be unique, the directories are
+                    manifest_bodies[body_directory] = {"id": id_num, "name": name, "directory": body_directory}
+                body.rows.append(row)
+                body.pos.append(rigid_body.pos)
+                body.rot.append(rigid_body.rot)
+                body.error.append(rigid_body.error)
+                body.valid.append(bool(rigid_body.tracking_valid))
+            if index + 1 - block_start >= EXPORT_BLOCK_FRAMES or index + 1 == frame_count:
+                for body in bodies.values():
+                    body.flush_block(block_start, index + 1)
+                block_start = index + 1
+                if progress is not None:
+                    progress(index + 1, frame_count)
+
+        for array in (frame_numbers, times_ns, timestamps):
+            array.flush()
+        for entry in manifest_bodies.values():
+            body = bodies[entry["id"]]
+            entry["valid_frames"] = body.valid_frames
+            entry["arrays"] = {name: name + ".npy" for name, dtype, shape in _BODY_ARRAYS}
+            body.close()
+
+        manifest = {
+            "source": os.path.abspath(recording_path),
+            "recording": reader.header,
+            "frames": frame_count,
+            "first_frame": int(frame_numbers[0]) if frame_count else None,
+            "last_frame": int(frame_numbers[-1]) if frame_count else None,
+            "arrays": {"frame_number": "frame_number.npy", "time_ns": "time_ns.npy",
+                       "timestamp": "timestamp.npy"},
+            "rigid_bodies": manifest_bodies,
+        }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def load_rigid_body(directory, name, mmap_mode="r"):
+    """Arrays of the rigid body name (or id, or directory) of an export, with the
+    frame time bases, as a dictionary of memory mapped arrays"""
+    manifest = load_manifest(directory)
+    entry = manifest["rigid_bodies"].get(str(name))
+    if entry is None:
+        for candidate in manifest["rigid_bodies"].values():
+            if candidate["id"] == name or candidate["name"] == name:
+                entry = candidate
+                break
+    if entry is None:
+        raise KeyError("rigid body %r is not in the export" % (name,))
+    arrays = {}
+    for key, file_name in manifest["arrays"].items():
+        arrays[key] = np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode)
+    body_directory = os.path.join(directory, entry["directory"])
+    for key, file_name in entry["arrays"].items():
+        arrays[key] = np.load(os.path.join(body_directory, file_name), mmap_mode=mmap_mode)
+    return arrays
@@ -42,7 +42,10 @@ class MotiveReceiver:
         start_process=True, 
         do_record_streaming=False, 
         do_mock_streaming=False, 
-        fn_mock='streaming_mock.pkl'
+        fn_mock='streaming_mock.natrec',
+        connect_timeout=5.0,
+        mock_speed=1.0,
+        mock_loop=False
     ):
         self.server_ip = server_ip
         self.client_ip = client_ip
@@ -73,6 +76,13 @@ class MotiveReceiver:
         self.do_record_streaming = do_record_streaming
         self.do_mock_streaming = do_mock_streaming
         self.fn_mock = fn_mock
+        # replay speed (1.0 real time, 0 as fast as possible) and looping of fn_mock
+        self.mock_speed = mock_speed
+        self.mock_loop = mock_loop
+        self.connect_timeout = connect_timeout
+        # set once the first frame has been processed, see wait_until_ready()
+        self.ready_event = threading.Event()
+        self.connect_timings = {}
         # self.rigid_body_positions = {label:[] for label in self.rigid_body_labels}
         if start_process:
             self.start_process()
@@ -105,16 +115,19 @@ class MotiveReceiver:
             if self.do_record_streaming:
                 self.streaming_client.set_record_streaming(fn_mock=self.fn_mock)
             if self.do_mock_streaming:
-                self.streaming_client.set_mock_streaming(fn_mock=self.fn_mock)
+                self.streaming_client.set_mock_streaming(fn_mock=self.fn_mock, speed=self.mock_speed, loop=self.mock_loop)
             self.streaming_client.set_client_address(optionsDict["clientAddress"])
             self.streaming_client.set_server_address(optionsDict["serverAddress"])
             self.streaming_client.set_use_multicast(optionsDict["use_multicast"])
             self.streaming_client.new_frame_listener = self.process_packet
                 
-            is_running = self.streaming_client.run()
-            if not is_running:
+            is_ready = self.streaming_client.run(wait_until_ready=True, timeout=self.connect_timeout)
+            if not self.do_mock_streaming and (self.streaming_client.command_socket is None or self.streaming_client.data_socket is None):
                 print("ERROR: Could not start streaming client.")
                 return
+            self.connect_timings = self.streaming_client.get_connect_timings()
+            if not is_ready:
+                print(f"WARNING: Server not ready after {self.connect_timeout}s, still waiting for data.")
         except Exception as e:
             print(f"ERROR: Exception in streaming client: {e}")
             return
@@ -123,21 +136,37 @@ class MotiveReceiver:
     def save_packet(self, packet_content):
         self.list_raw_packets.append(packet_content)
         
+    def get_data_descriptions(self):
+        """Latest model definitions of the streaming client, or None"""
+        streaming_client = getattr(self, "streaming_client", None)
+        if streaming_client is None:
+            return None
+        return streaming_client.data_descriptions
+
     def normalizer_data(self, dict_data):
         labels_rows = [_["model_name"] for _ in dict_data["marker_sets_labeled_data"]]
+        marker_sets_by_name = {_["model_name"].decode(): _ for _ in dict_data["marker_sets_labeled_data"]}
+        data_descriptions = self.get_data_descriptions()
         dict_data["rigid_bodies_full"] = {}
+        # the upper 16 bits of a labeled marker id are the id of its model
+        labeled_markers_by_model = {}
+        for marker in dict_data["labeled_markers"]:
+            labeled_markers_by_model.setdefault(marker["id_num"] >> 16, []).append(marker)
 
         for __ in dict_data["rigid_bodies"]:
             id_ = __["id_num"]-1
             out = __
-            out["model_name"] = labels_rows[id_]
-            out["markers"] = dict_data["marker_sets_labeled_data"][id_]["marker_pos_list"]
-            if len(dict_data["labeled_markers"])-1 >= id_ and id_ >= 0:
-                #print("id",id_)
-                #print(dict_data["labeled_markers"])
-                out["labeled_markers"] = dict_data["labeled_markers"][id_]
-            model_name = out["model_name"].decode()
-            del out["model_name"]
+            model_name = None
+            if data_descriptions is not None:
+                model_name = data_descriptions.get_rigid_body_name(__["id_num"])
+            if model_name is None:
+                # no model definitions yet, assume ids follow the marker set order
+                if id_ < 0 or id_ >= len(labels_rows):
+                    continue
+                model_name = labels_rows[id_].decode()
+            marker_set = marker_sets_by_name.get(model_name)
+            out["markers"] = marker_set["marker_pos_list"] if marker_set is not None else []
+            out["labeled_markers"] = labeled_markers_by_model.get(__["id_num"], [])
             dict_data["rigid_bodies_full"][model_name] = out
         return dict_data
     
@@ -179,8 +208,13 @@ class MotiveReceiver:
         #print(dict_data["skeletons_list"])
         dict_data = self.normalizer_data(dict_data)
         self.list_dict_packets.append(dict_data)
+        self.ready_event.set()
         
 
+    def wait_until_ready(self, timeout=None):
+        """Block until the first frame has been processed, returns False on timeout"""
+        return self.ready_event.wait(timeout)
+
     def stop(self):
         print("stopping process!")
         self.running = False
@@ -217,9 +251,8 @@ if __name__ == "__main__":
     if hasattr(signal, 'SIGTERM'):
         signal.signal(signal.SIGTERM, signal_handler)
     
-    # Wait a moment for connection to establish
-    import time
-    time.sleep(1)
+    # Wait for the connection handshake and the first frame
+    motive.wait_until_ready(timeout=5.0)
     
     # Keep the script running to receive and display data
     try:
@@ -4,10 +4,11 @@ import math
 import time
 import threading
 import sys
-import lunar_tools as lt
 
 class RigidBody:
     def __init__(self, motive_receiver, label):
+        # lunar_tools has a large dependency tree, only load it for RigidBody users
+        import lunar_tools as lt
         self.motive_receiver = motive_receiver
         self.label = label
         self.buffer_size = 100
@@ -194,16 +195,9 @@ if __name__ == "__main__":
     motive = MotiveReceiver(server_ip="10.40.49.47")
     
     print("Waiting for data connection...")
-    time.sleep(1)
-    
-    # Test basic connection first
-    print("Testing basic connection...")
-    for i in range(50):  # Try for 5 seconds
+    if motive.wait_until_ready(timeout=6.0):
         latest_data = motive.get_last()
-        if latest_data:
-            print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
-            break
-        time.sleep(0.1)
+        print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
     else:
         print("✗ No data received. Check OptiTrack connection.")
         motive.stop()
@@ -0,0 +1,552 @@
+# Compressed columnar archives of decoded frames, for long-term storage.
+#
+# Frames are grouped into chunks of chunk_frames frames. Inside a chunk every
+# value has its own column: frame numbers, receive times, and per rigid body
+# x, y, z, qx, qy, qz, qw, error and valid. Labeled markers are stored flat,
+# with a per frame count. Numeric columns are delta encoded (floats either
+# losslessly through their float32 bit patterns or quantized to a precision),
+# byte shuffled and compressed with zlib or lzma. Slowly changing values
+# leave mostly zero bytes after that, which compress very well.
+#
+# File layout, all integers little endian:
+#
+#   magic            8 bytes  b"NATARC\x00\x01"
+#   header length    uint32
+#   header           JSON (source recording header, chunk size, codec)
+#   chunks           until the end of the file, each one
+#       meta length      uint32   compressed (zlib) JSON column table
+#       data length      uint32   bytes of column data
+#       frame count      uint32
+#       reserved         uint32
+#       first frame      int64    smallest and largest frame number
+#       last frame       int64
+#       first time_ns    int64    earliest and latest receive time
+#       last time_ns     int64
+#       meta             meta length bytes
+#       data             data length bytes, the compressed columns
+#
+# The chunk headers let a reader skip chunks outside a frame or time range
+# without decompressing them, and read() decompresses only the requested
+# columns of the remaining ones.
+
+import itertools
+import json
+import lzma
+import mmap
+import operator
+import os
+import struct
+import time
+import zlib
+from array import array
+
+from .Recording import HeaderLength, RecordingReader
+
+MAGIC = b"NATARC\x00\x01"
+FILE_EXTENSION = ".natarc"
+
+ChunkHeader = struct.Struct( '<IIIxxxxqqqq' )
+
+CHUNK_FRAMES = 1024
+
+COMPRESSIONS = ("zlib", "lzma", "none")
+
+# Column encodings
+ENCODING_INT = "int"          # int64, delta encoded
+ENCODING_FLOAT32 = "float32"  # float32 bit patterns, delta encoded, lossless
+ENCODING_FLOAT64 = "float64"  # float64 bit patterns, delta encoded, lossless
+ENCODING_QUANTIZED = "quantized"  # round(value / scale), delta encoded
+ENCODING_UINT8 = "uint8"      # raw bytes
+
+RIGID_BODY_FIELDS = ("x", "y", "z", "qx", "qy", "qz", "qw", "error")
+LABELED_MARKER_FIELDS = ("x", "y", "z", "residual")
+
+
+def rigid_body_column(id_num, field):
+    """Column name of field (one of RIGID_BODY_FIELDS or "valid") of rigid body id_num"""
+    return "rigid_body/%d/%s" % (id_num, field)
+
+
+def _shuffle(data, width):
+    # byte planes: all first bytes, all second bytes, ...
+    return b"".join(data[i::width] for i in range(width))
+
+
+def _unshuffle(data, width):
+    out = bytearray(len(data))
+    count = len(data) // width
+    for i in range(width):
+        out[i::width] = data[i * count:(i + 1) * count]
+    return out
+
+
+def _delta_encode(values):
+    return array('q', map(operator.sub, values, itertools.chain((0,), values)))
+
+
+def _delta_decode(deltas):
+    return array('q', itertools.accumulate(deltas))
+
+
+def encode_column(values, encoding, scale=None):
+    """Bytes of the uncompressed column values"""
+    if encoding == ENCODING_UINT8:
+        return bytes(values)
+    if encoding == ENCODING_INT:
+        ints = values
+    elif encoding == ENCODING_FLOAT32:
+        ints = array('i', array('f', values).tobytes())
+    elif encoding == ENCODING_FLOAT64:
+        ints = array('q', array('d', values).tobytes())
+    elif encoding == ENCODING_QUANTIZED:
+        ints = list(map(round, map(operator.mul, values, itertools.repeat(1.0 / scale))))
+    else:
+        raise ValueError("unknown column encoding %r" % encoding)
+    return _shuffle(_delta_encode(ints).tobytes(), 8)
+
+
+def decode_column(data, encoding, scale=None):
+    """Values of a column from encode_column() bytes: array('q') for int,
+    array('f') for float32, array('d') for float64 and quantized, array('B') for uint8"""
+    if encoding == ENCODING_UINT8:
+        return array('B', data)
+    ints = _delta_decode(array('q', _unshuffle(data, 8)))
+    if encoding == ENCODING_INT:
+        return ints
+    if encoding == ENCODING_FLOAT32:
+        return array('f', array('i', ints).tobytes())
+    if encoding == ENCODING_FLOAT64:
+        return array('d', ints.tobytes())
+    if encoding == ENCODING_QUANTIZED:
+        return array('d', map(operator.mul, ints, itertools.repeat(scale)))
+    raise ValueError("unknown column encoding %r" % encoding)
+
+
+def _compress(data, compression, level):
+    if compression == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if compression == "lzma":
+        return lzma.compress(data, preset=6 if level is None else level)
+    return bytes(data)
+
+
+def _decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "lzma":
+        return lzma.decompress(data)
+    return bytes(data)
+
+
+class _RigidBodyColumns:
+    def __init__(self, frame_count):
+        # frames before the body first appeared in the chunk
+        self.values = [array('d', bytes(8 * frame_count)) for field in RIGID_BODY_FIELDS]
+        self.valid = bytearray(frame_count)
+
+    def pad(self, frame_count):
+        missing = frame_count - len(self.valid)
+        if missing > 0:
+            for column in self.values:
+                column.frombytes(bytes(8 * missing))
+            self.valid.extend(bytes(missing))
+
+
+class ArchiveWriter:
+    """Write decoded frames (MoCapData) to an archive at path.
+
+    precision quantizes positions, rotations, errors and residuals to
+    multiples of it (e.g. 1e-5 for 10 micrometers); None keeps the float32
+    values exactly. compression is "zlib", "lzma" or "none", level its
+    compression level. data_descriptions, when given, provide the rigid body
+    names stored with every chunk.
+    """
+    def __init__(self, path, header=None, chunk_frames=CHUNK_FRAMES, precision=None,
+                 compression="zlib", level=None, data_descriptions=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError("unknown compression %r" % compression)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.precision = precision
+        self.compression = compression
+        self.level = level
+        self.data_descriptions = data_descriptions
+        self.header = dict(header or {})
+        self.header.setdefault("created_time_ns", time.time_ns())
+        self.header["chunk_frames"] = chunk_frames
+        self.header["precision"] = precision
+        self.header["compression"] = compression
+
+        self.frames = 0
+        self.chunks = 0
+        self.bytes_in = 0
+        self.bytes_written = 0
+        self.__file = open(path, "wb")
+        header_bytes = json.dumps(self.header, sort_keys=True).encode("utf-8")
+        self.__file.write(MAGIC + HeaderLength.pack(len(header_bytes)) + header_bytes)
+        self.bytes_written = len(MAGIC) + HeaderLength.size + len(header_bytes)
+        self.__reset_chunk()
+
+    def __reset_chunk(self):
+        self.__frame_numbers = array('q')
+        self.__times_ns = array('q')
+        self.__timestamps = array('d')
+        self.__rigid_bodies = {}
+        self.__marker_counts = array('q')
+        self.__marker_ids = array('q')
+        self.__marker_values = [array('d') for field in LABELED_MARKER_FIELDS]
+
+    def add_frame(self, mocap_data, time_ns=None):
+        """Append a frame; time_ns defaults to its rx_timestamp_ns"""
+        if time_ns is None:
+            time_ns = mocap_data.rx_timestamp_ns
+        index = len(self.__frame_numbers)
+        self.__frame_numbers.append(mocap_data.prefix_data.frame_number)
+        self.__times_ns.append(time_ns if time_ns is not None else 0)
+        suffix_data = mocap_data.suffix_data
+        self.__timestamps.append(suffix_data.timestamp if suffix_data is not None else 0.0)
+
+        if mocap_data.rigid_body_data is not None:
+            for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+                columns = self.__rigid_bodies.get(rigid_body.id_num)
+                if columns is None:
+                    columns = self.__rigid_bodies[rigid_body.id_num] = _RigidBodyColumns(index)
+                else:
+                    columns.pad(index)
+                x, y, z, qx, qy, qz, qw, error = columns.values
+                pos = rigid_body.pos
+                rot = rigid_body.rot
+                x.append(pos[0])
+                y.append(pos[1])
+                z.append(pos[2])
+                qx.append(rot[0])
+                qy.append(rot[1])
+                qz.append(rot[2])
+                qw.append(rot[3])
+                error.append(rigid_body.error)
+                columns.valid.append(1 if rigid_body.tracking_valid else 0)
+
+        marker_count = 0
+        if mocap_data.labeled_marker_data is not None:
+            x, y, z, residual = self.__marker_values
+            for marker in mocap_data.labeled_marker_data.labeled_marker_list:
+                self.__marker_ids.append(marker.id_num)
+                pos = marker.pos
+                x.append(pos[0])
+                y.append(pos[1])
+                z.append(pos[2])
+                residual.append(marker.residual)
+                marker_count += 1
+        self.__marker_counts.append(marker_count)
+
+        self.frames += 1
+        if len(self.__frame_numbers) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """Write the frames added since the last chunk as a chunk"""
+        frame_count = len(self.__frame_numbers)
+        if frame_count == 0:
+            return
+        if self.precision is None:
+            float_encoding = ENCODING_FLOAT32
+        else:
+            float_encoding = ENCODING_QUANTIZED
+        columns = []
+        columns.append(("frame_number", ENCODING_INT, self.__frame_numbers))
+        columns.append(("time_ns", ENCODING_INT, self.__times_ns))
+        columns.append(("timestamp", ENCODING_FLOAT64, self.__timestamps))
+        names = {}
+        for id_num in sorted(self.__rigid_bodies):
+            body = self.__rigid_bodies[id_num]
+            body.pad(frame_count)
+            for field, values in zip(RIGID_BODY_FIELDS, body.values):
+                columns.append((rigid_body_column(id_num, field), float_encoding, values))
+            columns.append((rigid_body_column(id_num, "valid"), ENCODING_UINT8, body.valid))
+            if self.data_descriptions is not None:
+                name = self.data_descriptions.get_rigid_body_name(id_num)
+                if name is not None:
+                    names[str(id_num)] = name
+        columns.append(("labeled_marker/count", ENCODING_INT, self.__marker_counts))
+        columns.append(("labeled_marker/id", ENCODING_INT, self.__marker_ids))
+        for field, values in zip(LABELED_MARKER_FIELDS, self.__marker_values):
+            columns.append(("labeled_marker/" + field, float_encoding, values))
+
+        table = []
+        blobs = []
+        offset = 0
+        for name, encoding, values in columns:
+            raw = encode_column(values, encoding, self.precision)
+            blob = _compress(raw, self.compression, self.level)
+            entry = {"name": name, "encoding": encoding, "offset": offset,
+                     "length": len(blob), "count": len(values)}
+            if encoding == ENCODING_QUANTIZED:
+                entry["scale"] = self.precision
+            table.append(entry)
+            blobs.append(blob)
+            offset += len(blob)
+            self.bytes_in += len(raw)
+        meta = zlib.compress(json.dumps({"columns": table, "rigid_body_names": names}).encode("utf-8"))
+
+        times = [t for t in self.__times_ns if t != 0] or [0]
+        chunk_header = ChunkHeader.pack(len(meta), offset, frame_count,
+                                        min(self.__frame_numbers), max(self.__frame_numbers),
+                                        min(times), max(times))
+        self.__file.write(chunk_header)
+        self.__file.write(meta)
+        for blob in blobs:
+            self.__file.write(blob)
+        self.bytes_written += len(chunk_header) + len(meta) + offset
+        self.chunks += 1
+        self.__reset_chunk()
+
+    def close(self):
+        if self.__file is not None:
+            self.flush()
+            self.__file.close()
+            self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_stats(self):
+        stats = {}
+        stats["path"] = self.path
+        stats["frames"] = self.frames
+        stats["chunks"] = self.chunks
+        stats["bytes_written"] = self.bytes_written
+        stats["ratio"] = self.bytes_in / self.bytes_written if self.bytes_written else 0.0
+        return stats
+
+
+class ArchiveChunk:
+    """Header of one chunk: where it is and which frames and times it covers"""
+    def __init__(self, offset, meta_length, data_length, frame_count,
+                 first_frame, last_frame, first_time_ns, last_time_ns):
+        self.offset = offset
+        self.meta_length = meta_length
+        self.data_length = data_length
+        self.frame_count = frame_count
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.first_time_ns = first_time_ns
+        self.last_time_ns = last_time_ns
+        self.meta = None
+
+    def overlaps(self, first_frame, last_frame, first_time_ns, last_time_ns):
+        if first_frame is not None and self.last_frame < first_frame:
+            return False
+        if last_frame is not None and self.first_frame > last_frame:
+            return False
+        if first_time_ns is not None and self.last_time_ns < first_time_ns:
+            return False
+        if last_time_ns is not None and self.first_time_ns > last_time_ns:
+            return False
+        return True
+
+
+class ArchiveReader:
+    """Read columns of an archive written by ArchiveWriter.
+
+    read() skips the chunks outside the requested frame and time range by
+    their headers and decompresses only the requested columns of the others.
+    A chunk cut short by an interrupted write ends the archive.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError("not a NatNet archive")
+            header_length, = HeaderLength.unpack(f.read(HeaderLength.size))
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+            self.data_offset = f.tell()
+            self.file_size = os.fstat(f.fileno()).st_size
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+        self.compression = self.header.get("compression", "zlib")
+        # typecode of float columns as decoded
+        self.float_typecode = 'f' if self.header.get("precision") is None else 'd'
+
+        self.chunks = []
+        offset = self.data_offset
+        while offset + ChunkHeader.size <= self.file_size:
+            meta_length, data_length, frame_count, first_frame, last_frame, first_time_ns, last_time_ns = \
+                ChunkHeader.unpack_from(self.__view, offset)
+            if offset + ChunkHeader.size + meta_length + data_length > self.file_size:
+                break
+            self.chunks.append(ArchiveChunk(offset, meta_length, data_length, frame_count,
+                                            first_frame, last_frame, first_time_ns, last_time_ns))
+            offset += ChunkHeader.size + meta_length + data_length
+
+    def view(self, start, end):
+        """Raw bytes of the archive file from start to end, as a memoryview of the
+        mapping. Release it (or use it in a with statement) before close()."""
+        return self.__view[start:end]
+
+    def __len__(self):
+        """Number of frames"""
+        return sum(chunk.frame_count for chunk in self.chunks)
+
+    def __meta(self, chunk):
+        if chunk.meta is None:
+            start = chunk.offset + ChunkHeader.size
+            meta = json.loads(zlib.decompress(self.__view[start:start + chunk.meta_length]).decode("utf-8"))
+            meta["columns"] = {entry["name"]: entry for entry in meta["columns"]}
+            chunk.meta = meta
+        return chunk.meta
+
+    def __column(self, chunk, entry):
+        start = chunk.offset + ChunkHeader.size + chunk.meta_length + entry["offset"]
+        data = _decompress(self.__view[start:start + entry["length"]], self.compression)
+        return decode_column(data, entry["encoding"], entry.get("scale"))
+
+    def column_names(self):
+        """Names of all columns in any chunk, reads every chunk's column table"""
+        names = {}
+        for chunk in self.chunks:
+            for name in self.__meta(chunk)["columns"]:
+                names[name] = True
+        return list(names)
+
+    def rigid_body_names(self):
+        """Rigid body names by id, as far as they were known when writing"""
+        names = {}
+        for chunk in self.chunks:
+            for id_num, name in self.__meta(chunk)["rigid_body_names"].items():
+                names[int(id_num)] = name
+        return names
+
+    def read(self, columns, first_frame=None, last_frame=None, first_time_ns=None, last_time_ns=None):
+        """Values of the named columns for the frames in the given range (all
+        bounds inclusive, None for open), as a dictionary of arrays.
+
+        A name ending in "/" selects all columns starting with it, for example
+        "rigid_body/3/". Rigid body columns of chunks where the body does not
+        appear read as zero, with valid 0. Labeled marker columns other than
+        "labeled_marker/count" hold the markers of all selected frames one
+        after the other.
+        """
+        prefixes = [name for name in columns if name.endswith("/")]
+        if prefixes:
+            all_names = self.column_names()
+            expanded = [name for name in columns if not name.endswith("/")]
+            for prefix in prefixes:
+                expanded.extend(name for name in all_names if name.startswith(prefix) and name not in expanded)
+            columns = expanded
+        result = {}
+        for name in columns:
+            result[name] = None
+        for chunk in self.chunks:
+            if not chunk.overlaps(first_frame, last_frame, first_time_ns, last_time_ns):
+                continue
+            self.__read_chunk(chunk, result, first_frame, last_frame, first_time_ns, last_time_ns)
+        for name, values in result.items():
+            if values is None:
+                result[name] = array('q')
+        return result
+
+    def __read_chunk(self, chunk, result, first_frame, last_frame, first_time_ns, last_time_ns):
+        meta = self.__meta(chunk)
+        table = meta["columns"]
+        # rows of the chunk in range, None for all of them
+        rows = None
+        if ((first_frame is not None and chunk.first_frame < first_frame) or
+                (last_frame is not None and chunk.last_frame > last_frame) or
+                (first_time_ns is not None and chunk.first_time_ns < first_time_ns) or
+                (last_time_ns is not None and chunk.last_time_ns > last_time_ns)):
+            frame_numbers = self.__column(chunk, table["frame_number"])
+            times_ns = self.__column(chunk, table["time_ns"])
+            rows = [i for i in range(chunk.frame_count)
+                    if (first_frame is None or frame_numbers[i] >= first_frame) and
+                       (last_frame is None or frame_numbers[i] <= last_frame) and
+                       (first_time_ns is None or times_ns[i] >= first_time_ns) and
+                       (last_time_ns is None or times_ns[i] <= last_time_ns)]
+            if not rows:
+                return
+
+        marker_rows = None
+        for name in result:
+            entry = table.get(name)
+            if entry is None:
+                # a rigid body that does not appear in this chunk
+                count = chunk.frame_count if rows is None else len(rows)
+                if name.endswith("/valid"):
+                    values = array('B', bytes(count))
+                else:
+                    values = array(self.float_typecode, bytes(array(self.float_typecode).itemsize * count))
+            else:
+                values = self.__column(chunk, entry)
+                if rows is not None:
+                    if name.startswith("labeled_marker/") and name != "labeled_marker/count":
+                        if marker_rows is None:
+                            marker_rows = self.__marker_rows(chunk, table, rows)
+                        values = array(values.typecode, (values[i] for i in marker_rows))
+                    else:
+                        values = array(values.typecode, (values[i] for i in rows))
+            previous = result[name]
+            if previous is None:
+                result[name] = values
+            elif previous.typecode == values.typecode:
+                previous.extend(values)
+            else:
+                result[name] = array('d', itertools.chain(previous, values))
+
+    def __marker_rows(self, chunk, table, rows):
+        counts = self.__column(chunk, table["labeled_marker/count"])
+        starts = array('q', itertools.accumulate(itertools.chain((0,), counts)))
+        marker_rows = []
+        for i in rows:
+            marker_rows.extend(range(starts[i], starts[i + 1]))
+        return marker_rows
+
+    def close(self):
+        self.__view.release()
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def merge_archives(paths, path, header=None):
+    """Write the chunks of the archives at paths, in order, to a new archive
+    at path, with the header of the first one unless header is given. Lets
+    parts of a recording be converted in parallel. Returns the number of chunks."""
+    chunk_count = 0
+    with open(path, "wb") as out_file:
+        for i, part_path in enumerate(paths):
+            with ArchiveReader(part_path) as part:
+                if i == 0:
+                    if header is None:
+                        header = part.header
+                    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+                    out_file.write(MAGIC + HeaderLength.pack(len(header_bytes)) + header_bytes)
+                if not part.chunks:
+                    continue
+                last = part.chunks[-1]
+                end = last.offset + ChunkHeader.size + last.meta_length + last.data_length
+                with part.view(part.data_offset, end) as chunks:
+                    out_file.write(chunks)
+                chunk_count += len(part.chunks)
+    return chunk_count
+
+
+def convert_recording(recording_path, archive_path, chunk_frames=CHUNK_FRAMES, precision=None,
+                      compression="zlib", level=None):
+    """Decode the frames of a recording (see Recording.py) into an archive.
+    Returns the archive writer's get_stats()."""
+    with RecordingReader(recording_path) as reader:
+        frames = reader.frames()
+        header = {"source": os.path.basename(recording_path), "recording": reader.header}
+        with ArchiveWriter(archive_path, header, chunk_frames=chunk_frames, precision=precision,
+                           compression=compression, level=level,
+                           data_descriptions=frames.client.data_descriptions) as writer:
+            for i in range(len(frames)):
+                writer.add_frame(frames[i])
+        return writer.get_stats()
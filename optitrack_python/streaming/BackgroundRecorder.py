@@ -0,0 +1,228 @@
+# Write recordings from a dedicated thread.
+#
+# The receive threads only append the datagram and its receive times to a
+# queue; packing, writing, fsync and segment rotation happen on the writer
+# thread. The queue is bounded in bytes: when the disk cannot keep up, new
+# datagrams are dropped and counted instead of blocking the receive path.
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from .Recording import RecordingWriter, COMMAND_CHANNEL
+
+NAT_SERVERINFO = 1
+NAT_MODELDEF = 5
+
+# fsync policies
+FSYNC_NEVER = "never"        # leave it to the operating system
+FSYNC_SEGMENT = "segment"    # when a segment is closed
+FSYNC_INTERVAL = "interval"  # every fsync_interval seconds and when a segment is closed
+
+
+def segment_path(path, number):
+    """Path of segment number of the recording path, e.g. session.0003.natrec"""
+    root, extension = os.path.splitext(path)
+    return "%s.%04d%s" % (root, number, extension)
+
+
+class BackgroundRecorder:
+    """Record datagrams to path from a writer thread.
+
+    Without segment_bytes and segment_seconds everything goes to path. With
+    either, the recording is split into segments named by segment_path(),
+    each a complete recording that starts with the latest server info and
+    model definitions. The writer wakes up every batch_interval seconds and
+    writes all queued records in one go.
+    """
+    def __init__(self, path, header=None, segment_bytes=None, segment_seconds=None,
+                 fsync=FSYNC_SEGMENT, fsync_interval=1.0, max_queue_bytes=64*1024*1024,
+                 batch_interval=0.05):
+        if fsync not in (FSYNC_NEVER, FSYNC_SEGMENT, FSYNC_INTERVAL):
+            raise ValueError("unknown fsync policy %r" % fsync)
+        self.path = path
+        self.header = dict(header or {})
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_queue_bytes = max_queue_bytes
+        self.batch_interval = batch_interval
+
+        self.lock = threading.Lock()
+        self.__queue = deque()
+        self.__queue_bytes = 0
+        self.__wakeup = threading.Event()
+        self.__stop = False
+        self.__writer = None
+        self.__segment_number = 0
+        self.__segment_start_ns = None
+        self.__last_fsync = time.monotonic()
+        # latest server info and model definitions, repeated in every segment
+        self.__context = {}
+
+        self.error = None
+        self.records = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.max_queue_depth = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.segments = 0
+        self.fsyncs = 0
+        self.write_rate = 0.0
+        self.__rate_start = time.monotonic()
+        self.__rate_bytes = 0
+
+        self.writer_thread = threading.Thread(target=self.__writer_thread_function, daemon=True)
+        self.writer_thread.start()
+
+    def record(self, channel, data, time_ns=None, monotonic_ns=None):
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if time_ns is None:
+            time_ns = time.time_ns()
+        if not isinstance(data, bytes):
+            # a buffer that may change or go away before it is written
+            data = bytes(data)
+        size = len(data)
+        with self.lock:
+            self.records += 1
+            if self.__stop or self.error is not None or self.__queue_bytes + size > self.max_queue_bytes:
+                self.dropped += 1
+                self.dropped_bytes += size
+                return
+            self.__queue.append((channel, data, time_ns, monotonic_ns))
+            self.__queue_bytes += size
+            if len(self.__queue) > self.max_queue_depth:
+                self.max_queue_depth = len(self.__queue)
+
+    def __writer_thread_function(self):
+        try:
+            self.__next_segment(time.monotonic_ns())
+        except OSError as e:
+            self.error = e
+        while True:
+            self.__wakeup.wait(self.batch_interval)
+            self.__wakeup.clear()
+            with self.lock:
+                batch = self.__queue
+                self.__queue = deque()
+                self.__queue_bytes = 0
+                stop = self.__stop
+            try:
+                count = self.__write_batch(batch)
+            except OSError as e:
+                # disk full, removed directory, ...: drop everything from now on
+                with self.lock:
+                    self.error = e
+                count = self.__batch_count
+            if count < len(batch):
+                with self.lock:
+                    self.dropped += len(batch) - count
+                    self.dropped_bytes += sum(len(record[1]) for record in itertools.islice(batch, count, None))
+            if stop:
+                break
+        self.__close_segment()
+        return 0
+
+    def __write_batch(self, batch):
+        """Write the records of a batch, returns how many were handed to the
+        writer. After an OSError, __batch_count is the number handed to it before."""
+        self.__batch_count = 0
+        if self.error is not None:
+            return 0
+        written = 0
+        for channel, data, time_ns, monotonic_ns in batch:
+            if self.__segment_full(monotonic_ns):
+                self.__next_segment(monotonic_ns)
+            if channel == COMMAND_CHANNEL:
+                message_id = int.from_bytes(data[0:2], byteorder='little', signed=True)
+                if message_id in (NAT_SERVERINFO, NAT_MODELDEF):
+                    self.__context[message_id] = (channel, data, time_ns, monotonic_ns)
+            self.__writer.record(channel, data, time_ns, monotonic_ns)
+            self.__batch_count += 1
+            self.records_written += 1
+            self.bytes_written += len(data)
+            written += len(data)
+        if not batch:
+            return 0
+        # one large sequential write per batch
+        self.__writer.flush()
+        now = time.monotonic()
+        if self.fsync == FSYNC_INTERVAL and now - self.__last_fsync >= self.fsync_interval:
+            self.__writer.sync()
+            self.__last_fsync = now
+            self.fsyncs += 1
+        self.__rate_bytes += written
+        if now - self.__rate_start >= 1.0:
+            self.write_rate = self.__rate_bytes / (now - self.__rate_start)
+            self.__rate_start = now
+            self.__rate_bytes = 0
+        return len(batch)
+
+    def __segment_full(self, monotonic_ns):
+        if self.segment_bytes is not None and self.__writer.bytes_written >= self.segment_bytes:
+            return True
+        if self.segment_seconds is not None and monotonic_ns - self.__segment_start_ns >= self.segment_seconds * 1e9:
+            return True
+        return False
+
+    def current_path(self):
+        if self.segment_bytes is None and self.segment_seconds is None:
+            return self.path
+        return segment_path(self.path, self.__segment_number)
+
+    def __next_segment(self, monotonic_ns):
+        if self.__writer is not None:
+            self.__close_segment()
+            self.__segment_number += 1
+        header = dict(self.header)
+        if self.segment_bytes is not None or self.segment_seconds is not None:
+            header["segment"] = self.__segment_number
+        self.__writer = RecordingWriter(self.current_path(), header)
+        self.__segment_start_ns = monotonic_ns
+        self.segments += 1
+        for channel, data, time_ns, context_monotonic_ns in sorted(self.__context.values(), key=lambda record: record[3]):
+            self.__writer.record(channel, data, time_ns, context_monotonic_ns)
+
+    def __close_segment(self):
+        if self.__writer is None:
+            return
+        if self.fsync != FSYNC_NEVER:
+            self.__writer.sync()
+            self.fsyncs += 1
+        self.__writer.close()
+        self.__writer = None
+
+    def flush(self):
+        """Wake up the writer now instead of at the next batch_interval"""
+        self.__wakeup.set()
+
+    def close(self):
+        """Write what is queued, close the segment and stop the writer thread"""
+        with self.lock:
+            self.__stop = True
+        self.__wakeup.set()
+        if self.writer_thread is not threading.current_thread():
+            self.writer_thread.join()
+
+    def get_stats(self):
+        stats = {}
+        with self.lock:
+            stats["queue_depth"] = len(self.__queue)
+            stats["queue_bytes"] = self.__queue_bytes
+            stats["records"] = self.records
+            stats["dropped"] = self.dropped
+            stats["dropped_bytes"] = self.dropped_bytes
+        stats["path"] = self.current_path()
+        stats["max_queue_depth"] = self.max_queue_depth
+        stats["records_written"] = self.records_written
+        stats["bytes_written"] = self.bytes_written
+        stats["write_rate"] = self.write_rate
+        stats["segments"] = self.segments
+        stats["fsyncs"] = self.fsyncs
+        stats["error"] = None if self.error is None else str(self.error)
+        return stats
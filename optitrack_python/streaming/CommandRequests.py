@@ -0,0 +1,187 @@
+# Match NatNet command channel responses to the requests that caused them.
+#
+# NatNet responses carry no request id, but the server answers the requests of
+# one command socket in order. Each pending request therefore waits in a FIFO
+# for the message id of its response (NAT_SERVERINFO for NAT_CONNECT,
+# NAT_RESPONSE for NAT_REQUEST, ...) and the oldest one is resolved first.
+#
+# A retried request can be answered once per send: a late answer to the first
+# send and the answer to the resend both belong to it. Once a request leaves
+# the FIFO, the answers still expected for it are counted and the next ones
+# with its message id are discarded instead of resolving the following
+# request. Answers to sends that were lost never come, so these expectations
+# expire one timeout after the request left the FIFO. A cancelled request
+# leaves the FIFO at once and expects nothing: the caller gave up on it,
+# typically because its answer was lost.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+
+
+class PendingRequest:
+    def __init__(self, send_function, response_id, timeout, retries):
+        self.future = Future()
+        self.send_function = send_function
+        self.response_id = response_id
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.timer = None
+        # monotonic time of the last send, used for round trip times
+        self.sent_time = 0.0
+
+
+class RequestTracker:
+    """Pending command requests with per-request timeout and retries.
+
+    Futures resolve to the decoded response, fail with TimeoutError once all
+    retries timed out, or with RuntimeError if the server did not recognize
+    the request. Use asyncio.wrap_future() to await them from asyncio code.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        # response id -> deque of expiry times (monotonic) of answers still
+        # expected for requests that already left the FIFO
+        self.surplus = {}
+        # round trip time of the last answered request, in seconds
+        self.last_round_trip_time = None
+        # callback(response_id, round_trip_time) for every answered request
+        self.round_trip_listener = None
+
+    def submit(self, send_function, response_id, timeout=1.0, retries=2):
+        """Call send_function() now (and again on every retry) and return a Future
+        resolved by the next response with message id response_id."""
+        request = PendingRequest(send_function, response_id, timeout, retries)
+        with self.lock:
+            self.pending.setdefault(response_id, deque()).append(request)
+        request.future.add_done_callback(lambda future: self.__future_done(request))
+        self.__send(request)
+        return request.future
+
+    def __future_done(self, request):
+        if request.future.cancelled():
+            self.__remove(request, expected_answers=0)
+
+    def __send(self, request):
+        request.attempts += 1
+        request.sent_time = time.monotonic()
+        if request.timeout is not None:
+            request.timer = threading.Timer(request.timeout, self.__timed_out, args=(request,))
+            request.timer.daemon = True
+            request.timer.start()
+        try:
+            request.send_function()
+        except OSError as e:
+            # this send never left, the earlier ones may still be answered
+            if self.__remove(request, request.attempts - 1):
+                try:
+                    request.future.set_exception(e)
+                except InvalidStateError:
+                    pass
+
+    def __remove(self, request, expected_answers=None):
+        """Take a request out of the FIFO; expected_answers (default: one per send)
+        is the number of answers that may still arrive for it."""
+        if expected_answers is None:
+            expected_answers = request.attempts
+        with self.lock:
+            queue = self.pending.get(request.response_id)
+            if queue is None or request not in queue:
+                return False
+            queue.remove(request)
+            self.__expect_surplus(request, expected_answers)
+        if request.timer is not None:
+            request.timer.cancel()
+        return True
+
+    def __expect_surplus(self, request, count):
+        # called with the lock held
+        if count > 0 and request.timeout is not None:
+            expiry = time.monotonic() + request.timeout
+            self.surplus.setdefault(request.response_id, deque()).extend([expiry] * count)
+
+    def __take_surplus(self, response_id):
+        """True if an answer to response_id belongs to a request that already left the FIFO"""
+        with self.lock:
+            expected = self.surplus.get(response_id)
+            if not expected:
+                return False
+            now = time.monotonic()
+            while expected and expected[0] < now:
+                expected.popleft()
+            if not expected:
+                return False
+            expected.popleft()
+            return True
+
+    def __timed_out(self, request):
+        if request.future.done():
+            return
+        if request.attempts <= request.retries:
+            # keep the place in the queue, the server answers in order
+            self.__send(request)
+            return
+        if self.__remove(request):
+            try:
+                request.future.set_exception(TimeoutError(
+                    "no response to request after %d attempts" % request.attempts))
+            except InvalidStateError:
+                pass
+
+    def __pop_oldest(self, response_id):
+        if self.__take_surplus(response_id):
+            return None
+        with self.lock:
+            queue = self.pending.get(response_id)
+            if not queue:
+                return None
+            request = queue.popleft()
+            # the other sends of a retried request may be answered as well
+            self.__expect_surplus(request, request.attempts - 1)
+        if request.timer is not None:
+            request.timer.cancel()
+        return request
+
+    def has_pending(self, response_id):
+        with self.lock:
+            return len(self.pending.get(response_id, ())) > 0
+
+    def resolve(self, response_id, value):
+        """Resolve the oldest request waiting for response_id. Returns False if none was
+        waiting or the response answered another send of an earlier request."""
+        request = self.__pop_oldest(response_id)
+        if request is None:
+            return False
+        self.last_round_trip_time = time.monotonic() - request.sent_time
+        if self.round_trip_listener is not None:
+            self.round_trip_listener(response_id, self.last_round_trip_time)
+        try:
+            request.future.set_result(value)
+        except InvalidStateError:
+            # cancelled by a caller that stopped waiting
+            pass
+        return True
+
+    def reject(self, response_id, exception):
+        """Fail the oldest request waiting for response_id"""
+        request = self.__pop_oldest(response_id)
+        if request is None:
+            return False
+        try:
+            request.future.set_exception(exception)
+        except InvalidStateError:
+            pass
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            requests = [request for queue in self.pending.values() for request in queue]
+            self.pending = {}
+            self.surplus = {}
+        for request in requests:
+            if request.timer is not None:
+                request.timer.cancel()
+            request.future.cancel()
@@ -22,8 +22,6 @@
 
 
 import copy
-import hashlib
-import random
 
 K_SKIP = [0,0,1]
 K_FAIL = [0,1,0]
@@ -46,6 +44,7 @@ def add_lists(totals, totals_tmp):
 
 
 def test_hash(test_name, test_hash_str, test_object):
+    import hashlib
     out_str = test_object.get_as_string()
     out_hash_str=hashlib.sha1(out_str.encode()).hexdigest()
     ret_value=True
@@ -60,6 +59,7 @@ def test_hash(test_name, test_hash_str, test_object):
     return ret_value
 
 def test_hash2(test_name, test_hash_str, test_object, generator_string, run_test=True):
+    import hashlib
     ret_value = K_FAIL
     out_str = "FAIL"
     out_str2=""
@@ -483,6 +483,14 @@ class DataDescriptions():
         self.device_list=[]
         self.camera_list=[]
 
+        # Lookup indexes, kept up to date by the add_* methods
+        self.rigid_body_by_id={}
+        self.rigid_body_id_by_name={}
+        self.skeleton_by_id={}
+        self.skeleton_id_by_name={}
+        self.skeleton_bones_by_id={}
+        self.asset_by_id={}
+
     def generate_order_name(self):
         """Generate the name for the order list based on the current length of the list"""
         # should be a one up counter instead of based on length of data_order_dict
@@ -508,7 +516,10 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.rigid_body_list)
         self.data_order_dict[order_name]=("rigid_body_list", pos)
-        self.rigid_body_list.append(copy.deepcopy(new_rigid_body))
+        rigid_body = copy.deepcopy(new_rigid_body)
+        self.rigid_body_list.append(rigid_body)
+        self.rigid_body_by_id[rigid_body.id_num] = rigid_body
+        self.rigid_body_id_by_name[get_as_string(rigid_body.sz_name)] = rigid_body.id_num
 
 
     # Add a skeleton
@@ -519,7 +530,11 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.skeleton_list)
         self.data_order_dict[order_name]=("skeleton_list", pos)
-        self.skeleton_list.append(copy.deepcopy(new_skeleton))
+        skeleton = copy.deepcopy(new_skeleton)
+        self.skeleton_list.append(skeleton)
+        self.skeleton_by_id[skeleton.id_num] = skeleton
+        self.skeleton_id_by_name[get_as_string(skeleton.name)] = skeleton.id_num
+        self.skeleton_bones_by_id[skeleton.id_num] = {bone.id_num: bone for bone in skeleton.rigid_body_description_list}
 
 
     # Add an asset
@@ -530,7 +545,9 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.asset_list)
         self.data_order_dict[order_name]=("asset_list", pos)
-        self.asset_list.append(copy.deepcopy(new_asset))
+        asset = copy.deepcopy(new_asset)
+        self.asset_list.append(asset)
+        self.asset_by_id[asset.assetID] = asset
 
 
     # Add a force plate
@@ -585,6 +602,37 @@ class DataDescriptions():
         else:
             print("ERROR: Type %s unknown"%str(data_type))
 
+    def get_rigid_body_description(self, id_num):
+        """Rigid body description by streaming id, or None"""
+        return self.rigid_body_by_id.get(id_num)
+
+    def get_rigid_body_name(self, id_num):
+        """Rigid body name by streaming id, or None"""
+        rigid_body = self.rigid_body_by_id.get(id_num)
+        if rigid_body is None:
+            return None
+        return get_as_string(rigid_body.sz_name)
+
+    def get_rigid_body_id(self, name):
+        """Rigid body streaming id by name, or None"""
+        return self.rigid_body_id_by_name.get(get_as_string(name))
+
+    def get_skeleton_description(self, id_num):
+        """Skeleton description by id, or None"""
+        return self.skeleton_by_id.get(id_num)
+
+    def get_skeleton_id(self, name):
+        """Skeleton id by name, or None"""
+        return self.skeleton_id_by_name.get(get_as_string(name))
+
+    def get_skeleton_bones(self, id_num):
+        """Bone id -> bone RigidBodyDescription of a skeleton, empty if unknown"""
+        return self.skeleton_bones_by_id.get(id_num, {})
+
+    def get_asset_description(self, asset_id):
+        """Asset description by id, or None"""
+        return self.asset_by_id.get(asset_id)
+
     def get_object_from_list(self, list_name, pos_num):
         """Determine list name and position of the object"""
         ret_value = None
@@ -652,6 +700,47 @@ class DataDescriptions():
 
 # cDataDescriptions END
 
+def _named_ids(description_list, id_attr, name_attr):
+    """id -> name of every description in a list"""
+    out_dict={}
+    for description in description_list:
+        out_dict[getattr(description, id_attr)] = get_as_string(getattr(description, name_attr))
+    return out_dict
+
+def diff_data_descriptions(old_data_descs, new_data_descs):
+    """Compare two DataDescriptions by id.
+    Returns a dictionary with the keys rigid_bodies, skeletons and assets, each holding
+      added   : {id: name} of new objects
+      removed : {id: name} of objects that disappeared
+      renamed : {id: (old_name, new_name)}
+    old_data_descs may be None, then everything counts as added."""
+    kinds = [
+        ("rigid_bodies", "rigid_body_list", "id_num", "sz_name"),
+        ("skeletons",    "skeleton_list",   "id_num", "name"),
+        ("assets",       "asset_list",      "assetID", "name"),
+    ]
+    diff={}
+    for kind, list_name, id_attr, name_attr in kinds:
+        old_ids = {}
+        if old_data_descs is not None:
+            old_ids = _named_ids(getattr(old_data_descs, list_name), id_attr, name_attr)
+        new_ids = _named_ids(getattr(new_data_descs, list_name), id_attr, name_attr)
+        kind_diff={}
+        kind_diff["added"] = {id_num: name for id_num, name in new_ids.items() if id_num not in old_ids}
+        kind_diff["removed"] = {id_num: name for id_num, name in old_ids.items() if id_num not in new_ids}
+        kind_diff["renamed"] = {id_num: (old_ids[id_num], name) for id_num, name in new_ids.items()
+                                if id_num in old_ids and old_ids[id_num] != name}
+        diff[kind]=kind_diff
+    return diff
+
+def is_empty_diff(diff):
+    """True if diff_data_descriptions found no change"""
+    for kind_diff in diff.values():
+        for changes in kind_diff.values():
+            if len(changes) > 0:
+                return False
+    return True
+
 def generate_marker_set_description(set_num=0):
     """generate_marker_set_description - Testing functions"""
     marker_set_description = MarkerSetDescription()
@@ -704,6 +793,7 @@ def generate_skeleton_description(skeleton_num=0):
 
 def generate_force_plate_description(force_plate_num=0):
     """generate_force_plate_description - Generate Test ForcePlateDescription Data"""
+    import random
     fp_id=force_plate_num
     random.seed(force_plate_num)
 
@@ -0,0 +1,189 @@
+# Always-on flight recorder: the last seconds of raw datagrams in memory.
+#
+# Records are kept in the recording format (Recording.py) in one preallocated
+# byte ring, their start offsets in a preallocated array. Storing a datagram
+# packs its header and copies it into the ring; the oldest records are
+# overwritten when the ring or the array is full, so memory use is fixed.
+# A dump writes the records of the last `seconds` seconds to a normal
+# recording, preceded by the latest server info and model definitions.
+
+import os
+import threading
+import time
+from array import array
+
+from .Recording import RecordingWriter, RecordHeader, COMMAND_CHANNEL
+
+NAT_SERVERINFO = 1
+NAT_MODELDEF = 5
+
+
+class FlightRecorder:
+    """Keep the last seconds of datagrams in at most max_bytes of memory.
+
+    With a trigger_directory, trigger(reason) dumps the ring to a new
+    recording in that directory post_trigger_seconds later (so the recording
+    shows what happened after the trigger as well), at most once per
+    min_trigger_interval seconds. dump_listener(path, reason) is called after
+    every triggered dump.
+    """
+    def __init__(self, seconds=10.0, max_bytes=16*1024*1024, max_records=65536,
+                 trigger_directory=None, post_trigger_seconds=1.0, min_trigger_interval=10.0):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.trigger_directory = trigger_directory
+        self.post_trigger_seconds = post_trigger_seconds
+        self.min_trigger_interval = min_trigger_interval
+        self.dump_listener = None
+
+        self.lock = threading.Lock()
+        self.__buffer = bytearray(max_bytes)
+        self.__view = memoryview(self.__buffer)
+        # ring of record start offsets in __buffer, oldest at __first
+        self.__offsets = array('q', bytes(8 * max_records))
+        self.__first = 0
+        self.__count = 0
+        self.__write_position = 0
+        # latest server info and model definitions, needed to decode a dump
+        self.__context = {}
+        self.__trigger_timer = None
+        self.__last_trigger = -float("inf")
+        self.__closed = False
+
+        self.records = 0
+        self.overwritten = 0
+        self.too_large = 0
+        self.triggers = 0
+        self.dumps = 0
+
+    def record(self, channel, data, time_ns=None, monotonic_ns=None):
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if time_ns is None:
+            time_ns = time.time_ns()
+        length = len(data)
+        size = RecordHeader.size + length
+        if size > self.max_bytes:
+            self.too_large += 1
+            return
+        message_id = int.from_bytes(data[0:2], byteorder='little', signed=True)
+        if channel == COMMAND_CHANNEL and message_id in (NAT_SERVERINFO, NAT_MODELDEF):
+            # rare, kept outside the ring so they survive it
+            self.__context[message_id] = (channel, message_id, monotonic_ns, time_ns, bytes(data))
+        with self.lock:
+            position = self.__write_position
+            offsets = self.__offsets
+            if position + size > self.max_bytes:
+                # the end of the ring is too small: its records are the oldest
+                # ones, drop them and continue at the start
+                while self.__count > 0 and offsets[self.__first] >= position:
+                    self.__drop_oldest()
+                position = 0
+            end = position + size
+            # drop the oldest records the new one overwrites, or all slots are taken
+            while self.__count > 0 and (self.__count >= self.max_records or position <= offsets[self.__first] < end):
+                self.__drop_oldest()
+            RecordHeader.pack_into(self.__buffer, position, length, message_id, channel, monotonic_ns, time_ns)
+            self.__view[position + RecordHeader.size:end] = data
+            offsets[(self.__first + self.__count) % self.max_records] = position
+            self.__count += 1
+            self.__write_position = end
+            self.records += 1
+
+    def __drop_oldest(self):
+        self.__first = (self.__first + 1) % self.max_records
+        self.__count -= 1
+        self.overwritten += 1
+
+    def __snapshot(self, seconds):
+        """Copy of the records of the last seconds, oldest first"""
+        if seconds is None:
+            seconds = self.seconds
+        since_ns = time.monotonic_ns() - int(seconds * 1e9)
+        records = []
+        with self.lock:
+            view = self.__view
+            for i in range(self.__count):
+                offset = self.__offsets[(self.__first + i) % self.max_records]
+                length, message_id, channel, monotonic_ns, time_ns = RecordHeader.unpack_from(view, offset)
+                if monotonic_ns < since_ns:
+                    continue
+                start = offset + RecordHeader.size
+                records.append((channel, message_id, monotonic_ns, time_ns, bytes(view[start:start + length])))
+        return records
+
+    def dump(self, path, header=None, seconds=None):
+        """Write the records of the last seconds (default: all that are kept, up to
+        the configured seconds) to a recording at path. Returns the number of records."""
+        records = self.__snapshot(seconds)
+        header = dict(header or {})
+        header["flight_recorder"] = True
+        writer = RecordingWriter(path, header)
+        try:
+            first_ns = records[0][2] if records else None
+            for channel, message_id, monotonic_ns, time_ns, data in sorted(self.__context.values(), key=lambda record: record[2]):
+                # received earlier than the ring reaches back, or in it already
+                if first_ns is None or monotonic_ns < first_ns:
+                    writer.record(channel, data, time_ns, monotonic_ns)
+            for channel, message_id, monotonic_ns, time_ns, data in records:
+                writer.record(channel, data, time_ns, monotonic_ns)
+        finally:
+            writer.close()
+        self.dumps += 1
+        return len(records)
+
+    def trigger(self, reason, header=None):
+        """Dump the ring to trigger_directory soon, unless a dump is pending or the
+        last one was less than min_trigger_interval seconds ago. Never blocks."""
+        if self.trigger_directory is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            if self.__closed or self.__trigger_timer is not None or now - self.__last_trigger < self.min_trigger_interval:
+                return False
+            self.__last_trigger = now
+            self.triggers += 1
+            self.__trigger_timer = threading.Timer(self.post_trigger_seconds, self.__triggered_dump, args=(reason, header))
+            self.__trigger_timer.daemon = True
+            self.__trigger_timer.start()
+        return True
+
+    def __triggered_dump(self, reason, header):
+        with self.lock:
+            if self.__closed:
+                return
+        file_name = "flight_%s_%s.natrec" % (time.strftime("%Y%m%d-%H%M%S"), reason)
+        path = os.path.join(self.trigger_directory, file_name)
+        try:
+            os.makedirs(self.trigger_directory, exist_ok=True)
+            header = dict(header or {})
+            header["trigger"] = reason
+            self.dump(path, header)
+        except OSError:
+            path = None
+        finally:
+            with self.lock:
+                self.__trigger_timer = None
+        if path is not None and self.dump_listener is not None and not self.__closed:
+            self.dump_listener(path, reason)
+
+    def close(self):
+        """Cancel a pending triggered dump and ignore further triggers. dump() still works."""
+        with self.lock:
+            self.__closed = True
+            if self.__trigger_timer is not None:
+                self.__trigger_timer.cancel()
+                self.__trigger_timer = None
+
+    def get_stats(self):
+        stats = {}
+        with self.lock:
+            stats["records_kept"] = self.__count
+        stats["records"] = self.records
+        stats["overwritten"] = self.overwritten
+        stats["too_large"] = self.too_large
+        stats["triggers"] = self.triggers
+        stats["dumps"] = self.dumps
+        stats["max_bytes"] = self.max_bytes
+        return stats
@@ -0,0 +1,72 @@
+# Poll frame snapshots at a low, fixed rate with NAT_REQUEST_FRAMEOFDATA.
+#
+# Meant for consumers that need a few frames per second: combined with
+# NatNetClient.set_use_data_socket(False) nothing but the requested frames is
+# received or decoded.
+
+import threading
+import time
+
+
+class FramePoller:
+    """Call frame_callback(mocap_data) with a fresh frame rate times per second.
+
+    Only one request is outstanding at a time; a request that is not answered
+    within timeout seconds (default one period) is counted and skipped, and a
+    frame number that was already delivered is not delivered again.
+    """
+    def __init__(self, client, frame_callback, rate=5.0, timeout=None):
+        self.client = client
+        self.frame_callback = frame_callback
+        self.rate = rate
+        self.timeout = timeout
+
+        self.poll_thread = None
+        self.__stop = threading.Event()
+        self.__last_frame_number = None
+
+        self.polls = 0
+        self.frames = 0
+        self.timeouts = 0
+        self.duplicates = 0
+
+    def start(self):
+        self.__stop.clear()
+        self.poll_thread = threading.Thread(target=self.__poll_thread_function, daemon=True)
+        self.poll_thread.start()
+
+    def __poll_thread_function(self):
+        period = 1.0 / self.rate
+        timeout = self.timeout
+        if timeout is None:
+            timeout = period
+        next_poll = time.monotonic()
+        while not self.__stop.wait(max(next_poll - time.monotonic(), 0)):
+            next_poll = max(next_poll + period, time.monotonic())
+            self.polls += 1
+            mocap_data = self.client.fetch_frame(timeout)
+            if mocap_data is None:
+                self.timeouts += 1
+                continue
+            frame_number = mocap_data.prefix_data.frame_number
+            if frame_number == self.__last_frame_number:
+                self.duplicates += 1
+                continue
+            self.__last_frame_number = frame_number
+            self.frames += 1
+            self.frame_callback(mocap_data)
+        return 0
+
+    def get_stats(self):
+        stats = {}
+        stats["polls"] = self.polls
+        stats["frames"] = self.frames
+        stats["timeouts"] = self.timeouts
+        stats["duplicates"] = self.duplicates
+        return stats
+
+    def stop(self):
+        self.__stop.set()
+        if self.poll_thread is not None:
+            self.poll_thread.join(timeout=2.0)
+            self.poll_thread = None
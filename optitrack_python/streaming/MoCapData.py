@@ -23,8 +23,6 @@
 #Utility functions
 
 import copy
-import hashlib
-import random
 
 K_SKIP = [0,0,1]
 K_FAIL = [0,1,0]
@@ -46,6 +44,7 @@ def add_lists(totals, totals_tmp):
     return totals
 
 def test_hash(test_name, test_hash_str, test_object):
+    import hashlib
     out_str = test_object.get_as_string()
     out_hash_str=hashlib.sha1(out_str.encode()).hexdigest()
     ret_value=True
@@ -61,6 +60,7 @@ def test_hash(test_name, test_hash_str, test_object):
 
 
 def test_hash2(test_name, test_hash_str, test_object, generator_string, run_test):
+    import hashlib
     ret_value = K_FAIL
     out_str = "FAIL"
     out_str2=""
@@ -763,6 +763,8 @@ class MoCapData:
         self.force_plate_data = None
         self.device_data = None
         self.suffix_data = None
+        # Kernel receive time in ns since the epoch, None if not available
+        self.rx_timestamp_ns = None
 
     def set_prefix_data(self, new_prefix_data):
         self.prefix_data = new_prefix_data
@@ -861,6 +863,7 @@ def generate_label(label_base="label", label_num=0):
     return out_label
 
 def generate_position_srand(pos_num=0, frame_num=0):
+    import random
     random.seed(pos_num + (frame_num*1000))
     position=[(random.random()*100),(random.random()*100),(random.random()*100)]
     return position
@@ -896,6 +899,7 @@ def generate_marker_set_data(frame_num = 0, marker_set_num=0):
     return marker_set_data
 
 def generate_rigid_body_marker_srand(marker_num=0, frame_num = 0):
+    import random
     rigid_body_marker=RigidBodyMarker()
     rbm_num=11000+marker_num
     random.seed(rbm_num)
@@ -963,6 +967,7 @@ def generate_labeled_marker_data(frame_num = 0):
     return labeled_marker_data
 
 def generate_fp_channel_data(frame_num=0,fp_num=0, channel_num=0, num_frames =1):
+    import random
     rseed=(frame_num*100000)+(fp_num*10000)+(channel_num *1000)
     random.seed(rseed)
     fp_channel_data = ForcePlateChannelData()
@@ -988,6 +993,7 @@ def generate_force_plate_data(frame_num = 0):
     return force_plate_data
 
 def generate_device_channel_data(frame_num=0,device_num=0, channel_num=0, num_frames =1):
+    import random
     rseed=(frame_num*100000)+(device_num*10000)+(channel_num *1000)
     random.seed(rseed)
     device_channel_data = DeviceChannelData()
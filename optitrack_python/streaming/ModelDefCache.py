@@ -0,0 +1,80 @@
+# On-disk cache of NAT_MODELDEF datagrams.
+#
+# The raw datagram is stored rather than the decoded DataDescriptions, so cached
+# definitions are decoded by the same code as live ones and stay valid across
+# library versions. Files are named by the SHA-1 of their content and an index
+# points every server address to the last definition it sent, together with the
+# application name and versions the server reported at the time.
+
+import os
+
+DEFAULT_CACHE_DIRECTORY = os.path.join( os.path.expanduser("~"), ".cache", "optitrack_python", "modeldef" )
+
+INDEX_FILE_NAME = "index.json"
+
+
+def content_hash(data):
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+
+class ModelDefCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY):
+        self.directory = directory
+
+    def __index_path(self):
+        return os.path.join(self.directory, INDEX_FILE_NAME)
+
+    def __data_path(self, digest):
+        return os.path.join(self.directory, "%s.modeldef"% digest)
+
+    def __read_index(self):
+        import json
+        try:
+            with open(self.__index_path(), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __write_atomic(self, path, content, mode):
+        tmp_path = path + ".tmp%d"% os.getpid()
+        with open(tmp_path, mode) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def load(self, server_key):
+        """Return (entry, data) for the last definition stored for server_key, or (None, None).
+        entry holds application_name, server_version, nat_net_version and hash."""
+        entry = self.__read_index().get(server_key)
+        if entry is None:
+            return None, None
+        try:
+            with open(self.__data_path(entry["hash"]), "rb") as f:
+                data = f.read()
+        except (OSError, KeyError):
+            return None, None
+        # a truncated or foreign file must not be decoded
+        if content_hash(data) != entry["hash"]:
+            return None, None
+        return entry, data
+
+    def store(self, server_key, data, application_name, server_version, nat_net_version):
+        """Save a raw NAT_MODELDEF datagram as the current definition of server_key.
+        Returns the content hash."""
+        data = bytes(data)
+        digest = content_hash(data)
+        os.makedirs(self.directory, exist_ok=True)
+        data_path = self.__data_path(digest)
+        if not os.path.exists(data_path):
+            self.__write_atomic(data_path, data, "wb")
+        index = self.__read_index()
+        entry = {}
+        entry["application_name"] = application_name
+        entry["server_version"] = list(server_version)
+        entry["nat_net_version"] = list(nat_net_version)
+        entry["hash"] = digest
+        if index.get(server_key) != entry:
+            import json
+            index[server_key] = entry
+            self.__write_atomic(self.__index_path(), json.dumps(index, indent=2, sort_keys=True), "w")
+        return digest
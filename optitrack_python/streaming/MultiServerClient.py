@@ -0,0 +1,219 @@
+# Consume several Motive servers from one receive thread.
+#
+# Every server gets its own NatNetClient for configuration, decoding and
+# statistics, but none of them starts threads: a single selector loop reads all
+# data and command sockets and feeds the datagrams to the owning client.
+
+import selectors
+import socket
+import time
+from threading import Thread
+
+from .NatNetClient import NatNetClient
+
+DATA_CHANNEL = 0
+COMMAND_CHANNEL = 1
+
+
+class MultiServerClient:
+    """Receive frames from several Motive servers or multicast groups.
+
+    new_frame_listener(data_dict) is called for every frame of every server;
+    data_dict["source"] holds the name given to add_server().
+
+    merged_frame_listener(frames) is called with a dictionary source -> data_dict
+    whenever every server has a frame and those frames lie within
+    merge_tolerance seconds of each other. Frames are aligned by receive time
+    (kernel time when available) unless align_by is "timestamp", which uses the
+    Motive timestamps and only makes sense for synchronized servers.
+
+    A socket that fails (closed, network down, ...) is taken out of the receive
+    loop and tried again after reconnect_backoff seconds, doubling up to
+    reconnect_backoff_max; socket_error_listener(source, channel, error) is
+    called for every failure and get_stats() counts them as socket_errors.
+    """
+    def __init__(self):
+        self.new_frame_listener = None
+        self.merged_frame_listener = None
+        self.merge_tolerance = 0.005
+        self.align_by = "receive_time"
+        self.socket_error_listener = None
+        self.reconnect_backoff = 0.5
+        self.reconnect_backoff_max = 10.0
+
+        self.clients = {}
+        self.selector = None
+        self.receive_thread = None
+        self.stop_threads = False
+
+        # latest unmatched frame of every source, waiting for the merge
+        self.__pending = {}
+        # failed socket -> [retry time, backoff, selector data]
+        self.__failed_sockets = {}
+        self.__socket_errors = {}
+
+    def add_server(self, name, server_ip_address, local_ip_address="0.0.0.0",
+                   multicast_address="239.255.42.99", use_multicast=True,
+                   command_port=1510, data_port=1511):
+        """Add a server before run(). Returns its NatNetClient for further configuration."""
+        client = NatNetClient()
+        client.set_server_address(server_ip_address)
+        client.set_client_address(local_ip_address)
+        client.set_multicast_address(multicast_address)
+        client.set_use_multicast(use_multicast)
+        client.set_command_port(command_port)
+        client.set_data_port(data_port)
+        client.new_frame_listener = lambda data_dict: self.__receive_frame(name, data_dict)
+        self.clients[name] = client
+        self.__socket_errors[name] = 0
+        return client
+
+    def get_client(self, name):
+        return self.clients[name]
+
+    def get_stats(self):
+        stats = {}
+        for name, client in self.clients.items():
+            stats[name] = client.get_stats()
+            stats[name]["socket_errors"] = self.__socket_errors[name]
+        return stats
+
+    def run(self):
+        self.selector = selectors.DefaultSelector()
+        for name, client in self.clients.items():
+            if not client.open_sockets():
+                self.shutdown()
+                return False
+            client.start_processing()
+            try:
+                if client.use_data_socket:
+                    self.selector.register(client.data_socket, selectors.EVENT_READ, (name, client, DATA_CHANNEL))
+                self.selector.register(client.command_socket, selectors.EVENT_READ, (name, client, COMMAND_CHANNEL))
+            except (OSError, ValueError):
+                # closes the sockets opened so far
+                self.shutdown()
+                raise
+
+        self.stop_threads = False
+        self.receive_thread = Thread(target=self.__receive_thread_function)
+        self.receive_thread.start()
+
+        for client in self.clients.values():
+            client.send_connect()
+        return True
+
+    def __receive_thread_function(self):
+        last_service = time.monotonic()
+        while not self.stop_threads:
+            try:
+                events = self.selector.select(timeout=0.5)
+            except (OSError, ValueError):
+                # selector closed by shutdown()
+                break
+            for key, mask in events:
+                name, client, channel = key.data
+                try:
+                    data, rx_timestamp_ns = client.receive_datagram(key.fileobj)
+                except (socket.timeout, BlockingIOError):
+                    continue
+                except OSError as e:
+                    if self.stop_threads:
+                        return 0
+                    # select keeps reporting a failed socket, don't spin on it
+                    self.__socket_failed(key, e)
+                    continue
+                if key.fileobj in self.__failed_sockets:
+                    # received again after a retry
+                    del self.__failed_sockets[key.fileobj]
+                if len(data) == 0:
+                    continue
+                if channel == COMMAND_CHANNEL:
+                    client.process_command_datagram(data)
+                else:
+                    client.process_datagram(data, rx_timestamp_ns)
+
+            # keep alives, stall detection and reconnects of every client,
+            # see NatNetClient.service_session()
+            now = time.monotonic()
+            if now - last_service >= 0.1:
+                last_service = now
+                for client in self.clients.values():
+                    client.service_session(now)
+                self.__retry_failed_sockets(now)
+        return 0
+
+    def __socket_failed(self, key, error):
+        name, client, channel = key.data
+        try:
+            self.selector.unregister(key.fileobj)
+        except (KeyError, ValueError):
+            pass
+        failed = self.__failed_sockets.get(key.fileobj)
+        if failed is None:
+            backoff = self.reconnect_backoff
+        else:
+            backoff = min(failed[1] * 2, self.reconnect_backoff_max)
+        self.__failed_sockets[key.fileobj] = [time.monotonic() + backoff, backoff, key.data]
+        self.__socket_errors[name] += 1
+        if self.socket_error_listener is not None:
+            self.socket_error_listener(name, channel, error)
+
+    def __retry_failed_sockets(self, now):
+        for sock, failed in list(self.__failed_sockets.items()):
+            retry_time, backoff, data = failed
+            if now < retry_time:
+                continue
+            if sock.fileno() < 0:
+                # closed for good, nothing to retry
+                del self.__failed_sockets[sock]
+                continue
+            # stays in __failed_sockets until it receives, so that the next
+            # failure doubles the backoff
+            failed[0] = float("inf")
+            try:
+                self.selector.register(sock, selectors.EVENT_READ, data)
+            except (KeyError, OSError, ValueError):
+                del self.__failed_sockets[sock]
+
+    def __receive_frame(self, name, data_dict):
+        data_dict["source"] = name
+        if self.new_frame_listener is not None:
+            self.new_frame_listener(data_dict)
+        if self.merged_frame_listener is not None:
+            self.__merge_frame(name, data_dict)
+
+    def __alignment_time(self, data_dict):
+        if self.align_by == "timestamp":
+            return data_dict["timestamp"]
+        rx_timestamp_ns = data_dict.get("rx_timestamp_ns")
+        if rx_timestamp_ns is None:
+            rx_timestamp_ns = time.time_ns()
+            data_dict["rx_timestamp_ns"] = rx_timestamp_ns
+        return rx_timestamp_ns * 1e-9
+
+    # Greedy alignment: keep the newest frame per source; once all sources have
+    # one, emit them if they are close enough, otherwise drop the oldest, since
+    # later frames of the other sources can only be further away from it.
+    def __merge_frame(self, name, data_dict):
+        pending = self.__pending
+        pending[name] = (self.__alignment_time(data_dict), data_dict)
+        while len(pending) == len(self.clients):
+            times = [entry[0] for entry in pending.values()]
+            if max(times) - min(times) <= self.merge_tolerance:
+                frames = {source: entry[1] for source, entry in pending.items()}
+                pending.clear()
+                self.merged_frame_listener(frames)
+                break
+            oldest = min(pending, key=lambda source: pending[source][0])
+            del pending[oldest]
+
+    def shutdown(self):
+        self.stop_threads = True
+        if self.receive_thread is not None:
+            self.receive_thread.join(timeout=2.0)
+            self.receive_thread = None
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        for client in self.clients.values():
+            client.shutdown()
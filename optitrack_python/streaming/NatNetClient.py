@@ -16,13 +16,23 @@
 # OptiTrack NatNet direct depacketization library for Python 3.x
 
 import sys
+import importlib
 import socket
 import struct
+import queue
+import threading
+from array import array
 from threading import Thread
 import copy
 import time
-from . import DataDescriptions
-from . import MoCapData
+from .ModelDefCache import ModelDefCache, DEFAULT_CACHE_DIRECTORY, content_hash
+from .Recording import DATA_CHANNEL, COMMAND_CHANNEL
+from .BackgroundRecorder import BackgroundRecorder, FSYNC_SEGMENT
+
+# Bound through importlib: the package re-exports the DataDescriptions and MoCapData
+# classes under their module names, so "from . import" could return the class
+DataDescriptions = importlib.import_module( ".DataDescriptions", __package__ )
+MoCapData = importlib.import_module( ".MoCapData", __package__ )
 
 def trace( *args ):
     # uncomment the one you want to use
@@ -56,6 +66,17 @@ NNIntValue = struct.Struct( '<I')
 FPCalMatrixRow = struct.Struct( '<ffffffffffff' )
 FPCorners      = struct.Struct( '<ffffffffffff')
 
+# Linux socket options that are not exposed by every Python build.
+SO_BUSY_POLL    = getattr( socket, "SO_BUSY_POLL", 46 )
+SO_TIMESTAMPNS  = getattr( socket, "SO_TIMESTAMPNS", 35 )
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+SO_RXQ_OVFL     = getattr( socket, "SO_RXQ_OVFL", 40 )
+IP_MULTICAST_ALL = getattr( socket, "IP_MULTICAST_ALL", 49 )
+# struct timespec as delivered in SCM_TIMESTAMPNS ancillary data
+TimeSpec = struct.Struct( '@ll' )
+# SO_RXQ_OVFL ancillary data: cumulative count of datagrams dropped by the socket
+DropCount = struct.Struct( '@I' )
+
 class NatNetClient:
     # print_level = 0 off
     # print_level = 1 on
@@ -80,10 +101,56 @@ class NatNetClient:
 
         self.use_multicast = True
 
+        # Without the data socket no stream is received, frames are only
+        # fetched on demand with fetch_frame()
+        self.use_data_socket = True
+
+        # Data socket tuning, applied when the data socket is created.
+        # None leaves the operating system default in place.
+        self.receive_buffer_size = None
+        self.busy_poll_usec = None
+        self.use_kernel_timestamps = False
+
+        # Receive buffer size the kernel actually granted (Linux reports double the requested value)
+        self.receive_buffer_size_granted = None
+
+        # Number of worker processes decoding frames, 0 decodes on the data thread
+        self.decode_processes = 0
+        self.decode_process_options = {}
+        self.__process_decoder = None
+
+        # Number of threads decoding frames in parallel, 0 decodes on the data thread.
+        # Only worthwhile on free-threaded (no GIL) Python builds.
+        self.decode_threads = 0
+        self.decode_queue_size = 64
+        self.__decode_queue = None
+        self.__decode_thread_list = []
+        self.__delivery_lock = threading.Lock()
+        # the thread handing frames to the listeners, None while nobody does
+        self.__delivering_thread = None
+        self.__decoded_frames = {}
+        self.__next_decode_sequence = 0
+        self.__next_delivery_sequence = 0
+
         # Set this to a callback method of your choice to receive per-rigid-body data at each frame.
         self.rigid_body_listener = None
         self.new_frame_listener  = None
 
+        # Set this to a callback method of your choice to receive all rigid bodies of a frame
+        # in a single call, once the frame has been fully decoded. See __build_rigid_body_batch.
+        self.rigid_body_batch_listener = None
+
+        # Set this to a callback method of your choice to receive columnar frames
+        # when decoding in worker processes, see set_decode_processes().
+        self.columnar_frame_listener = None
+
+        # Per-client copy of the class default, so set_print_level() never touches other clients
+        self.print_level = NatNetClient.print_level
+
+        # Guards the server/version state below, which is written by the command thread
+        # and read by the data and decode threads (required on free-threaded builds).
+        self.__version_lock = threading.RLock()
+
         # Set Application Name
         self.__application_name = "Not Set"
 
@@ -111,6 +178,97 @@ class NatNetClient:
 
         self.stop_threads=False
 
+        # Default timeout in seconds and number of resends for command requests,
+        # see send_request_async()
+        self.command_timeout = 1.0
+        self.command_retries = 2
+        # concurrent.futures is imported here, not at module level, to keep the import fast
+        from .CommandRequests import RequestTracker
+        self.__requests = RequestTracker()
+        self.__requests.round_trip_listener = self.__record_round_trip
+
+        # Connection supervisor, see get_connection_state(). The connection counts as
+        # stalled when no frame arrived for stall_timeout seconds. Without data socket
+        # no frames are streamed, and it counts as stalled when a command request
+        # (a fetch_frame() or any other) stayed unanswered for stall_timeout seconds;
+        # an idle client is not stalled. Reconnect attempts then follow after reconnect_backoff
+        # seconds, doubling up to reconnect_backoff_max. Unicast servers additionally
+        # get a keep alive every keep_alive_interval seconds.
+        self.keep_alive_interval = 1.0
+        self.stall_timeout = 3.0
+        self.reconnect_backoff = 0.5
+        self.reconnect_backoff_max = 10.0
+        # Receive threads wake up this often to notice shutdown()
+        self.receive_timeout = 0.25
+        self.supervisor_thread = None
+        self.__session_stop = threading.Event()
+        self.__session_lock = threading.Lock()
+        self.__session_stats = {}
+        self.__last_server_message = time.monotonic()
+        self.__last_frame_datagram = time.monotonic()
+        # first command request sent since the last server message, or None
+        self.__first_unanswered_request = None
+        self.__next_keep_alive = 0.0
+        self.__next_reconnect_attempt = 0.0
+        self.__current_backoff = self.reconnect_backoff
+        self.__connection_state = self.STATE_DISCONNECTED
+        self.reset_session_stats()
+
+        # Set this to a callback method of your choice to be told about connection
+        # state changes, called as connection_state_listener(old_state, new_state).
+        self.connection_state_listener = None
+
+        # Latest model definitions and where they came from ("cache" or "server"),
+        # see set_model_def_cache()
+        self.data_descriptions = None
+        self.data_descriptions_source = None
+        self.data_descriptions_hash = None
+        self.__model_def_cache = None
+        # index entry of the definitions loaded from the cache, checked against
+        # the server info once it arrives
+        self.__cached_model_def_entry = None
+
+        # Request new model definitions when a frame reports tracked_models_changed,
+        # at most once per model_def_refresh_interval seconds.
+        self.auto_refresh_model_def = True
+        self.model_def_refresh_interval = 1.0
+        self.__model_def_refresh_lock = threading.Lock()
+        self.__model_def_refresh_timer = None
+        self.__last_model_def_refresh = -float("inf")
+
+        # Set this to a callback method of your choice to be told which rigid bodies,
+        # skeletons and assets were added, removed or renamed when new model
+        # definitions arrive. See __set_data_descriptions.
+        self.model_changed_listener = None
+
+        # Raw datagram recorder, see set_record_streaming(), and recording replay,
+        # see set_mock_streaming()
+        self.__recorder = None
+        self.__replay = None
+
+        # Flight recorder ring, see set_flight_recorder(). Set flight_recorder_listener
+        # to a callback method of your choice to be told about triggered dumps.
+        self.__flight_recorder = None
+        self.__trigger_on_frame_gap = False
+        self.__trigger_on_tracking_lost = False
+        self.__tracking_valid = {}
+        self.flight_recorder_listener = None
+
+        # Set by the first decoded frame, see wait_until_ready()
+        self.__first_frame_event = threading.Event()
+        self.__connect_timings = {}
+
+        self.__kernel_timestamps_enabled = False
+        self.__rxq_ovfl_enabled = False
+        # raw SO_RXQ_OVFL value of the current socket and the total carried over from earlier sockets
+        self.__kernel_drop_raw = 0
+        self.__kernel_drop_base = 0
+
+        # Receive statistics, see get_stats()
+        self.__stats_lock = threading.Lock()
+        self.__stats = {}
+        self.reset_stats()
+
 
     # Client/server message ids
     NAT_CONNECT               = 0
@@ -127,6 +285,21 @@ class NatNetClient:
     NAT_UNRECOGNIZED_REQUEST  = 100
     NAT_UNDEFINED             = 999999.9999
 
+    # Connection states reported by get_connection_state()
+    STATE_DISCONNECTED        = "disconnected"
+    STATE_CONNECTING          = "connecting"
+    STATE_STREAMING           = "streaming"
+    STATE_STALLED             = "stalled"
+    STATE_RECONNECTING        = "reconnecting"
+
+    # Message id the server answers each request type with
+    RESPONSE_IDS = {
+        NAT_CONNECT               : NAT_SERVERINFO,
+        NAT_REQUEST               : NAT_RESPONSE,
+        NAT_REQUEST_MODELDEF      : NAT_MODELDEF,
+        NAT_REQUEST_FRAMEOFDATA   : NAT_FRAMEOFDATA,
+    }
+
 
     def set_client_address(self, local_ip_address):
         if not self.__is_locked:
@@ -147,48 +320,305 @@ class NatNetClient:
         if not self.__is_locked:
             self.use_multicast = use_multicast
 
+    def set_use_data_socket(self, use_data_socket):
+        if not self.__is_locked:
+            self.use_data_socket = use_data_socket
+
+    def set_multicast_address(self, multicast_address):
+        if not self.__is_locked:
+            self.multicast_address = multicast_address
+
+    def get_multicast_address(self):
+        return self.multicast_address
+
+    def set_command_port(self, command_port):
+        if not self.__is_locked:
+            self.command_port = command_port
+
+    def set_data_port(self, data_port):
+        if not self.__is_locked:
+            self.data_port = data_port
+
+    def get_data_port(self):
+        return self.data_port
+
+    def set_receive_buffer_size(self, receive_buffer_size):
+        """request SO_RCVBUF in bytes for the data socket"""
+        if not self.__is_locked:
+            self.receive_buffer_size = receive_buffer_size
+
+    def get_receive_buffer_size_granted(self):
+        return self.receive_buffer_size_granted
+
+    def set_busy_poll(self, busy_poll_usec):
+        """set SO_BUSY_POLL in microseconds for the data socket (Linux only)"""
+        if not self.__is_locked:
+            self.busy_poll_usec = busy_poll_usec
+
+    def set_use_kernel_timestamps(self, use_kernel_timestamps):
+        """stamp each received frame with the kernel receive time (SO_TIMESTAMPNS, Linux only)"""
+        if not self.__is_locked:
+            self.use_kernel_timestamps = use_kernel_timestamps
+
+    def set_decode_processes(self, num_processes, max_rigid_bodies=256, max_labeled_markers=2048):
+        """Decode frames in num_processes worker processes through shared memory.
+        Frames are then delivered in receive order to columnar_frame_listener
+        (and rigid_body_batch_listener) as flat arrays; new_frame_listener and
+        rigid_body_listener are not called for them."""
+        if not self.__is_locked:
+            self.decode_processes = num_processes
+            self.decode_process_options = {"max_rigid_bodies": max_rigid_bodies,
+                                           "max_labeled_markers": max_labeled_markers}
+
+    def set_decode_threads(self, num_threads, queue_size=64):
+        """Decode frames on num_threads threads in parallel. Listeners are still
+        called one frame at a time, in the order the frames were received.
+        Frames arriving while queue_size frames wait for decoding are dropped
+        and counted in get_stats()["decode_queue_dropped"], frames that fail
+        to decode in get_stats()["decode_errors"]."""
+        if not self.__is_locked:
+            self.decode_threads = num_threads
+            self.decode_queue_size = queue_size
+
+    def set_model_def_cache(self, directory=DEFAULT_CACHE_DIRECTORY):
+        """Persist model definitions in directory. On the next start data_descriptions
+        is loaded from there before the server answers, then replaced by the server's
+        definitions once they arrive. None disables the cache."""
+        if not self.__is_locked:
+            if directory is None:
+                self.__model_def_cache = None
+            else:
+                self.__model_def_cache = ModelDefCache( directory )
+
+    def set_record_streaming(self, fn_mock=None, segment_bytes=None, segment_seconds=None,
+                             fsync=FSYNC_SEGMENT, max_queue_bytes=64*1024*1024):
+        """Append every received data and command datagram to the recording file
+        fn_mock (see Recording.py for the format). None stops recording, so
+        does shutdown(). Can be called before run() or on a running client.
+
+        Writing happens on a background thread (see BackgroundRecorder.py);
+        when more than max_queue_bytes are waiting for the disk, datagrams are
+        dropped from the recording and counted. segment_bytes and
+        segment_seconds split the recording into self contained segment files
+        (session.natrec -> session.0000.natrec, ...). fsync is "never",
+        "segment" or "interval"."""
+        if self.__recorder is not None:
+            self.__recorder.close()
+            self.__recorder = None
+        if fn_mock is None:
+            return
+        self.__recorder = BackgroundRecorder( fn_mock, self.__recording_header(),
+                                              segment_bytes=segment_bytes,
+                                              segment_seconds=segment_seconds,
+                                              fsync=fsync, max_queue_bytes=max_queue_bytes )
+        if self.command_socket is not None:
+            # make the recording self contained: server info and model definitions
+            self.send_request_async( self.NAT_CONNECT )
+            self.request_model_definitions_async()
+
+    def __recording_header(self):
+        header = {}
+        header["server_address"] = self.server_ip_address
+        header["local_address"] = self.local_ip_address
+        header["multicast_address"] = self.multicast_address
+        header["use_multicast"] = self.use_multicast
+        header["command_port"] = self.command_port
+        header["data_port"] = self.data_port
+        header["application_name"] = self.get_application_name()
+        header["server_version"] = self.get_server_version()
+        header["nat_net_version"] = self.get_nat_net_version_server()
+        return header
+
+    def set_flight_recorder(self, seconds=10.0, max_bytes=16*1024*1024, trigger_directory=None,
+                            trigger_on_frame_gap=True, trigger_on_tracking_lost=True):
+        """Keep the datagrams of the last seconds in a ring of max_bytes, see
+        dump_flight_recorder(). With a trigger_directory the ring is also dumped
+        there when frames go missing or a rigid body loses tracking, and
+        flight_recorder_listener(path, reason) is called. None disables it."""
+        # a pending triggered dump of the old ring must not fire anymore
+        if self.__flight_recorder is not None:
+            self.__flight_recorder.close()
+        if seconds is None:
+            self.__flight_recorder = None
+            return
+        from .FlightRecorder import FlightRecorder
+        flight_recorder = FlightRecorder( seconds, max_bytes, trigger_directory=trigger_directory )
+        flight_recorder.dump_listener = self.__on_flight_recorder_dump
+        self.__trigger_on_frame_gap = trigger_on_frame_gap
+        self.__trigger_on_tracking_lost = trigger_on_tracking_lost
+        self.__tracking_valid = {}
+        self.__flight_recorder = flight_recorder
+
+    def dump_flight_recorder(self, path, seconds=None):
+        """Write the flight recorder ring (or its last seconds) to a recording at
+        path, while the stream goes on. Returns the number of datagrams written."""
+        if self.__flight_recorder is None:
+            raise RuntimeError("flight recorder not enabled, see set_flight_recorder()")
+        return self.__flight_recorder.dump( path, self.__recording_header(), seconds )
+
+    def get_flight_recorder_stats(self):
+        if self.__flight_recorder is None:
+            return None
+        return self.__flight_recorder.get_stats()
+
+    def __trigger_flight_recorder(self, reason):
+        self.__flight_recorder.trigger( reason, self.__recording_header() )
+
+    def __on_flight_recorder_dump(self, path, reason):
+        trace( "Flight recorder dumped to %s (%s)"% (path, reason) )
+        if self.flight_recorder_listener is not None:
+            self.flight_recorder_listener( path, reason )
+
+    # Trigger the flight recorder when a rigid body goes from tracked to not tracked
+    def __check_tracking_lost(self, mocap_data):
+        tracking_valid = self.__tracking_valid
+        lost = False
+        for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+            if tracking_valid.get( rigid_body.id_num, False ) and not rigid_body.tracking_valid:
+                lost = True
+            tracking_valid[rigid_body.id_num] = rigid_body.tracking_valid
+        if lost:
+            self.__trigger_flight_recorder( "tracking_lost" )
+
+    def set_mock_streaming(self, fn_mock=None, speed=1.0, loop=False, first_frame=None, last_frame=None, start_time=None):
+        """Replay the recording fn_mock instead of connecting to a server: run()
+        then opens no sockets and feeds the recorded datagrams through the
+        normal decode path. speed 1.0 is real time, 0 as fast as possible.
+        See RecordingReplay for the other options. None goes back to live data."""
+        if not self.__is_locked:
+            if fn_mock is None:
+                self.__replay = None
+            else:
+                from .RecordingReplay import RecordingReplay
+                self.__replay = RecordingReplay( self, fn_mock, speed=speed, loop=loop,
+                                                 first_frame=first_frame, last_frame=last_frame,
+                                                 start_time=start_time )
+
+    def get_replay(self):
+        """The RecordingReplay set up by set_mock_streaming() (for wait() and get_stats()), or None"""
+        return self.__replay
+
+    def get_recording_stats(self):
+        """Queue depth, dropped records, bytes written and write rate of the
+        current recording, or None"""
+        if self.__recorder is None:
+            return None
+        return self.__recorder.get_stats()
+
+    def __model_def_cache_key(self):
+        return "%s:%d"% (self.server_ip_address, self.command_port)
+
+    def __load_cached_model_def(self):
+        entry, data = self.__model_def_cache.load( self.__model_def_cache_key() )
+        if data is None:
+            return False
+        major, minor = entry["nat_net_version"][0], entry["nat_net_version"][1]
+        try:
+            data_descs = self.unpack_data_descriptions( data, major, minor )
+        except Exception:
+            # written by an incompatible server or library, the server will resend it
+            return False
+        self.__set_data_descriptions( data_descs, "cache", entry["hash"] )
+        self.__cached_model_def_entry = entry
+        return True
+
+    # The cache is keyed by server address only: another Motive version or
+    # application on the same host must not keep its predecessor's definitions.
+    def __check_cached_model_def(self):
+        entry = self.__cached_model_def_entry
+        self.__cached_model_def_entry = None
+        if entry is None or self.data_descriptions_source != "cache" or self.data_descriptions_hash != entry["hash"]:
+            return
+        if entry.get("application_name") != self.get_application_name() or \
+           entry.get("server_version") != self.get_server_version() or \
+           entry.get("nat_net_version") != self.get_nat_net_version_server():
+            self.data_descriptions = None
+            self.data_descriptions_source = None
+            self.data_descriptions_hash = None
+
+    # model_changed_listener receives the result of DataDescriptions.diff_data_descriptions()
+    # (rigid_bodies, skeletons and assets, each with added, removed and renamed) plus
+    #   data_descriptions          : the new DataDescriptions
+    #   previous_data_descriptions : the replaced DataDescriptions or None
+    #   source                     : "cache" or "server"
+    # It is only called if something was added, removed or renamed.
+    def __set_data_descriptions(self, data_descs, source, digest):
+        previous_data_descs = self.data_descriptions
+        previous_digest = self.data_descriptions_hash
+        self.data_descriptions = data_descs
+        self.data_descriptions_source = source
+        self.data_descriptions_hash = digest
+        if self.model_changed_listener is None or digest == previous_digest:
+            return
+        change_event = DataDescriptions.diff_data_descriptions( previous_data_descs, data_descs )
+        if DataDescriptions.is_empty_diff( change_event ):
+            return
+        change_event["data_descriptions"] = data_descs
+        change_event["previous_data_descriptions"] = previous_data_descs
+        change_event["source"] = source
+        self.model_changed_listener( change_event )
+
+    def __update_data_descriptions(self, data, data_descs):
+        digest = content_hash( bytes(data) )
+        self.__set_data_descriptions( data_descs, "server", digest )
+        if self.__model_def_cache is not None:
+            try:
+                self.__model_def_cache.store( self.__model_def_cache_key(), data,
+                    self.get_application_name(), self.get_server_version(), self.get_nat_net_version_server() )
+            except OSError:
+                pass
+
+    def get_process_decoder_stats(self):
+        if self.__process_decoder is None:
+            return None
+        return self.__process_decoder.get_stats()
+
     def can_change_bitstream_version(self):
         return self.__can_change_bitstream_version
 
     def set_nat_net_version(self, major, minor):
         """checks to see if stream version can change, then changes it with position reset"""
         return_code = -1
-        if self.__can_change_bitstream_version and \
-            ((major != self.__nat_net_requested_version[0]) or\
-             (minor != self.__nat_net_requested_version[1])):
+        with self.__version_lock:
+            needs_change = self.__can_change_bitstream_version and \
+                ((major != self.__nat_net_requested_version[0]) or\
+                 (minor != self.__nat_net_requested_version[1]))
+        if needs_change:
             sz_command = "Bitstream,%1.1d.%1.1d"%(major, minor)
-            return_code = self.send_command(sz_command)
-            if return_code >=0:
-                self.__nat_net_requested_version[0] = major
-                self.__nat_net_requested_version[1] = minor
-                self.__nat_net_requested_version[2] = 0
-                self.__nat_net_requested_version[3] = 0
-                # # print("changing bitstream MAIN")
-                # get original output state
-                #print_results = self.get_print_results()
-                #turn off output
-                #self.set_print_results(False)
+            # wait for the server to acknowledge instead of sleeping
+            if self.__wait_for_response( self.send_command_async(sz_command) ) is not None:
+                return_code = 0
+                with self.__version_lock:
+                    self.__nat_net_requested_version[0] = major
+                    self.__nat_net_requested_version[1] = minor
+                    self.__nat_net_requested_version[2] = 0
+                    self.__nat_net_requested_version[3] = 0
                 # force frame send and play reset
-                self.send_command("TimelinePlay")
-                time.sleep(0.1)
+                self.__wait_for_response( self.send_command_async("TimelinePlay") )
                 tmpCommands=["TimelinePlay",
                     "TimelineStop",
                     "SetPlaybackCurrentFrame,0",
                     "TimelineStop"]
-                self.send_commands(tmpCommands,False)
-                time.sleep(2)
-                #reset to original output state
-                #self.set_print_results(print_results)
+                pending = [self.send_command_async(sz_command) for sz_command in tmpCommands]
+                for future in pending:
+                    self.__wait_for_response( future )
             #else:
             # # print("Bitstream change request failed")
         return return_code
 
 
     def get_major(self):
-        return self.__nat_net_requested_version[0]
+        with self.__version_lock:
+            return self.__nat_net_requested_version[0]
 
     def get_minor(self):
-        return self.__nat_net_requested_version[1]
+        with self.__version_lock:
+            return self.__nat_net_requested_version[1]
+
+    # major and minor read together, so a concurrent version change cannot mix them
+    def __get_major_minor(self):
+        with self.__version_lock:
+            return self.__nat_net_requested_version[0], self.__nat_net_requested_version[1]
 
     def set_print_level(self, print_level=0):
         if(print_level >=0):
@@ -203,7 +633,7 @@ class NatNetClient:
         # check sockets
         if self.command_socket == None:
             ret_value = False
-        elif self.data_socket ==None:
+        elif self.use_data_socket and self.data_socket ==None:
             ret_value = False
         # check versions
         elif self.get_application_name() == "Not Set":
@@ -241,8 +671,8 @@ class NatNetClient:
                 result = None
             # set to broadcast mode
             result.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            # set timeout to allow for keep alive messages
-            result.settimeout(2.0)
+            # wake up the command thread regularly to notice shutdown()
+            result.settimeout(self.receive_timeout)
         else:
             # Unicast case
             result = socket.socket( socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -262,8 +692,8 @@ class NatNetClient:
                 # # print("ERROR: command socket timeout occurred. Server not responding")
                 result = None
 
-            # set timeout to allow for keep alive messages
-            result.settimeout(2.0)
+            # wake up the command thread regularly to notice shutdown()
+            result.settimeout(self.receive_timeout)
             result.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         return result
@@ -321,8 +751,141 @@ class NatNetClient:
                 mreq = struct.pack("4sl", socket.inet_aton(self.multicast_address), socket.INADDR_ANY)
                 result.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
+        if result is not None:
+            self.__tune_data_socket( result )
+            # wake up the data thread regularly to notice shutdown()
+            result.settimeout( self.receive_timeout )
         return result
 
+    # Apply the optional receive buffer, busy-poll and timestamp settings to the data socket
+    def __tune_data_socket( self, in_socket ):
+        is_linux = sys.platform.startswith( "linux" )
+
+        if self.use_multicast and is_linux:
+            # Only deliver the group this socket joined. By default Linux hands a socket
+            # bound to INADDR_ANY every group joined on the host, which mixes servers
+            # when several clients share the data port.
+            try:
+                in_socket.setsockopt( socket.IPPROTO_IP, IP_MULTICAST_ALL, 0 )
+            except OSError:
+                pass
+
+        if self.receive_buffer_size is not None:
+            try:
+                in_socket.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size )
+            except OSError:
+                pass
+                # # print("WARNING: could not set SO_RCVBUF")
+        # verify what the kernel granted, it silently caps at net.core.rmem_max
+        self.receive_buffer_size_granted = in_socket.getsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF )
+
+        if self.busy_poll_usec is not None and is_linux:
+            try:
+                in_socket.setsockopt( socket.SOL_SOCKET, SO_BUSY_POLL, self.busy_poll_usec )
+            except OSError:
+                pass
+                # # print("WARNING: could not set SO_BUSY_POLL (needs CAP_NET_ADMIN above net.core.busy_read)")
+
+        # count datagrams the kernel dropped because the receive buffer was full
+        self.__rxq_ovfl_enabled = False
+        with self.__stats_lock:
+            self.__kernel_drop_base = self.__stats["kernel_dropped_datagrams"]
+            self.__kernel_drop_raw = 0
+        if is_linux and hasattr( in_socket, "recvmsg" ):
+            try:
+                in_socket.setsockopt( socket.SOL_SOCKET, SO_RXQ_OVFL, 1 )
+                self.__rxq_ovfl_enabled = True
+            except OSError:
+                pass
+                # # print("WARNING: could not set SO_RXQ_OVFL")
+
+        self.__kernel_timestamps_enabled = False
+        if self.use_kernel_timestamps and is_linux and hasattr( in_socket, "recvmsg" ):
+            try:
+                in_socket.setsockopt( socket.SOL_SOCKET, SO_TIMESTAMPNS, 1 )
+                self.__kernel_timestamps_enabled = True
+            except OSError:
+                pass
+                # # print("WARNING: could not set SO_TIMESTAMPNS")
+
+    # Receive one datagram, returns the data and the kernel receive time in ns
+    # since the epoch (None when kernel timestamps are not enabled).
+    # The kernel drop counter (SO_RXQ_OVFL) is picked up from the same ancillary data.
+    def __receive_datagram( self, in_socket, recv_buffer_size ):
+        if not (self.__kernel_timestamps_enabled or self.__rxq_ovfl_enabled):
+            data, addr = in_socket.recvfrom( recv_buffer_size )
+            return data, None
+
+        rx_timestamp_ns = None
+        data, ancdata, msg_flags, addr = in_socket.recvmsg( recv_buffer_size, 256 )
+        for cmsg_level, cmsg_type, cmsg_data in ancdata:
+            if cmsg_level != socket.SOL_SOCKET:
+                continue
+            if cmsg_type == SCM_TIMESTAMPNS:
+                tv_sec, tv_nsec = TimeSpec.unpack( cmsg_data[:TimeSpec.size] )
+                rx_timestamp_ns = tv_sec * 1000000000 + tv_nsec
+            elif cmsg_type == SO_RXQ_OVFL:
+                # the counter is cumulative for the lifetime of the socket
+                self.__kernel_drop_raw, = DropCount.unpack( cmsg_data[:DropCount.size] )
+                with self.__stats_lock:
+                    self.__stats["kernel_dropped_datagrams"] = self.__kernel_drop_base + self.__kernel_drop_raw
+        return data, rx_timestamp_ns
+
+    def receive_datagram( self, in_socket, recv_buffer_size=64*1024 ):
+        """Receive one datagram from one of this client's sockets.
+        Returns the data and the kernel receive time in ns (or None), and keeps
+        the kernel drop counters up to date. For callers running their own event loop."""
+        return self.__receive_datagram( in_socket, recv_buffer_size )
+
+    def reset_stats(self):
+        with self.__stats_lock:
+            self.__reset_stats_locked()
+
+    def __reset_stats_locked(self):
+        self.__stats["frames_received"] = 0
+        self.__stats["last_frame_number"] = -1
+        self.__stats["frame_gaps"] = 0
+        self.__stats["frames_missing"] = 0
+        self.__stats["kernel_dropped_datagrams"] = 0
+        self.__stats["kernel_dropped_frames"] = 0
+        self.__stats["sender_dropped_frames"] = 0
+        self.__stats["decode_queue_dropped"] = 0
+        self.__stats["decode_errors"] = 0
+        self.__kernel_drop_base = -self.__kernel_drop_raw
+        self.__kernel_dropped_at_last_frame = 0
+
+    def get_stats(self):
+        """Receive statistics.
+        frames_missing is the total of all frame_number gaps. Each gap is split into
+        kernel_dropped_frames (explained by datagrams our own socket dropped, SO_RXQ_OVFL, Linux only)
+        and sender_dropped_frames (frames that never arrived at our socket)."""
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    # Update the frame counters from the frame number of each decoded frame
+    def __update_frame_stats( self, frame_number ):
+        with self.__stats_lock:
+            gap = self.__update_frame_stats_locked( frame_number )
+        self.__first_frame_event.set()
+        if gap and self.__trigger_on_frame_gap and self.__flight_recorder is not None:
+            self.__trigger_flight_recorder( "frame_gap" )
+
+    def __update_frame_stats_locked( self, frame_number ):
+        stats = self.__stats
+        stats["frames_received"] += 1
+        kernel_dropped = stats["kernel_dropped_datagrams"]
+        last_frame_number = stats["last_frame_number"]
+        if last_frame_number >= 0 and frame_number > last_frame_number + 1:
+            missing = frame_number - last_frame_number - 1
+            kernel_missing = min( missing, kernel_dropped - self.__kernel_dropped_at_last_frame )
+            stats["frame_gaps"] += 1
+            stats["frames_missing"] += missing
+            stats["kernel_dropped_frames"] += kernel_missing
+            stats["sender_dropped_frames"] += missing - kernel_missing
+        stats["last_frame_number"] = frame_number
+        self.__kernel_dropped_at_last_frame = kernel_dropped
+        return last_frame_number >= 0 and frame_number > last_frame_number + 1
+
     # Unpack a rigid body object from a data packet
     def __unpack_rigid_body( self, data, major, minor, rb_num):
         offset = 0
@@ -344,10 +907,6 @@ class NatNetClient:
 
         rigid_body = MoCapData.RigidBody(new_id, pos, rot)
 
-        # Send information to any listener.
-        if self.rigid_body_listener is not None:
-            self.rigid_body_listener( new_id, pos, rot )
-
         # RB Marker Data ( Before version 3.0.  After Version 3.0 Marker data is in description )
         if( major < 3  and major != 0) :
             # Marker count (4 bytes)
@@ -844,8 +1403,9 @@ class NatNetClient:
 
 
     # Unpack data from a motion capture frame message
-    def __unpack_mocap_data( self, data : bytes, packet_size, major, minor):
+    def __unpack_mocap_data( self, data : bytes, packet_size, major, minor, rx_timestamp_ns=None):
         mocap_data = MoCapData.MoCapData()
+        mocap_data.rx_timestamp_ns = rx_timestamp_ns
         data = memoryview( data )
         offset = 0
         rel_offset = 0
@@ -912,32 +1472,135 @@ class NatNetClient:
         offset += rel_offset
         mocap_data.set_suffix_data(frame_suffix_data)
 
+        return offset, mocap_data
+
+    # Send a decoded frame to the listeners. Kept apart from decoding so frames
+    # decoded elsewhere (process or thread pools) are delivered the same way.
+    def __notify_frame_listeners( self, mocap_data ):
+        if mocap_data.suffix_data.tracked_models_changed:
+            self.__on_tracked_models_changed()
+        if self.__trigger_on_tracking_lost and self.__flight_recorder is not None:
+            self.__check_tracking_lost( mocap_data )
+        # Send per-rigid-body information to any listener.
+        if self.rigid_body_listener is not None:
+            for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+                self.rigid_body_listener( rigid_body.id_num, rigid_body.pos, rigid_body.rot )
+            for skeleton in mocap_data.skeleton_data.skeleton_list:
+                for rigid_body in skeleton.rigid_body_list:
+                    self.rigid_body_listener( rigid_body.id_num, rigid_body.pos, rigid_body.rot )
 
-        timecode = frame_suffix_data.timecode
-        timecode_sub= frame_suffix_data.timecode_sub
-        timestamp = frame_suffix_data.timestamp
-        is_recording = frame_suffix_data.is_recording
-        tracked_models_changed = frame_suffix_data.tracked_models_changed
+        frame_suffix_data = mocap_data.suffix_data
 
         # Send information to any listener.
         if self.new_frame_listener is not None:
+            asset_count = 0
+            if mocap_data.asset_data is not None:
+                asset_count = mocap_data.asset_data.get_asset_count()
             data_dict={}
-            data_dict["frame_number"]=frame_number
-            data_dict[ "marker_set_count"] = marker_set_count
-            data_dict[ "unlabeled_markers_count"] = unlabeled_markers_count
-            data_dict[ "rigid_body_count"] = rigid_body_count
-            data_dict[ "skeleton_count"] =skeleton_count
-            data_dict[ "asset_count"] =asset_count
-            data_dict[ "labeled_marker_count"] = labeled_marker_count
-            data_dict[ "timecode"] = timecode
-            data_dict[ "timecode_sub"] = timecode_sub
-            data_dict[ "timestamp"] = timestamp
-            data_dict[ "is_recording"] = is_recording
-            data_dict[ "tracked_models_changed"] = tracked_models_changed
+            data_dict["frame_number"]=mocap_data.prefix_data.frame_number
+            data_dict[ "marker_set_count"] = mocap_data.legacy_other_markers.get_marker_count()
+            data_dict[ "unlabeled_markers_count"] = mocap_data.marker_set_data.get_unlabeled_marker_count()
+            data_dict[ "rigid_body_count"] = mocap_data.rigid_body_data.get_rigid_body_count()
+            data_dict[ "skeleton_count"] = mocap_data.skeleton_data.get_skeleton_count()
+            data_dict[ "asset_count"] = asset_count
+            data_dict[ "labeled_marker_count"] = mocap_data.labeled_marker_data.get_labeled_marker_count()
+            data_dict[ "timecode"] = frame_suffix_data.timecode
+            data_dict[ "timecode_sub"] = frame_suffix_data.timecode_sub
+            data_dict[ "timestamp"] = frame_suffix_data.timestamp
+            data_dict[ "is_recording"] = frame_suffix_data.is_recording
+            data_dict[ "tracked_models_changed"] = frame_suffix_data.tracked_models_changed
+            data_dict[ "rx_timestamp_ns"] = mocap_data.rx_timestamp_ns
             data_dict["mocap_data"] = mocap_data
 
             self.new_frame_listener( data_dict )
-        return offset, mocap_data
+
+        if self.rigid_body_batch_listener is not None:
+            self.rigid_body_batch_listener( self.__build_rigid_body_batch( mocap_data ) )
+
+    # Motive flags every frame for a while after a change, so requests are rate
+    # limited; a flag seen within the interval schedules one trailing request.
+    def __on_tracked_models_changed( self ):
+        if not self.auto_refresh_model_def or self.command_socket is None:
+            return
+        with self.__model_def_refresh_lock:
+            if self.__model_def_refresh_timer is not None:
+                return
+            wait = self.__last_model_def_refresh + self.model_def_refresh_interval - time.monotonic()
+            if wait > 0:
+                self.__model_def_refresh_timer = threading.Timer( wait, self.__refresh_model_def )
+                self.__model_def_refresh_timer.daemon = True
+                self.__model_def_refresh_timer.start()
+                return
+            self.__last_model_def_refresh = time.monotonic()
+        self.request_model_definitions_async()
+
+    def __refresh_model_def( self ):
+        with self.__model_def_refresh_lock:
+            self.__model_def_refresh_timer = None
+            self.__last_model_def_refresh = time.monotonic()
+        if not self.stop_threads:
+            self.request_model_definitions_async()
+
+    def __report_decode_error( self, message ):
+        if self.print_level > 0:
+            print( "ERROR: frame decode failed in a decode process: %s" % message )
+
+    # Called by the process decoder, in receive order, for every frame decoded by a worker
+    def __deliver_columnar_frame( self, frame ):
+        self.__update_frame_stats( frame["frame_number"] )
+        if frame["tracked_models_changed"]:
+            self.__on_tracked_models_changed()
+        if self.columnar_frame_listener is not None:
+            self.columnar_frame_listener( frame )
+        if self.rigid_body_batch_listener is not None:
+            self.rigid_body_batch_listener( frame )
+
+    # Collect the rigid bodies of a decoded frame into flat arrays so a listener
+    # is called once per frame instead of once per rigid body.
+    #   ids          : array('i')  rigid body / bone ids
+    #   positions    : array('f')  x,y,z per body (3*n values)
+    #   rotations    : array('f')  qx,qy,qz,qw per body (4*n values)
+    #   errors       : array('f')  mean marker error per body
+    #   valid        : array('b')  1 if tracking is valid
+    #   skeleton_ids : array('i')  owning skeleton id for bones, -1 for top-level rigid bodies
+    # The arrays can be wrapped without copying, e.g. numpy.frombuffer(batch["positions"], numpy.float32).
+    def __build_rigid_body_batch( self, mocap_data ):
+        ids = array('i')
+        positions = array('f')
+        rotations = array('f')
+        errors = array('f')
+        valid = array('b')
+        skeleton_ids = array('i')
+
+        for rigid_body in mocap_data.rigid_body_data.rigid_body_list:
+            ids.append(rigid_body.id_num)
+            positions.extend(rigid_body.pos)
+            rotations.extend(rigid_body.rot)
+            errors.append(rigid_body.error)
+            valid.append(rigid_body.tracking_valid)
+            skeleton_ids.append(-1)
+
+        for skeleton in mocap_data.skeleton_data.skeleton_list:
+            for rigid_body in skeleton.rigid_body_list:
+                ids.append(rigid_body.id_num)
+                positions.extend(rigid_body.pos)
+                rotations.extend(rigid_body.rot)
+                errors.append(rigid_body.error)
+                valid.append(rigid_body.tracking_valid)
+                skeleton_ids.append(skeleton.id_num)
+
+        batch={}
+        batch["frame_number"] = mocap_data.prefix_data.frame_number
+        batch["timestamp"] = mocap_data.suffix_data.timestamp
+        batch["rx_timestamp_ns"] = mocap_data.rx_timestamp_ns
+        batch["count"] = len(ids)
+        batch["ids"] = ids
+        batch["positions"] = positions
+        batch["rotations"] = rotations
+        batch["errors"] = errors
+        batch["valid"] = valid
+        batch["skeleton_ids"] = skeleton_ids
+        return batch
 
 
     # Unpack a Markerset description packet
@@ -1435,7 +2098,7 @@ class NatNetClient:
                 # # print("\t"+ str(i+1) +" datasets processed of " + str(dataset_count))
                 # # print("\t "+ str(offset) +" bytes processed of " + str(packet_size) )
                 # # print("\tPACKET DECODE STOPPED")
-                return offset
+                return offset, data_descs
             offset += offset_tmp
             data_descs.add_data(data_tmp)
             trace_dd("\t"+ str(i+1) +" datasets processed of " + str(dataset_count))
@@ -1447,6 +2110,10 @@ class NatNetClient:
     # and will update the values for the versions/ NatNet capabilities
     # of the server.
     def __unpack_server_info(self, data, packet_size, major, minor):
+        with self.__version_lock:
+            return self.__unpack_server_info_locked( data, packet_size, major, minor )
+
+    def __unpack_server_info_locked(self, data, packet_size, major, minor):
         offset = 0
         # Server name
         #szName = data[offset: offset+256]
@@ -1517,8 +2184,6 @@ class NatNetClient:
 
     def __command_thread_function( self, in_socket, stop, gprint_level):
         message_id_dict={}
-        if not self.use_multicast:
-            in_socket.settimeout(2.0)
         data=bytearray(0)
         # 64k buffer size
         recv_buffer_size=64*1024
@@ -1528,25 +2193,28 @@ class NatNetClient:
             # # print("loop commad")
             try:
                 data, addr = in_socket.recvfrom( recv_buffer_size )
-            except socket.error as msg:
-                if self.stop_threads:
-                    pass
-                    ## # print("ERROR: command socket access error occurred:\n  %s" %msg)
-                    #return 1
-                    # # print("shutting down")
+            except  socket.timeout:
+                # nothing within receive_timeout, check stop_threads again
+                continue
             except  socket.herror:
                 # # print("ERROR: command socket access herror occurred")
                 return 2
             except  socket.gaierror:
                 # # print("ERROR: command socket access gaierror occurred")
                 return 3
-            except  socket.timeout:
-                if(self.use_multicast):
-                    pass
-                    # # print("ERROR: command socket access timeout occurred. Server not responding")
-                    #return 4
+            except socket.error as msg:
+                if self.stop_threads:
+                    return 0
+                # # print("ERROR: command socket access error occurred:\n  %s" %msg)
+                # the connection supervisor opens a new socket and restarts the thread
+                return 1
 
             if len( data ) > 0 :
+                self.__mark_server_alive()
+                if self.__recorder is not None:
+                    self.__recorder.record( COMMAND_CHANNEL, data )
+                if self.__flight_recorder is not None:
+                    self.__flight_recorder.record( COMMAND_CHANNEL, data )
                 #peek ahead at message_id
                 message_id = get_message_id(data)
                 tmp_str="mi_%1.1d"%message_id
@@ -1561,13 +2229,9 @@ class NatNetClient:
                             print_level = 1
                         else:
                             print_level = 0
-                message_id = self.__process_message( data , print_level)
+                message_id = self.__process_command_message( data , print_level)
 
                 data=bytearray(0)
-
-            if not self.use_multicast:
-                if not stop():
-                    self.send_keep_alive(in_socket, self.server_ip_address, self.command_port)
         return 0
 
     def __data_thread_function( self, in_socket, stop, gprint_level):
@@ -1580,14 +2244,13 @@ class NatNetClient:
         while not self.stop_threads:
             # # print("loop data")
             # Block for input
+            rx_timestamp_ns = None
             try:
-                data, addr = in_socket.recvfrom( recv_buffer_size )
+                data, rx_timestamp_ns = self.__receive_datagram( in_socket, recv_buffer_size )
                 ## # print("row data", data, addr)
-            except socket.error as msg:
-                if not self.stop_threads:
-                    pass
-                    # # print("ERROR: data socket access error occurred:\n  %s" %msg)
-                    return 1
+            except  socket.timeout:
+                # nothing within receive_timeout, check stop_threads again
+                continue
             except  socket.herror:
                 pass
                 # # print("ERROR: data socket access herror occurred")
@@ -1596,11 +2259,12 @@ class NatNetClient:
                 pass
                 # # print("ERROR: data socket access gaierror occurred")
                 #return 3
-            except  socket.timeout:
-                pass
-                #if self.use_multicast:
-                # # print("ERROR: data socket access timeout occurred. Server not responding")
-                #return 4
+            except socket.error as msg:
+                if self.stop_threads:
+                    return 0
+                # # print("ERROR: data socket access error occurred:\n  %s" %msg)
+                # the connection supervisor opens a new socket and restarts the thread
+                return 1
             except Exception as e:
                 pass
                 # # print(e)
@@ -1619,16 +2283,171 @@ class NatNetClient:
                             print_level = 1
                         else:
                             print_level = 0
-                message_id = self.__process_message( data , print_level)
+                self.__dispatch_datagram( data, print_level, rx_timestamp_ns )
 
                 data=bytearray(0)
         # # print("Thread data ended")
         return 0
 
-    def __process_message( self, data : bytes, print_level=0):
+    # Route a data channel datagram to the process pool, the decode threads or the inline decoder
+    def __dispatch_datagram( self, data, print_level=0, rx_timestamp_ns=None ):
+        message_id = get_message_id(data)
+        self.__mark_server_alive( message_id == self.NAT_FRAMEOFDATA )
+        if self.__recorder is not None:
+            self.__recorder.record( DATA_CHANNEL, data, rx_timestamp_ns )
+        if self.__flight_recorder is not None:
+            self.__flight_recorder.record( DATA_CHANNEL, data, rx_timestamp_ns )
+        if message_id == self.NAT_FRAMEOFDATA:
+            if self.__process_decoder is not None:
+                major, minor = self.__get_major_minor()
+                self.__process_decoder.submit( data, major, minor, rx_timestamp_ns )
+                return message_id
+            if self.__decode_queue is not None:
+                major, minor = self.__get_major_minor()
+                try:
+                    self.__decode_queue.put_nowait( (self.__next_decode_sequence, data, rx_timestamp_ns, major, minor) )
+                    self.__next_decode_sequence += 1
+                except queue.Full:
+                    with self.__stats_lock:
+                        self.__stats["decode_queue_dropped"] += 1
+                return message_id
+        return self.__process_message( data, print_level, rx_timestamp_ns )
+
+    def __decode_thread_function( self ):
+        while True:
+            item = self.__decode_queue.get()
+            if item is None:
+                break
+            sequence, data, rx_timestamp_ns, major, minor = item
+            mocap_data = None
+            try:
+                mocap_data = self.unpack_frame_of_data( data, major, minor )
+                mocap_data.rx_timestamp_ns = rx_timestamp_ns
+            except Exception:
+                with self.__stats_lock:
+                    self.__stats["decode_errors"] += 1
+            self.__deliver_in_order( sequence, mocap_data )
+
+    # Frames are decoded in parallel but handed to the listeners strictly in
+    # receive order, one at a time: whichever thread completes the next expected
+    # sequence number delivers it and any already decoded frames after it, while
+    # the others only leave their frames behind. The listeners are called without
+    # the lock held, so they may call back into the client.
+    def __deliver_in_order( self, sequence, mocap_data ):
+        with self.__delivery_lock:
+            self.__decoded_frames[sequence] = mocap_data
+            if self.__delivering_thread is not None:
+                return
+            self.__delivering_thread = threading.current_thread()
+        while True:
+            with self.__delivery_lock:
+                if self.__next_delivery_sequence not in self.__decoded_frames:
+                    self.__delivering_thread = None
+                    return
+                mocap_data = self.__decoded_frames.pop( self.__next_delivery_sequence )
+                self.__next_delivery_sequence += 1
+            if mocap_data is not None:
+                try:
+                    self.__update_frame_stats( mocap_data.prefix_data.frame_number )
+                    self.__notify_frame_listeners( mocap_data )
+                except BaseException:
+                    # a failing listener must not stop the delivery for good
+                    with self.__delivery_lock:
+                        self.__delivering_thread = None
+                    raise
+
+    # Frames on the command socket answer fetch_frame() while one is pending
+    def __process_command_message( self, data, print_level=0 ):
+        message_id = get_message_id(data)
+        if message_id == self.NAT_FRAMEOFDATA:
+            if self.__requests.has_pending( self.NAT_FRAMEOFDATA ):
+                try:
+                    mocap_data = self.unpack_frame_of_data( data )
+                except Exception as e:
+                    self.__requests.reject( self.NAT_FRAMEOFDATA, e )
+                else:
+                    self.__requests.resolve( self.NAT_FRAMEOFDATA, mocap_data )
+                return message_id
+            if not self.use_data_socket:
+                # not subscribed to the stream, do not pay for decoding it
+                return message_id
+        return self.__process_message( data, print_level )
+
+    def process_command_datagram( self, data ):
+        """Feed a command channel datagram received elsewhere through the same path as the command thread"""
+        self.__mark_server_alive()
+        if self.__recorder is not None:
+            self.__recorder.record( COMMAND_CHANNEL, data )
+        if self.__flight_recorder is not None:
+            self.__flight_recorder.record( COMMAND_CHANNEL, data )
+        return self.__process_command_message( data )
+
+    def process_datagram( self, data, rx_timestamp_ns=None ):
+        """Feed a data channel datagram received elsewhere (another socket, a
+        recording, a packet capture) through the same path as the data thread.
+        Call start_processing() (or run()) first when decode pools are configured."""
+        return self.__dispatch_datagram( data, 0, rx_timestamp_ns )
+
+    def start_processing( self ):
+        """Lock the configuration and start the configured decode pools without
+        opening sockets or receive threads. run() calls this itself."""
+        self.__is_locked = True
+
+        if self.decode_processes > 0 and self.__process_decoder is None:
+            from .ProcessDecoder import ProcessDecoder
+            self.__process_decoder = ProcessDecoder( self.__deliver_columnar_frame,
+                                                     num_workers=self.decode_processes,
+                                                     error_callback=self.__report_decode_error,
+                                                     **self.decode_process_options )
+            self.__process_decoder.start()
+
+        if self.decode_threads > 0 and self.__decode_queue is None:
+            self.__decode_queue = queue.Queue( maxsize=self.decode_queue_size )
+            self.__decoded_frames = {}
+            self.__next_decode_sequence = 0
+            self.__next_delivery_sequence = 0
+            for i in range( self.decode_threads ):
+                decode_thread = Thread( target = self.__decode_thread_function, daemon=True )
+                decode_thread.start()
+                self.__decode_thread_list.append( decode_thread )
+        return True
+
+    def wait_until_decoded( self, timeout=None ):
+        """Block until every frame handed to a decode pool has been delivered.
+        Called from a frame listener of the decode threads it does not wait, since
+        the frames after the current one are delivered once the listener returns."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if self.__process_decoder is not None:
+            return self.__process_decoder.wait_idle( timeout )
+        while self.__decode_queue is not None:
+            with self.__delivery_lock:
+                if self.__next_delivery_sequence >= self.__next_decode_sequence and \
+                   self.__delivering_thread is None:
+                    break
+                if self.__delivering_thread is threading.current_thread():
+                    return self.__next_delivery_sequence >= self.__next_decode_sequence
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep( 0.001 )
+        return True
+
+    def __stop_processing( self ):
+        if self.__decode_queue is not None:
+            for decode_thread in self.__decode_thread_list:
+                self.__decode_queue.put( None )
+            for decode_thread in self.__decode_thread_list:
+                decode_thread.join( timeout=2.0 )
+            self.__decode_thread_list = []
+            self.__decode_queue = None
+        if self.__process_decoder is not None:
+            self.__process_decoder.shutdown()
+            self.__process_decoder = None
+
+    def __process_message( self, data : bytes, print_level=0, rx_timestamp_ns=None):
         #return message ID
-        major = self.get_major()
-        minor = self.get_minor()
+        major, minor = self.__get_major_minor()
 
         trace( "Begin Packet\n-----------------" )
         show_nat_net_version = False
@@ -1648,8 +2467,10 @@ class NatNetClient:
             trace( "Message ID  : %3.1d NAT_FRAMEOFDATA"% message_id )
             trace( "Packet Size : ", packet_size )
 
-            offset_tmp, mocap_data = self.__unpack_mocap_data( data[offset:], packet_size, major, minor )
+            offset_tmp, mocap_data = self.__unpack_mocap_data( data[offset:], packet_size, major, minor, rx_timestamp_ns )
             offset += offset_tmp
+            self.__update_frame_stats( mocap_data.prefix_data.frame_number )
+            self.__notify_frame_listeners( mocap_data )
             # # print("MoCap Frame: %d\n"%(mocap_data.prefix_data.frame_number))
             # get a string version of the data for output
             mocap_data_str=mocap_data.get_as_string()
@@ -1668,11 +2489,19 @@ class NatNetClient:
             if print_level>0:
                 pass
                 # # print("%s\n"%(data_descs_str))
+            self.__update_data_descriptions( data, data_descs )
+            self.__requests.resolve( self.NAT_MODELDEF, data_descs )
 
         elif message_id == self.NAT_SERVERINFO :
             trace( "Message ID  : %3.1d NAT_SERVERINFO"% message_id )
             trace( "Packet Size : ", packet_size )
             offset += self.__unpack_server_info( data[offset:], packet_size, major, minor)
+            self.__check_cached_model_def()
+            server_info = {}
+            server_info["application_name"] = self.get_application_name()
+            server_info["server_version"] = self.get_server_version()
+            server_info["nat_net_version"] = self.get_nat_net_version_server()
+            self.__requests.resolve( self.NAT_SERVERINFO, server_info )
 
         elif message_id == self.NAT_RESPONSE :
             trace( "Message ID  : %3.1d NAT_RESPONSE"% message_id )
@@ -1685,6 +2514,7 @@ class NatNetClient:
                                                              data[offset+2],
                                                              data[offset+3]))
                 offset += 4
+                self.__requests.resolve( self.NAT_RESPONSE, command_response )
             else:
                 show_remainder = False
                 message, separator, remainder = bytes(data[offset:]).partition( b'\0' )
@@ -1692,13 +2522,14 @@ class NatNetClient:
                     tmpString = message.decode('utf-8')
                     # Decode bitstream version
                     if( tmpString.startswith('Bitstream') ):
-                        nn_version = self.__unpack_bitstream_info(data[offset:],packet_size, major, minor)
+                        nn_version = self.__unpack_bitstream_info(message,packet_size, major, minor)
                         # This is the current server version
                         if(len(nn_version)>1):
-                            for i in range( len(nn_version) ):
-                                self.__nat_net_stream_version_server[i] = int(nn_version[i])
-                            for i in range( len(nn_version),4 ):
-                                self.__nat_net_stream_version_server[i] = 0
+                            with self.__version_lock:
+                                for i in range( len(nn_version) ):
+                                    self.__nat_net_stream_version_server[i] = int(nn_version[i])
+                                for i in range( len(nn_version),4 ):
+                                    self.__nat_net_stream_version_server[i] = 0
                             
                 offset += len( message ) + 1
 
@@ -1707,10 +2538,12 @@ class NatNetClient:
                         " separator:", separator, " remainder:",remainder )
                 else:
                     trace( "Command response:", message.decode( 'utf-8' ))
+                self.__requests.resolve( self.NAT_RESPONSE, message.decode( 'utf-8', errors='replace' ) )
         elif message_id == self.NAT_UNRECOGNIZED_REQUEST :
             trace( "Message ID  : %3.1d NAT_UNRECOGNIZED_REQUEST: "% message_id )
             trace( "Packet Size : ", packet_size )
             trace( "Received 'Unrecognized request' from server" )
+            self.__requests.reject( self.NAT_RESPONSE, RuntimeError( "Unrecognized request" ) )
         elif message_id == self.NAT_MESSAGESTRING :
             trace( "Message ID  : %3.1d NAT_MESSAGESTRING"% message_id)
             trace( "Packet Size : ", packet_size )
@@ -1725,6 +2558,29 @@ class NatNetClient:
         trace( "End Packet\n-----------------" )
         return message_id
 
+    def unpack_frame_of_data( self, data, major=None, minor=None ):
+        """Decode a complete NAT_FRAMEOFDATA datagram into a MoCapData object
+        without updating statistics or calling any listener.
+        major/minor default to the currently negotiated NatNet version."""
+        if major is None:
+            major = self.get_major()
+        if minor is None:
+            minor = self.get_minor()
+        packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
+        offset_tmp, mocap_data = self.__unpack_mocap_data( data[4:], packet_size, major, minor )
+        return mocap_data
+
+    def unpack_data_descriptions( self, data, major=None, minor=None ):
+        """Decode a complete NAT_MODELDEF datagram into a DataDescriptions object.
+        major/minor default to the currently negotiated NatNet version."""
+        if major is None:
+            major = self.get_major()
+        if minor is None:
+            minor = self.get_minor()
+        packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
+        offset_tmp, data_descs = self.__unpack_data_descriptions( data[4:], packet_size, major, minor )
+        return data_descs
+
     def send_request( self, in_socket, command, command_str, address ):
         # Compose the message in our known message format
         packet_size = 0
@@ -1769,6 +2625,8 @@ class NatNetClient:
             data += command_str.encode( 'utf-8' )
         data += b'\0'
 
+        if command != self.NAT_KEEPALIVE and self.__first_unanswered_request is None:
+            self.__first_unanswered_request = time.monotonic()
         return in_socket.sendto( data, address )
 
     def send_command( self, command_str):
@@ -1784,6 +2642,57 @@ class NatNetClient:
 
         #return self.send_request(self.data_socket,    self.NAT_REQUEST, command_str,  (self.server_ip_address, self.command_port) )
 
+    def send_request_async( self, command, command_str="", timeout=None, retries=None ):
+        """Send a request on the command channel and return a concurrent.futures.Future
+        resolved with the server's answer: the NAT_SERVERINFO summary dictionary for
+        NAT_CONNECT, the response string or int code for NAT_REQUEST and the
+        DataDescriptions for NAT_REQUEST_MODELDEF.
+
+        The request is resent up to retries times if no answer arrives within timeout
+        seconds (defaults: command_timeout, command_retries), after which the future
+        fails with TimeoutError. Await it from asyncio with asyncio.wrap_future().
+        Answers are resolved by the thread receiving the command socket, so do not
+        block on the future from a listener."""
+        if timeout is None:
+            timeout = self.command_timeout
+        if retries is None:
+            retries = self.command_retries
+        address = (self.server_ip_address, self.command_port)
+        send_function = lambda : self.send_request( self.command_socket, command, command_str, address )
+        return self.__requests.submit( send_function, self.RESPONSE_IDS[command], timeout, retries )
+
+    def send_command_async( self, command_str, timeout=None, retries=None ):
+        """Send a NAT_REQUEST command, see send_request_async()"""
+        return self.send_request_async( self.NAT_REQUEST, command_str, timeout, retries )
+
+    def fetch_frame_async( self, timeout=None, retries=0 ):
+        """Request a single frame with NAT_REQUEST_FRAMEOFDATA, the future resolves to a
+        MoCapData object. Fetched frames do not count in get_stats() and do not reach
+        the frame listeners. A resent request could be answered by a newer frame, so
+        retries default to 0."""
+        return self.send_request_async( self.NAT_REQUEST_FRAMEOFDATA, "", timeout, retries )
+
+    def fetch_frame( self, timeout=None ):
+        """Fetch a snapshot of the current frame, returns MoCapData or None if the
+        server did not answer within timeout seconds (default command_timeout)."""
+        return self.__wait_for_response( self.fetch_frame_async( timeout ) )
+
+    def request_model_definitions_async( self, timeout=None, retries=None ):
+        """Request the model definitions, the future resolves to a DataDescriptions object"""
+        return self.send_request_async( self.NAT_REQUEST_MODELDEF, "", timeout, retries )
+
+    def get_command_round_trip_time( self ):
+        """Round trip time in seconds of the last answered command request, or None"""
+        return self.__requests.last_round_trip_time
+
+    def __wait_for_response( self, future ):
+        # result of a command future, None if it timed out or was rejected
+        from concurrent import futures
+        try:
+            return future.result()
+        except (TimeoutError, futures.TimeoutError, futures.CancelledError, RuntimeError, OSError):
+            return None
+
     def send_commands(self,tmpCommands, print_results: bool =True):
         for sz_command in tmpCommands:
             return_code = self.send_command(sz_command)
@@ -1801,49 +2710,340 @@ class NatNetClient:
         #query for application configuration
         ## # print("Request current configuration")
         sz_command = "Bitstream"
-        return_code = self.send_command(sz_command)
-        time.sleep(0.5)
+        # returns as soon as the server answers, e.g. "Bitstream,4.1", None without an answer
+        return self.__wait_for_response( self.send_command_async(sz_command) )
 
     def get_application_name(self):
         return self.__application_name
 
     def get_nat_net_requested_version(self):
-        return self.__nat_net_requested_version
+        with self.__version_lock:
+            return list(self.__nat_net_requested_version)
 
     def get_nat_net_version_server(self):
-        return self.__nat_net_stream_version_server
+        with self.__version_lock:
+            return list(self.__nat_net_stream_version_server)
 
     def get_server_version(self):
-        return self.__server_version
+        with self.__version_lock:
+            return list(self.__server_version)
+
+
+
+    def reset_session_stats( self ):
+        with self.__session_lock:
+            self.__session_stats["keep_alives_sent"] = 0
+            self.__session_stats["keep_alive_bytes"] = 0
+            self.__session_stats["stalls"] = 0
+            self.__session_stats["reconnect_attempts"] = 0
+            self.__session_stats["reconnects"] = 0
+            self.__session_stats["rtt_count"] = 0
+            self.__session_stats["rtt_last"] = None
+            self.__session_stats["rtt_min"] = None
+            self.__session_stats["rtt_max"] = None
+            self.__session_stats["rtt_sum"] = 0.0
+
+    def get_session_stats( self ):
+        """Connection state, keep alive, stall and reconnect counters of the
+        supervisor, plus round trip times in seconds of all answered command requests."""
+        with self.__session_lock:
+            stats = dict(self.__session_stats)
+            stats["state"] = self.__connection_state
+        stats["stalled"] = stats["state"] in (self.STATE_STALLED, self.STATE_RECONNECTING)
+        now = time.monotonic()
+        stats["seconds_since_server_message"] = now - self.__last_server_message
+        stats["seconds_since_frame"] = now - self.__last_frame_datagram
+        stats["rtt_mean"] = None
+        if stats["rtt_count"] > 0:
+            stats["rtt_mean"] = stats["rtt_sum"] / stats["rtt_count"]
+        del stats["rtt_sum"]
+        return stats
+
+    def __record_round_trip( self, response_id, round_trip_time ):
+        with self.__session_lock:
+            stats = self.__session_stats
+            stats["rtt_count"] += 1
+            stats["rtt_last"] = round_trip_time
+            stats["rtt_sum"] += round_trip_time
+            if stats["rtt_min"] is None or round_trip_time < stats["rtt_min"]:
+                stats["rtt_min"] = round_trip_time
+            if stats["rtt_max"] is None or round_trip_time > stats["rtt_max"]:
+                stats["rtt_max"] = round_trip_time
+
+    # Called for every datagram from the server, on either socket
+    def __mark_server_alive( self, is_frame=False ):
+        now = time.monotonic()
+        self.__last_server_message = now
+        self.__first_unanswered_request = None
+        if is_frame:
+            self.__last_frame_datagram = now
+        elif self.use_data_socket:
+            # only frames prove that the stream is flowing
+            return
+        if self.__connection_state != self.STATE_STREAMING:
+            old_state = self.__set_connection_state( self.STATE_STREAMING,
+                (self.STATE_CONNECTING, self.STATE_STALLED, self.STATE_RECONNECTING) )
+            if old_state in (self.STATE_STALLED, self.STATE_RECONNECTING):
+                # the server may have restarted with other assets
+                self.request_model_definitions_async()
+
+    # Change the connection state if it is one of expected (any, if None).
+    # Returns the previous state, or None if nothing changed.
+    def __set_connection_state( self, new_state, expected=None ):
+        with self.__session_lock:
+            old_state = self.__connection_state
+            if old_state == new_state or (expected is not None and old_state not in expected):
+                return None
+            self.__connection_state = new_state
+            if new_state == self.STATE_STALLED:
+                self.__session_stats["stalls"] += 1
+            elif new_state == self.STATE_STREAMING and old_state in (self.STATE_STALLED, self.STATE_RECONNECTING):
+                self.__session_stats["reconnects"] += 1
+        trace( "Connection state %s -> %s"% (old_state, new_state) )
+        if self.connection_state_listener is not None:
+            self.connection_state_listener( old_state, new_state )
+        return old_state
+
+    def get_connection_state( self ):
+        """One of STATE_DISCONNECTED, STATE_CONNECTING (sockets open, no frame yet),
+        STATE_STREAMING, STATE_STALLED (nothing for stall_timeout seconds) and
+        STATE_RECONNECTING (reconnect attempts with backoff until frames arrive again)."""
+        return self.__connection_state
+
+    def service_session( self, now=None ):
+        """Run the connection supervisor once: send a keep alive to a unicast server
+        when one is due, detect a stalled stream and make reconnect attempts.
+        run() calls this from its supervisor thread; call it yourself a few times
+        per second when driving the sockets from your own event loop."""
+        if now is None:
+            now = time.monotonic()
+        if not self.use_multicast and now >= self.__next_keep_alive:
+            # fixed rate, but do not try to catch up after a long pause
+            self.__next_keep_alive = max( self.__next_keep_alive + self.keep_alive_interval, now )
+            self.__send_session_keep_alive()
+        self.__supervise( now )
+
+    def __send_session_keep_alive( self ):
+        try:
+            sent = self.send_keep_alive( self.command_socket, self.server_ip_address, self.command_port )
+        except (OSError, AttributeError):
+            return
+        with self.__session_lock:
+            self.__session_stats["keep_alives_sent"] += 1
+            self.__session_stats["keep_alive_bytes"] += sent
+
+    def __supervise( self, now ):
+        state = self.__connection_state
+        if state in (self.STATE_CONNECTING, self.STATE_STREAMING):
+            if self.use_data_socket:
+                last_activity = self.__last_frame_datagram
+            else:
+                # nothing is streamed: only requests the server leaves unanswered count
+                last_activity = self.__first_unanswered_request
+                if last_activity is None:
+                    return
+            if now - last_activity <= self.stall_timeout:
+                return
+            if self.__set_connection_state( self.STATE_STALLED, (state,) ) is None:
+                return
+            trace( "Nothing received for %1.1f s"% (now - last_activity) )
+            self.__current_backoff = self.reconnect_backoff
+            self.__next_reconnect_attempt = now
+        elif state not in (self.STATE_STALLED, self.STATE_RECONNECTING):
+            return
+        if now < self.__next_reconnect_attempt:
+            return
+        self.__next_reconnect_attempt = now + self.__current_backoff
+        self.__current_backoff = min( self.__current_backoff * 2, self.reconnect_backoff_max )
+        if self.__set_connection_state( self.STATE_RECONNECTING, (self.STATE_STALLED, self.STATE_RECONNECTING) ) is None \
+                and self.__connection_state != self.STATE_RECONNECTING:
+            # frames came back in the meantime
+            return
+        self.__reconnect()
+
+    # Keep the sockets unless their receive thread died, and connect again
+    def __reconnect( self ):
+        with self.__session_lock:
+            self.__session_stats["reconnect_attempts"] += 1
+        try:
+            self.__restart_receive_threads()
+            if self.use_multicast and self.data_socket is not None:
+                self.__rejoin_multicast_group( self.data_socket )
+            # no retries, the supervisor makes the next attempt itself
+            self.send_request_async( self.NAT_CONNECT, retries=0 )
+        except OSError as e:
+            trace( "Reconnect attempt failed: %s"% e )
+
+    # Leave and join the group again, so that switches with IGMP snooping that
+    # forgot about us (e.g. after a restart) forward the stream again
+    def __rejoin_multicast_group( self, in_socket ):
+        mreq = socket.inet_aton(self.multicast_address) + socket.inet_aton(self.local_ip_address)
+        try:
+            in_socket.setsockopt( socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq )
+        except OSError:
+            pass
+        in_socket.setsockopt( socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq )
+
+    # Receive threads only return on their own after a socket error: replace
+    # that socket and start the thread again. Healthy sockets are kept.
+    def __restart_receive_threads( self ):
+        if self.stop_threads:
+            return
+        if self.data_thread is not None and not self.data_thread.is_alive():
+            trace( "Data thread ended, opening a new data socket" )
+            if self.data_socket is not None:
+                self.data_socket.close()
+            self.data_socket = self.__create_data_socket( self.data_port )
+            if self.data_socket is not None:
+                self.__start_data_thread()
+        if self.command_thread is not None and not self.command_thread.is_alive():
+            trace( "Command thread ended, opening a new command socket" )
+            if self.command_socket is not None:
+                self.command_socket.close()
+            self.command_socket = self.__create_command_socket()
+            if self.command_socket is not None:
+                self.__start_command_thread()
+
+    def __start_data_thread( self ):
+        self.data_thread = Thread( target = self.__data_thread_function, args = (self.data_socket, lambda : self.stop_threads, lambda : self.print_level, ))
+        self.data_thread.start()
 
+    def __start_command_thread( self ):
+        self.command_thread = Thread( target = self.__command_thread_function, args = (self.command_socket, lambda : self.stop_threads, lambda : self.print_level,))
+        self.command_thread.start()
+
+    def __supervisor_thread_function( self ):
+        # short ticks, so stalls and backoff steps are handled on time
+        while not self.__session_stop.wait( 0.1 ):
+            self.service_session()
+        return 0
 
+    def open_sockets( self ):
+        """Create the data and command sockets without starting receive threads.
+        run() calls this itself; use it directly to drive the sockets from your own event loop."""
+        if self.__model_def_cache is not None:
+            self.__load_cached_model_def()
+        now = time.monotonic()
+        self.__last_server_message = now
+        self.__last_frame_datagram = now
+        self.__first_unanswered_request = None
+        self.__next_keep_alive = now + self.keep_alive_interval
 
-    def run( self ):
         # Create the data socket
-        self.data_socket = self.__create_data_socket( self.data_port )
-        if self.data_socket is None :
-            # # print( "Could not open data channel" )
-            return False
+        if self.use_data_socket:
+            self.data_socket = self.__create_data_socket( self.data_port )
+            if self.data_socket is None :
+                # # print( "Could not open data channel" )
+                return False
 
         # Create the command socket
         self.command_socket = self.__create_command_socket()
         if self.command_socket is None :
             # # print( "Could not open command channel" )
             return False
-        self.__is_locked = True
+        self.__set_connection_state( self.STATE_CONNECTING )
+        return True
+
+    def send_connect( self ):
+        """Send NAT_CONNECT, the server answers with NAT_SERVERINFO"""
+        return self.send_request( self.command_socket, self.NAT_CONNECT, "",  (self.server_ip_address, self.command_port) )
+
+    def wait_until_ready( self, timeout=5.0 ):
+        """Run the connect handshake on a running client and block until the server
+        answered NAT_CONNECT, the bitstream version query and the model definition
+        request, and the first frame has been decoded (or fetched, without data socket).
+        Returns False if that did not happen within timeout seconds. The requests
+        keep being retried then, and the ones of the phases not reached yet are
+        sent anyway, so the client still completes the handshake later.
+        The duration of every phase is available from get_connect_timings().
+        When replaying a recording only the first frame is waited for."""
+        timings = {}
+        self.__connect_timings = timings
+        start = time.monotonic()
+        deadline = start + timeout
+        if self.__replay is not None:
+            # server info and model definitions are part of the recording
+            if not self.__first_frame_event.wait( timeout ):
+                return False
+            timings["first_frame"] = timings["total"] = time.monotonic() - start
+            return True
+        phases = [
+            ("server_info", lambda : self.send_request_async( self.NAT_CONNECT )),
+            ("bitstream",   lambda : self.send_command_async( "Bitstream" )),
+            ("model_def",   lambda : self.request_model_definitions_async()),
+            ("first_frame", None if self.use_data_socket else self.fetch_frame_async),
+        ]
+        for index, (name, request) in enumerate( phases ):
+            phase_start = time.monotonic()
+            remaining = max( deadline - phase_start, 0 )
+            if request is None:
+                ready = self.__first_frame_event.wait( remaining )
+            else:
+                # servers without bitstream support reject the query, the version
+                # from NAT_SERVERINFO stays in use then
+                ready = self.__wait_for_phase( request(), remaining, allow_rejected=(name == "bitstream") )
+            if not ready:
+                trace( "Connect phase %s timed out"% name )
+                # the server answers in order, nothing needs to wait for the answers
+                for later_name, later_request in phases[index+1:]:
+                    if later_request is not None:
+                        later_request()
+                return False
+            timings[name] = time.monotonic() - phase_start
+        timings["total"] = time.monotonic() - start
+        return True
+
+    def __wait_for_phase( self, future, timeout, allow_rejected=False ):
+        from concurrent import futures
+        try:
+            future.result( timeout )
+        except RuntimeError:
+            return allow_rejected
+        except (TimeoutError, futures.TimeoutError, futures.CancelledError, OSError):
+            # not cancelled: the caller gave up waiting, but the request keeps
+            # its retries and its answer is still applied when it arrives
+            return False
+        return True
+
+    def get_connect_timings( self ):
+        """Seconds spent in each phase of the last wait_until_ready(): server_info,
+        bitstream, model_def, first_frame and their total. Phases that did not
+        complete are missing."""
+        return dict(self.__connect_timings)
+
+    def run( self, wait_until_ready=False, timeout=5.0 ):
+        """Open the sockets, start the receive threads and connect to the server.
+        Returns right away, unless wait_until_ready is True: then it returns
+        wait_until_ready(timeout), and the client keeps running either way."""
+        if self.__replay is not None:
+            return self.__run_replay( wait_until_ready, timeout )
+        if not self.open_sockets():
+            return False
+        self.start_processing()
+        self.__first_frame_event.clear()
 
         self.stop_threads = False
         # Create a separate thread for receiving data packets
-        self.data_thread = Thread( target = self.__data_thread_function, args = (self.data_socket, lambda : self.stop_threads, lambda : self.print_level, ))
-        self.data_thread.start()
+        if self.use_data_socket:
+            self.__start_data_thread()
 
         # Create a separate thread for receiving command packets
-        self.command_thread = Thread( target = self.__command_thread_function, args = (self.command_socket, lambda : self.stop_threads, lambda : self.print_level,))
-        self.command_thread.start()
+        self.__start_command_thread()
+
+        # Keep alives, stall detection and reconnects
+        self.__session_stop.clear()
+        self.supervisor_thread = Thread( target = self.__supervisor_thread_function, daemon = True )
+        self.supervisor_thread.start()
 
         # Required for setup
         # Get NatNet and server versions
-        self.send_request(self.command_socket, self.NAT_CONNECT, "",  (self.server_ip_address, self.command_port) )
+        if wait_until_ready:
+            return self.wait_until_ready( timeout )
+        self.send_request_async( self.NAT_CONNECT )
+        if self.__model_def_cache is not None or self.__recorder is not None:
+            # check the cached definitions against the server in the background,
+            # recordings need them to be decoded later
+            self.request_model_definitions_async()
 
 
         ##Example Commands
@@ -1853,18 +3053,48 @@ class NatNetClient:
         #self.send_request(self.command_socket, self.NAT_REQUEST_MODELDEF, "",  (self.server_ip_address, self.command_port) )
         return True
 
+    def __run_replay( self, wait_until_ready, timeout ):
+        self.start_processing()
+        self.__first_frame_event.clear()
+        self.__set_connection_state( self.STATE_CONNECTING )
+        self.__replay.start()
+        if wait_until_ready:
+            return self.wait_until_ready( timeout )
+        return True
+
     def shutdown(self):
         # # print("shutdown called")
         self.stop_threads = True
-        # closing sockets causes blocking recvfrom to throw
-        # an exception and break the loop
+        if self.__replay is not None:
+            self.__replay.stop()
+        self.__session_stop.set()
+        # threads are not joined from themselves, e.g. when a listener calls shutdown()
+        current_thread = threading.current_thread()
+        # the supervisor goes first, it restarts receive threads that ended
+        if self.supervisor_thread and self.supervisor_thread is not current_thread:
+            self.supervisor_thread.join()
+        self.supervisor_thread = None
+        self.__requests.cancel_all()
+        with self.__model_def_refresh_lock:
+            if self.__model_def_refresh_timer is not None:
+                self.__model_def_refresh_timer.cancel()
+                self.__model_def_refresh_timer = None
+        # the receive threads notice stop_threads within receive_timeout seconds,
+        # the sockets are closed once nothing uses them anymore
+        for thread in (self.command_thread, self.data_thread):
+            if thread is not None and thread is not current_thread:
+                thread.join()
+        self.command_thread = None
+        self.data_thread = None
         if self.command_socket:
             self.command_socket.close()
         if self.data_socket:
             self.data_socket.close()
-        # attempt to join the threads back with timeout
-        if self.command_thread:
-            self.command_thread.join(timeout=2.0)
-        if self.data_thread:
-            self.data_thread.join(timeout=2.0)
+        self.__stop_processing()
+        # the receive threads are gone, nothing records anymore
+        self.set_record_streaming( None )
+        if self.__flight_recorder is not None:
+            # no triggered dumps after shutdown, dump_flight_recorder() still works
+            self.__flight_recorder.close()
+        self.__set_connection_state( self.STATE_DISCONNECTED )
 
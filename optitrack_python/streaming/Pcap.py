@@ -0,0 +1,355 @@
+# NatNet datagrams from packet captures (tcpdump, Wireshark, dumpcap).
+#
+# PcapReader reads pcap and pcapng files one packet at a time and yields the
+# payloads of the UDP datagrams of the NatNet ports with their capture times:
+# frames and other data channel datagrams sent to or from the data port, and
+# the server's replies from the command port. IPv4 fragments, which every
+# frame larger than one Ethernet packet arrives as, are reassembled. Supported
+# link types are Ethernet (with VLAN tags), Linux cooked captures (tcpdump -i
+# any), raw IPv4 and BSD loopback.
+#
+# feed_pcap() passes the datagrams to a NatNetClient like a replay does,
+# convert_pcap() writes them to a recording (see Recording.py), which can then
+# be replayed in real time, indexed, archived or exported.
+
+import os
+import struct
+import time
+
+from .Recording import RecordingWriter, DATA_CHANNEL, COMMAND_CHANNEL
+
+PCAP_MAGIC_MICROSECONDS = 0xA1B2C3D4
+PCAP_MAGIC_NANOSECONDS = 0xA1B23C4D
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_OBSOLETE_PACKET = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IP_PROTOCOL_UDP = 17
+
+NAT_FRAMEOFDATA_ID = (7).to_bytes(2, "little")
+
+DEFAULT_COMMAND_PORT = 1510
+DEFAULT_DATA_PORT = 1511
+
+# Incomplete fragmented datagrams are dropped after this many seconds of capture time
+FRAGMENT_TIMEOUT = 10.0
+
+IPv4Header = struct.Struct( '!BBHHHBBH4s4s' )
+UDPHeader = struct.Struct( '!HHHH' )
+
+
+class PcapReader:
+    """NatNet datagrams of the pcap or pcapng capture at path.
+
+    datagrams() yields (channel, time_ns, data, server_address) for every
+    NatNet datagram in capture order: channel is DATA_CHANNEL or
+    COMMAND_CHANNEL, time_ns the capture time in ns since the epoch and
+    server_address the address of the Motive host. With server_address set,
+    datagrams of other servers are skipped.
+    """
+    def __init__(self, path, command_port=DEFAULT_COMMAND_PORT, data_port=DEFAULT_DATA_PORT,
+                 server_address=None, fragment_timeout=FRAGMENT_TIMEOUT):
+        self.path = path
+        self.command_port = command_port
+        self.data_port = data_port
+        self.server_address = server_address
+        self.fragment_timeout_ns = int(fragment_timeout * 1e9)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.packets = 0
+        self.natnet_datagrams = 0
+        self.bytes = 0
+        self.truncated = 0
+        self.reassembled = 0
+        self.fragments_dropped = 0
+        self.unsupported_link_type = 0
+        self.first_time_ns = None
+        self.last_time_ns = None
+
+    def datagrams(self):
+        # (source, destination, id) -> [first fragment time_ns, {offset: data}, total length or None]
+        self.__fragments = {}
+        self.__last_expiry_ns = 0
+        with open(self.path, "rb") as f:
+            magic = f.read(4)
+            if len(magic) < 4:
+                return
+            if int.from_bytes(magic, "big") == PCAPNG_SECTION_HEADER:
+                packets = self.__pcapng_packets(f, magic)
+            else:
+                packets = self.__pcap_packets(f, magic)
+            for link_type, time_ns, packet, original_length in packets:
+                self.packets += 1
+                if len(packet) < original_length:
+                    self.truncated += 1
+                    continue
+                datagram = self.__udp_datagram(link_type, time_ns, packet)
+                if datagram is not None:
+                    yield datagram
+
+    # Capture file formats, yield (link type, time_ns, packet bytes, original length)
+
+    def __pcap_packets(self, f, magic):
+        for byte_order in ("<", ">"):
+            value, = struct.unpack(byte_order + "I", magic)
+            if value in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+                break
+        else:
+            raise ValueError("not a pcap or pcapng file")
+        nanoseconds = value == PCAP_MAGIC_NANOSECONDS
+        header = f.read(20)
+        if len(header) < 20:
+            return
+        link_type = struct.unpack(byte_order + "I", header[16:20])[0] & 0xFFFF
+        record_header = struct.Struct(byte_order + "IIII")
+        read = f.read
+        while True:
+            header = read(record_header.size)
+            if len(header) < record_header.size:
+                return
+            seconds, fraction, captured_length, original_length = record_header.unpack(header)
+            packet = read(captured_length)
+            if len(packet) < captured_length:
+                return
+            time_ns = seconds * 1000000000 + (fraction if nanoseconds else fraction * 1000)
+            yield link_type, time_ns, packet, original_length
+
+    def __pcapng_packets(self, f, magic):
+        byte_order = "<"
+        # per interface of the current section: (link type, ns per tick numerator, denominator)
+        interfaces = []
+        block_type = int.from_bytes(magic, "big")
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            if block_type == PCAPNG_SECTION_HEADER:
+                # the byte order of the section follows the block length
+                byte_order_magic = f.read(4)
+                if len(byte_order_magic) < 4:
+                    return
+                byte_order = "<" if struct.unpack("<I", byte_order_magic)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+                block_length, = struct.unpack(byte_order + "I", header)
+                if block_length < 16:
+                    return
+                body = byte_order_magic + f.read(block_length - 16)
+                interfaces = []
+            else:
+                block_length, = struct.unpack(byte_order + "I", header)
+                if block_length < 12:
+                    return
+                body = f.read(block_length - 12)
+            trailer = f.read(4)
+            if len(body) < block_length - 12 or len(trailer) < 4:
+                return
+
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                interfaces.append(self.__pcapng_interface(body, byte_order))
+            elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_OBSOLETE_PACKET):
+                if block_type == PCAPNG_ENHANCED_PACKET:
+                    interface_id, high, low, captured_length, original_length = struct.unpack_from(byte_order + "IIIII", body)
+                else:
+                    interface_id, drops, high, low, captured_length, original_length = struct.unpack_from(byte_order + "HHIIII", body)
+                if interface_id < len(interfaces):
+                    link_type, numerator, denominator = interfaces[interface_id]
+                    time_ns = ((high << 32) | low) * numerator // denominator
+                    yield link_type, time_ns, body[20:20 + captured_length], original_length
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                if interfaces:
+                    original_length, = struct.unpack_from(byte_order + "I", body)
+                    # no timestamp in simple packet blocks
+                    yield interfaces[0][0], 0, body[4:4 + original_length], original_length
+
+            magic = f.read(4)
+            if len(magic) < 4:
+                return
+            # the section header block type reads the same in both byte orders
+            block_type, = struct.unpack(byte_order + "I", magic)
+
+    def __pcapng_interface(self, body, byte_order):
+        link_type, reserved, snap_length = struct.unpack_from(byte_order + "HHI", body)
+        # timestamps are in microseconds unless if_tsresol says otherwise
+        numerator, denominator = 1000, 1
+        position = 8
+        while position + 4 <= len(body):
+            code, length = struct.unpack_from(byte_order + "HH", body, position)
+            if code == 0:
+                break
+            if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+                resolution = body[position + 4]
+                if resolution & 0x80:
+                    numerator, denominator = 1000000000, 1 << (resolution & 0x7F)
+                else:
+                    numerator, denominator = 1000000000, 10 ** resolution
+            position += 4 + (length + 3) // 4 * 4
+        return link_type, numerator, denominator
+
+    # Link, network and transport layers
+
+    def __udp_datagram(self, link_type, time_ns, packet):
+        if link_type == LINKTYPE_ETHERNET:
+            ether_type = int.from_bytes(packet[12:14], "big")
+            offset = 14
+            while ether_type in ETHERTYPE_VLAN:
+                ether_type = int.from_bytes(packet[offset + 2:offset + 4], "big")
+                offset += 4
+            if ether_type != ETHERTYPE_IPV4:
+                return None
+        elif link_type == LINKTYPE_LINUX_SLL:
+            if int.from_bytes(packet[14:16], "big") != ETHERTYPE_IPV4:
+                return None
+            offset = 16
+        elif link_type == LINKTYPE_LINUX_SLL2:
+            if int.from_bytes(packet[0:2], "big") != ETHERTYPE_IPV4:
+                return None
+            offset = 20
+        elif link_type in LINKTYPE_RAW or link_type == LINKTYPE_IPV4:
+            offset = 0
+        elif link_type == LINKTYPE_NULL:
+            # address family in the byte order of the capturing host, AF_INET is 2
+            if packet[0:4] not in (b"\x02\x00\x00\x00", b"\x00\x00\x00\x02"):
+                return None
+            offset = 4
+        else:
+            self.unsupported_link_type += 1
+            return None
+
+        if len(packet) < offset + IPv4Header.size or packet[offset] >> 4 != 4:
+            return None
+        version_length, tos, total_length, identification, flags_fragment, ttl, protocol, checksum, source, destination = \
+            IPv4Header.unpack_from(packet, offset)
+        if protocol != IP_PROTOCOL_UDP:
+            return None
+        header_length = (version_length & 0x0F) * 4
+        # total_length drops the Ethernet padding of short packets
+        payload = packet[offset + header_length:offset + total_length]
+        more_fragments = flags_fragment & 0x2000
+        fragment_offset = (flags_fragment & 0x1FFF) * 8
+        if more_fragments or fragment_offset:
+            payload = self.__reassemble(time_ns, (source, destination, identification),
+                                        fragment_offset, more_fragments, payload)
+            if payload is None:
+                return None
+
+        if len(payload) < UDPHeader.size:
+            return None
+        source_port, destination_port, udp_length, udp_checksum = UDPHeader.unpack_from(payload)
+        if source_port == self.command_port:
+            # replies of the server; requests to it are not part of the stream.
+            # Frames sent from the command port (unicast) still go to the data channel.
+            channel = COMMAND_CHANNEL
+        elif source_port == self.data_port or destination_port == self.data_port:
+            channel = DATA_CHANNEL
+        else:
+            return None
+        server_address = "%d.%d.%d.%d" % tuple(source)
+        if self.server_address is not None and server_address != self.server_address:
+            return None
+        data = payload[UDPHeader.size:udp_length]
+        if channel == COMMAND_CHANNEL and data[0:2] == NAT_FRAMEOFDATA_ID:
+            channel = DATA_CHANNEL
+
+        self.natnet_datagrams += 1
+        self.bytes += len(data)
+        if self.first_time_ns is None:
+            self.first_time_ns = time_ns
+        self.last_time_ns = time_ns
+        return channel, time_ns, data, server_address
+
+    def __reassemble(self, time_ns, key, fragment_offset, more_fragments, payload):
+        fragments = self.__fragments
+        if time_ns - self.__last_expiry_ns > self.fragment_timeout_ns:
+            # datagrams that lost a fragment never complete
+            for expired in [k for k, entry in fragments.items() if time_ns - entry[0] > self.fragment_timeout_ns]:
+                del fragments[expired]
+                self.fragments_dropped += 1
+            self.__last_expiry_ns = time_ns
+        entry = fragments.get(key)
+        if entry is None:
+            entry = fragments[key] = [time_ns, {}, None]
+        entry[1][fragment_offset] = payload
+        if not more_fragments:
+            entry[2] = fragment_offset + len(payload)
+        total_length = entry[2]
+        if total_length is None:
+            return None
+        # complete when the fragments cover the datagram without holes
+        position = 0
+        parts = entry[1]
+        while position < total_length:
+            part = parts.get(position)
+            if part is None or not part:
+                return None
+            position += len(part)
+        del fragments[key]
+        self.reassembled += 1
+        return b"".join(parts[offset] for offset in sorted(parts))
+
+    def get_stats(self):
+        stats = {}
+        stats["packets"] = self.packets
+        stats["datagrams"] = self.natnet_datagrams
+        stats["bytes"] = self.bytes
+        stats["truncated"] = self.truncated
+        stats["reassembled"] = self.reassembled
+        stats["fragments_dropped"] = self.fragments_dropped
+        stats["unsupported_link_type"] = self.unsupported_link_type
+        duration = 0.0
+        if self.first_time_ns is not None:
+            duration = (self.last_time_ns - self.first_time_ns) / 1e9
+        stats["duration"] = duration
+        return stats
+
+
+def feed_pcap(client, path, **options):
+    """Pass the NatNet datagrams of a capture to client, as fast as possible:
+    data datagrams to process_datagram() with their capture time, replies of
+    the server to process_command_datagram(). options go to PcapReader.
+    Returns the reader's get_stats()."""
+    reader = PcapReader(path, **options)
+    for channel, time_ns, data, server_address in reader.datagrams():
+        if channel == DATA_CHANNEL:
+            client.process_datagram(data, time_ns)
+        else:
+            client.process_command_datagram(data)
+    return reader.get_stats()
+
+
+def convert_pcap(path, recording_path, **options):
+    """Write the NatNet datagrams of a capture to a recording, with their
+    capture times as receive times. options go to PcapReader. Returns the
+    reader's get_stats()."""
+    reader = PcapReader(path, **options)
+    header = {"source": "pcap", "pcap": os.path.basename(path),
+              "command_port": reader.command_port, "data_port": reader.data_port,
+              "created_time_ns": time.time_ns()}
+    writer = None
+    try:
+        for channel, time_ns, data, server_address in reader.datagrams():
+            if writer is None:
+                header["server_address"] = server_address
+                writer = RecordingWriter(recording_path, header)
+            # the capture clock is the only clock of a capture
+            writer.record(channel, data, time_ns, time_ns)
+        if writer is None:
+            writer = RecordingWriter(recording_path, header)
+    finally:
+        if writer is not None:
+            writer.close()
+    return reader.get_stats()
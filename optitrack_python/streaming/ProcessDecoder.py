@@ -0,0 +1,288 @@
+# Decode NatNet frames in worker processes.
+#
+# The receive thread copies each raw NAT_FRAMEOFDATA datagram into a slot of a
+# shared memory input block and hands the slot index to a pool of worker
+# processes. A worker decodes the frame and writes rigid body and labeled marker
+# columns into the matching slot of a shared memory output block. A collector
+# thread in the main process puts the results back into arrival order and
+# delivers them as columnar frames in that order.
+
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from array import array
+from multiprocessing import shared_memory
+
+# frame_number, flags, n_rigid_bodies, n_labeled_markers, timestamp
+SlotHeader = struct.Struct( '<iiiid' )
+
+FLAG_TRACKED_MODELS_CHANGED = 0x01
+FLAG_TRUNCATED              = 0x02
+
+# largest UDP payload
+MAX_DATAGRAM_SIZE = 64*1024
+
+
+class ColumnarFrameLayout:
+    """Fixed layout of one output slot: a header followed by preallocated columns."""
+    def __init__(self, max_rigid_bodies=256, max_labeled_markers=2048):
+        self.max_rigid_bodies = max_rigid_bodies
+        self.max_labeled_markers = max_labeled_markers
+        # (name, typecode, values per entry, entry count)
+        self.columns = [
+            ("ids", 'i', 1, max_rigid_bodies),
+            ("positions", 'f', 3, max_rigid_bodies),
+            ("rotations", 'f', 4, max_rigid_bodies),
+            ("errors", 'f', 1, max_rigid_bodies),
+            ("skeleton_ids", 'i', 1, max_rigid_bodies),
+            ("valid", 'b', 1, max_rigid_bodies),
+            ("labeled_marker_ids", 'i', 1, max_labeled_markers),
+            ("labeled_marker_positions", 'f', 3, max_labeled_markers),
+            ("labeled_marker_sizes", 'f', 1, max_labeled_markers),
+            ("labeled_marker_residuals", 'f', 1, max_labeled_markers),
+        ]
+        self.offsets = {}
+        offset = SlotHeader.size
+        for name, typecode, width, count in self.columns:
+            self.offsets[name] = offset
+            offset += array(typecode).itemsize * width * count
+        # keep slots 8 byte aligned
+        self.slot_size = (offset + 7) & ~7
+
+    def write(self, buf, slot, mocap_data):
+        """Write the columns of a decoded MoCapData into a slot, returns the frame number"""
+        base = slot * self.slot_size
+        flags = 0
+        if mocap_data.suffix_data.tracked_models_changed:
+            flags |= FLAG_TRACKED_MODELS_CHANGED
+
+        columns = {}
+        for name, typecode, width, count in self.columns:
+            columns[name] = array(typecode)
+
+        bodies = [(rigid_body, -1) for rigid_body in mocap_data.rigid_body_data.rigid_body_list]
+        for skeleton in mocap_data.skeleton_data.skeleton_list:
+            bodies.extend((rigid_body, skeleton.id_num) for rigid_body in skeleton.rigid_body_list)
+        if len(bodies) > self.max_rigid_bodies:
+            bodies = bodies[:self.max_rigid_bodies]
+            flags |= FLAG_TRUNCATED
+        for rigid_body, skeleton_id in bodies:
+            columns["ids"].append(rigid_body.id_num)
+            columns["positions"].extend(rigid_body.pos)
+            columns["rotations"].extend(rigid_body.rot)
+            columns["errors"].append(rigid_body.error)
+            columns["skeleton_ids"].append(skeleton_id)
+            columns["valid"].append(rigid_body.tracking_valid)
+
+        markers = mocap_data.labeled_marker_data.labeled_marker_list
+        if len(markers) > self.max_labeled_markers:
+            markers = markers[:self.max_labeled_markers]
+            flags |= FLAG_TRUNCATED
+        for marker in markers:
+            columns["labeled_marker_ids"].append(marker.id_num)
+            columns["labeled_marker_positions"].extend(marker.pos)
+            columns["labeled_marker_sizes"].append(marker.size)
+            columns["labeled_marker_residuals"].append(marker.residual)
+
+        for name, column in columns.items():
+            start = base + self.offsets[name]
+            raw = memoryview(column).cast('B')
+            buf[start:start+len(raw)] = raw
+
+        frame_number = mocap_data.prefix_data.frame_number
+        SlotHeader.pack_into(buf, base, frame_number, flags, len(bodies), len(markers),
+                             mocap_data.suffix_data.timestamp)
+        return frame_number
+
+    def read(self, buf, slot):
+        """Copy a slot out of shared memory into a frame dictionary of arrays"""
+        base = slot * self.slot_size
+        frame_number, flags, n_rigid_bodies, n_labeled_markers, timestamp = SlotHeader.unpack_from(buf, base)
+        frame = {}
+        frame["frame_number"] = frame_number
+        frame["timestamp"] = timestamp
+        frame["tracked_models_changed"] = (flags & FLAG_TRACKED_MODELS_CHANGED) != 0
+        frame["truncated"] = (flags & FLAG_TRUNCATED) != 0
+        frame["count"] = n_rigid_bodies
+        frame["labeled_marker_count"] = n_labeled_markers
+        for name, typecode, width, count in self.columns:
+            n = n_labeled_markers if name.startswith("labeled_marker") else n_rigid_bodies
+            column = array(typecode)
+            start = base + self.offsets[name]
+            column.frombytes(buf[start:start + column.itemsize*width*n])
+            frame[name] = column
+        return frame
+
+
+def _decode_worker(input_name, output_name, layout, task_queue, result_queue):
+    # Imported here so the worker does not depend on how the parent imported us
+    from optitrack_python.streaming.NatNetClient import NatNetClient
+
+    # Workers share the parent's resource tracker, so attaching here does not
+    # make the segments outlive (or die with) a worker; the parent unlinks them.
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    decoder = NatNetClient()
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, length, major, minor = task
+            start = slot * MAX_DATAGRAM_SIZE
+            frame_number = None
+            error = None
+            try:
+                mocap_data = decoder.unpack_frame_of_data(bytes(input_shm.buf[start:start+length]), major, minor)
+                frame_number = layout.write(output_shm.buf, slot, mocap_data)
+            except Exception as e:
+                # a malformed datagram only costs its own frame
+                error = "%s: %s" % (type(e).__name__, e)
+            result_queue.put((slot, frame_number, error))
+    finally:
+        input_shm.close()
+        output_shm.close()
+
+
+class ProcessDecoder:
+    """Pool of decode processes fed through shared memory slots.
+
+    frame_callback(frame) is called from the collector thread, in arrival order,
+    with the dictionary returned by ColumnarFrameLayout.read() plus the
+    rx_timestamp_ns passed to submit(). error_callback(message) is called from
+    the collector thread for the first frame that fails to decode; the message of
+    the last failure is kept in the stats.
+    """
+    def __init__(self, frame_callback, num_workers=2, num_slots=None,
+                 max_rigid_bodies=256, max_labeled_markers=2048, error_callback=None):
+        self.frame_callback = frame_callback
+        self.error_callback = error_callback
+        self.num_workers = num_workers
+        if num_slots is None:
+            num_slots = 8 * num_workers
+        self.num_slots = num_slots
+        self.layout = ColumnarFrameLayout(max_rigid_bodies, max_labeled_markers)
+
+        self.input_shm = None
+        self.output_shm = None
+        self.workers = []
+        self.collector_thread = None
+
+        self.submitted = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.decode_errors = 0
+        self.last_decode_error = None
+
+    def start(self):
+        self.input_shm = shared_memory.SharedMemory(create=True, size=self.num_slots * MAX_DATAGRAM_SIZE)
+        self.output_shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.layout.slot_size)
+
+        context = multiprocessing.get_context()
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.free_slots = queue.Queue()
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+        # submission sequence number and receive time for every busy slot
+        self.slot_info = [None] * self.num_slots
+        self.next_sequence = 0
+
+        for _ in range(self.num_workers):
+            worker = context.Process(target=_decode_worker,
+                                     args=(self.input_shm.name, self.output_shm.name, self.layout,
+                                           self.task_queue, self.result_queue),
+                                     daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        self.collector_thread = threading.Thread(target=self.__collector_thread_function, daemon=True)
+        self.collector_thread.start()
+
+    def submit(self, data, major, minor, rx_timestamp_ns=None, block=False):
+        """Hand a raw NAT_FRAMEOFDATA datagram to the workers.
+        Returns False (and counts a drop) when no slot is free and block is False."""
+        try:
+            slot = self.free_slots.get(block=block)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        length = len(data)
+        start = slot * MAX_DATAGRAM_SIZE
+        self.input_shm.buf[start:start+length] = data
+        self.slot_info[slot] = (self.submitted, rx_timestamp_ns)
+        self.submitted += 1
+        self.task_queue.put((slot, length, major, minor))
+        return True
+
+    def __collector_thread_function(self):
+        # results by submission sequence, delivered strictly in sequence
+        pending = {}
+        next_sequence = 0
+        while True:
+            result = self.result_queue.get()
+            if result is None:
+                break
+            slot, frame_number, error = result
+            sequence, rx_timestamp_ns = self.slot_info[slot]
+            pending[sequence] = (slot, frame_number, error, rx_timestamp_ns)
+
+            while next_sequence in pending:
+                slot, frame_number, error, rx_timestamp_ns = pending.pop(next_sequence)
+                next_sequence += 1
+                frame = None
+                if frame_number is None:
+                    self.decode_errors += 1
+                    self.last_decode_error = error
+                    if self.decode_errors == 1 and self.error_callback is not None:
+                        self.error_callback(error)
+                else:
+                    frame = self.layout.read(self.output_shm.buf, slot)
+                    frame["rx_timestamp_ns"] = rx_timestamp_ns
+                self.slot_info[slot] = None
+                if frame is not None:
+                    self.delivered += 1
+                    self.frame_callback(frame)
+                self.free_slots.put(slot)
+
+    def get_stats(self):
+        stats = {}
+        stats["submitted"] = self.submitted
+        stats["dropped"] = self.dropped
+        stats["delivered"] = self.delivered
+        stats["decode_errors"] = self.decode_errors
+        stats["last_decode_error"] = self.last_decode_error
+        stats["free_slots"] = self.free_slots.qsize()
+        return stats
+
+    def wait_idle(self, timeout=None):
+        """Block until every submitted datagram has been delivered or dropped"""
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while self.free_slots.qsize() < self.num_slots:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        if self.collector_thread is not None:
+            self.result_queue.put(None)
+            self.collector_thread.join(timeout=2.0)
+            self.collector_thread = None
+        for shm in (self.input_shm, self.output_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.input_shm = None
+        self.output_shm = None
@@ -0,0 +1,428 @@
+# Raw NatNet datagram recordings.
+#
+# A recording keeps exactly the bytes Motive sent, so it is decoded by the same
+# code as a live stream, by any later version of it.
+#
+# File layout, all integers little endian:
+#
+#   magic            8 bytes  b"NATREC\x00\x01"
+#   header length    uint32
+#   header           JSON (server address, ports, NatNet version, start time)
+#   records          until the end of the file, each one
+#       length           uint32   number of datagram bytes
+#       message id       int16    NatNet message id, peeked from the datagram
+#       channel          uint8    DATA_CHANNEL or COMMAND_CHANNEL
+#       reserved         uint8
+#       monotonic_ns     int64    time.monotonic_ns() at receive
+#       time_ns          int64    wall clock receive time in ns since the epoch,
+#                                 the kernel timestamp when enabled
+#       datagram         length bytes
+#
+# Next to every recording the writer keeps a sparse index, <recording>.idx:
+#
+#   magic            8 bytes  b"NATIDX\x00\x01"
+#   entries          until the end of the file, each one
+#       offset           uint64   file offset of the record
+#       monotonic_ns     int64    as in the record
+#       time_ns          int64    as in the record
+#       frame number     int32    -1 for command records
+#       message id       int16
+#       channel          uint8
+#       reserved         uint8
+#
+# There is an entry for every INDEX_INTERVAL-th frame and for every command
+# channel record that is not a frame (server info, model definitions,
+# responses), which are needed to decode frames after a seek. The index is
+# only a shortcut: the reader completes a missing or partial one from the
+# recording itself.
+
+import bisect
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"NATREC\x00\x01"
+INDEX_MAGIC = b"NATIDX\x00\x01"
+FILE_EXTENSION = ".natrec"
+INDEX_EXTENSION = ".idx"
+
+DATA_CHANNEL = 0
+COMMAND_CHANNEL = 1
+
+NAT_FRAMEOFDATA = 7
+
+HeaderLength = struct.Struct( '<I' )
+RecordHeader = struct.Struct( '<IhBxqq' )
+IndexEntry = struct.Struct( '<QqqihBx' )
+
+# Writes go through a buffer of this size, the receive threads never wait for the disk
+WRITE_BUFFER_SIZE = 1024*1024
+
+# One index entry per this many frames; a seek reads at most that many records
+INDEX_INTERVAL = 120
+
+
+def index_path_of(path):
+    return path + INDEX_EXTENSION
+
+
+def frame_number_of(data):
+    """Frame number of a NAT_FRAMEOFDATA datagram, without decoding it"""
+    return int.from_bytes(data[4:8], byteorder='little', signed=True)
+
+
+class RecordingWriter:
+    """Append raw datagrams to a recording file and its index.
+
+    record() may be called from several receive threads. It only packs a
+    24 byte record header and copies both into the write buffer.
+    """
+    def __init__(self, path, header=None, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.header = dict(header or {})
+        self.header.setdefault("created_time_ns", time.time_ns())
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self.records = 0
+        self.frames = 0
+        self.bytes_written = 0
+        self.__file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.__index_file = open(index_path_of(path), "wb")
+        self.__index_file.write(INDEX_MAGIC)
+        import json
+        header_bytes = json.dumps(self.header, sort_keys=True).encode("utf-8")
+        self.__file.write(MAGIC + HeaderLength.pack(len(header_bytes)) + header_bytes)
+        self.bytes_written = len(MAGIC) + HeaderLength.size + len(header_bytes)
+
+    def record(self, channel, data, time_ns=None, monotonic_ns=None):
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if time_ns is None:
+            time_ns = time.time_ns()
+        message_id = -1
+        if len(data) >= 2:
+            message_id = int.from_bytes(data[0:2], byteorder='little', signed=True)
+        record_header = RecordHeader.pack(len(data), message_id, channel, monotonic_ns, time_ns)
+        with self.lock:
+            if self.__file is None:
+                return
+            offset = self.bytes_written
+            self.__file.write(record_header)
+            self.__file.write(data)
+            self.records += 1
+            self.bytes_written += RecordHeader.size + len(data)
+            if message_id == NAT_FRAMEOFDATA and channel == DATA_CHANNEL:
+                if self.frames % self.index_interval == 0:
+                    self.__index_file.write(IndexEntry.pack(offset, monotonic_ns, time_ns,
+                        frame_number_of(data), message_id, channel))
+                self.frames += 1
+            elif channel == COMMAND_CHANNEL and message_id != NAT_FRAMEOFDATA:
+                self.__index_file.write(IndexEntry.pack(offset, monotonic_ns, time_ns,
+                    -1, message_id, channel))
+
+    def flush(self):
+        with self.lock:
+            if self.__file is not None:
+                # the recording first, an index entry must never point past its end
+                self.__file.flush()
+                self.__index_file.flush()
+
+    def sync(self):
+        """Flush and wait until the recording and its index are on disk"""
+        with self.lock:
+            if self.__file is not None:
+                self.__file.flush()
+                self.__index_file.flush()
+                os.fsync(self.__file.fileno())
+                os.fsync(self.__index_file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__index_file.close()
+                self.__file = None
+                self.__index_file = None
+
+    def get_stats(self):
+        stats = {}
+        stats["path"] = self.path
+        stats["records"] = self.records
+        stats["frames"] = self.frames
+        stats["bytes_written"] = self.bytes_written
+        return stats
+
+
+def read_header(in_file):
+    """Read the header of a recording opened in binary mode.
+    Returns the header dictionary, the file is left at the first record."""
+    magic = in_file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("not a NatNet recording")
+    header_length, = HeaderLength.unpack(in_file.read(HeaderLength.size))
+    import json
+    return json.loads(in_file.read(header_length).decode("utf-8"))
+
+
+class RecordingReader:
+    """Access to the records of a recording, with seeks through its index.
+
+    The file is memory mapped: records are memoryview slices of the mapping,
+    nothing is copied or decoded until used, and processes reading the same
+    recording share it through the page cache.
+
+    records() yields (channel, message_id, monotonic_ns, time_ns, data) tuples
+    in the order they were received, from the start or from an offset returned
+    by seek_frame() or seek_time(). A record cut short by an interrupted
+    recording ends the iteration. frames() gives random access to the frames.
+    """
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        import mmap
+        self.path = path
+        self.index_interval = index_interval
+        with open(path, "rb") as f:
+            self.header = read_header(f)
+            self.data_offset = f.tell()
+            self.file_size = os.fstat(f.fileno()).st_size
+            # the mapping stays valid after the file is closed
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+
+        # sparse frame index, sorted by offset
+        self.__entries = []
+        self.frame_offsets = []
+        self.frame_numbers = []
+        self.frame_times = []
+        # (offset, message_id) of command records other than frames
+        self.command_offsets = []
+        self.__load_index()
+        # offsets of all frame records, see frame_record_offsets()
+        self.__all_frame_offsets = None
+
+    def __read_record_header(self, offset):
+        if offset + RecordHeader.size > self.file_size:
+            return None
+        length, message_id, channel, monotonic_ns, time_ns = RecordHeader.unpack_from(self.__view, offset)
+        if offset + RecordHeader.size + length > self.file_size:
+            return None
+        return length, message_id, channel, monotonic_ns, time_ns
+
+    def __frame_number_at(self, offset):
+        return frame_number_of(self.__view[offset + RecordHeader.size:offset + RecordHeader.size + 8])
+
+    def records(self, offset=None, end=None):
+        """Records from offset (default: the first one) up to, not including,
+        the record at offset end (default: the end of the recording)"""
+        if offset is None:
+            offset = self.data_offset
+        view = self.__view
+        file_size = self.file_size
+        if end is not None and end < file_size:
+            file_size = end
+        unpack_from = RecordHeader.unpack_from
+        while offset + RecordHeader.size <= file_size:
+            length, message_id, channel, monotonic_ns, time_ns = unpack_from(view, offset)
+            start = offset + RecordHeader.size
+            offset = start + length
+            if offset > file_size:
+                return
+            yield channel, message_id, monotonic_ns, time_ns, view[start:offset]
+
+    def record_at(self, offset):
+        """The record at a file offset, as yielded by records()"""
+        return next(self.records(offset))
+
+    def __iter__(self):
+        return self.records()
+
+    # Index
+
+    def __add_index_entry(self, offset, monotonic_ns, time_ns, frame_number, message_id, channel):
+        self.__entries.append((offset, monotonic_ns, time_ns, frame_number, message_id, channel))
+        if frame_number >= 0:
+            self.frame_offsets.append(offset)
+            self.frame_numbers.append(frame_number)
+            self.frame_times.append(monotonic_ns)
+        else:
+            self.command_offsets.append((offset, message_id))
+
+    def __load_index(self):
+        index_path = index_path_of(self.path)
+        entries = []
+        try:
+            with open(index_path, "rb") as f:
+                content = f.read()
+            if content[:len(INDEX_MAGIC)] == INDEX_MAGIC:
+                end = len(content) - (len(content) - len(INDEX_MAGIC)) % IndexEntry.size
+                entries = [entry for entry in IndexEntry.iter_unpack(content[len(INDEX_MAGIC):end])
+                           if entry[0] < self.file_size]
+        except OSError:
+            pass
+        # a missing index is built from the start, a partial one (recording still
+        # running or interrupted) completed from its last entry
+        scan_offset = self.data_offset
+        frames_since_entry = 0
+        if entries:
+            last_entry = entries[-1]
+            scan_offset = last_entry[0]
+            record = self.__read_record_header(scan_offset)
+            if record is None:
+                entries.pop()
+            else:
+                scan_offset += RecordHeader.size + record[0]
+                if last_entry[3] >= 0:
+                    frames_since_entry = 1
+        for entry in entries:
+            self.__add_index_entry(*entry)
+        appended = self.__scan(scan_offset, frames_since_entry)
+        if appended:
+            self.__write_index(index_path)
+
+    def __scan(self, offset, frames_since_entry):
+        """Index the records from offset to the end, returns the number of new entries"""
+        appended = 0
+        while True:
+            record = self.__read_record_header(offset)
+            if record is None:
+                return appended
+            length, message_id, channel, monotonic_ns, time_ns = record
+            if message_id == NAT_FRAMEOFDATA and channel == DATA_CHANNEL:
+                if frames_since_entry % self.index_interval == 0:
+                    self.__add_index_entry(offset, monotonic_ns, time_ns, self.__frame_number_at(offset),
+                                           message_id, channel)
+                    appended += 1
+                frames_since_entry += 1
+            elif channel == COMMAND_CHANNEL and message_id != NAT_FRAMEOFDATA:
+                self.__add_index_entry(offset, monotonic_ns, time_ns, -1, message_id, channel)
+                appended += 1
+            offset += RecordHeader.size + length
+
+    def __write_index(self, index_path):
+        content = INDEX_MAGIC + b"".join(IndexEntry.pack(*entry) for entry in self.__entries)
+        tmp_path = index_path + ".tmp%d"% os.getpid()
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            # read only location, the index is rebuilt next time
+            pass
+
+    def __seek_from_entry(self, position, predicate):
+        """Offset of the first frame record at or after index entry position for
+        which predicate(frame_number, monotonic_ns) holds, or None."""
+        if position < 0:
+            position = 0
+        if position >= len(self.frame_offsets):
+            return None
+        offset = self.frame_offsets[position]
+        while True:
+            record = self.__read_record_header(offset)
+            if record is None:
+                return None
+            length, message_id, channel, monotonic_ns, time_ns = record
+            if message_id == NAT_FRAMEOFDATA and channel == DATA_CHANNEL:
+                if predicate(self.__frame_number_at(offset), monotonic_ns):
+                    return offset
+            offset += RecordHeader.size + length
+
+    def seek_frame(self, frame_number):
+        """File offset of the first frame with a frame number of at least
+        frame_number, or None. Assumes frame numbers increase over the
+        recording, as they do within one Motive session."""
+        position = bisect.bisect_right(self.frame_numbers, frame_number) - 1
+        return self.__seek_from_entry(position, lambda number, monotonic_ns: number >= frame_number)
+
+    def seek_time(self, seconds):
+        """File offset of the first frame received at least seconds after the
+        first frame of the recording, or None."""
+        if not self.frame_times:
+            return None
+        target_ns = self.frame_times[0] + int(seconds * 1e9)
+        position = bisect.bisect_right(self.frame_times, target_ns) - 1
+        return self.__seek_from_entry(position, lambda number, monotonic_ns: monotonic_ns >= target_ns)
+
+    def context_records(self, offset):
+        """The command records (server info, model definitions, responses)
+        received before offset, in order. Feeding them first lets frames from
+        offset on be decoded as if the recording had been replayed from the start."""
+        end = bisect.bisect_left(self.command_offsets, (offset,))
+        return [self.record_at(command_offset) for command_offset, message_id in self.command_offsets[:end]]
+
+    # Random access
+
+    def frame_record_offsets(self):
+        """Offsets of all frame records, in an array('Q'). Built from the record
+        headers on first use, which touches one page per record."""
+        if self.__all_frame_offsets is None:
+            from array import array
+            offsets = array('Q')
+            offset = self.data_offset
+            while True:
+                record = self.__read_record_header(offset)
+                if record is None:
+                    break
+                if record[1] == NAT_FRAMEOFDATA and record[2] == DATA_CHANNEL:
+                    offsets.append(offset)
+                offset += RecordHeader.size + record[0]
+            self.__all_frame_offsets = offsets
+        return self.__all_frame_offsets
+
+    def frames(self, client=None):
+        """The frames of the recording as a sequence of MoCapData, decoded on access"""
+        return RecordedFrames(self, client)
+
+    def close(self):
+        self.__view.release()
+        try:
+            self.__map.close()
+        except BufferError:
+            # records are still referenced, the mapping goes away with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordedFrames:
+    """Random access to the frames of a recording, decoded on access.
+
+    frames[i] decodes the i-th frame into a MoCapData (negative indices count
+    from the end); raw(i) returns its datagram as a memoryview. Frames are
+    decoded by client, a NatNetClient that is given the server info and model
+    definitions recorded before the first frame. Without client a private
+    one is created.
+    """
+    def __init__(self, reader, client=None):
+        self.reader = reader
+        self.offsets = reader.frame_record_offsets()
+        if client is None:
+            from .NatNetClient import NatNetClient
+            client = NatNetClient()
+            client.set_print_level(0)
+        self.client = client
+        if len(self.offsets) > 0:
+            for record in reader.context_records(self.offsets[0]):
+                client.process_command_datagram(record[4])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def raw(self, index):
+        return self.reader.record_at(self.offsets[index])[4]
+
+    def receive_time_ns(self, index):
+        """Recorded wall clock receive time of the i-th frame"""
+        return self.reader.record_at(self.offsets[index])[3]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        channel, message_id, monotonic_ns, time_ns, data = self.reader.record_at(self.offsets[index])
+        mocap_data = self.client.unpack_frame_of_data(data)
+        mocap_data.rx_timestamp_ns = time_ns
+        return mocap_data
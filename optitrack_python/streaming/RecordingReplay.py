@@ -0,0 +1,145 @@
+# Replay a recording through a NatNetClient.
+#
+# The recorded datagrams take the same path as live ones: data datagrams go to
+# NatNetClient.process_datagram() with their recorded receive time, command
+# datagrams (server info, model definitions, ...) to process_command_datagram().
+# Listeners, decode pools and everything built on them cannot tell the difference.
+
+import itertools
+import threading
+import time
+
+from .Recording import RecordingReader, DATA_CHANNEL, NAT_FRAMEOFDATA, frame_number_of
+
+
+class RecordingReplay:
+    """Feed the recording at path to client.
+
+    speed 1.0 replays in real time, 4.0 four times as fast and 0 (or None) as
+    fast as possible. first_frame and last_frame limit the replayed frames by
+    frame number, start_time starts at the first frame received that many
+    seconds into the recording. The start is found through the recording's
+    index; the command datagrams before it are fed first, so the frames can
+    be decoded. With loop the replay starts over at the end of the range
+    until stop() is called.
+    """
+    def __init__(self, client, path, speed=1.0, loop=False, first_frame=None, last_frame=None, start_time=None):
+        self.client = client
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.start_time = start_time
+
+        self.replay_thread = None
+        self.__stop = threading.Event()
+        self.__finished = threading.Event()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.records = 0
+        self.frames = 0
+        self.bytes = 0
+        self.loops = 0
+        # largest delay of a datagram behind its schedule, in seconds
+        self.max_lag = 0.0
+        self.elapsed = 0.0
+
+    def start(self):
+        """Replay in a background thread, see wait()"""
+        self.__stop.clear()
+        self.__finished.clear()
+        self.replay_thread = threading.Thread(target=self.run, daemon=True)
+        self.replay_thread.start()
+
+    def run(self):
+        """Replay in the calling thread, returns get_stats() when done"""
+        self.__finished.clear()
+        start = time.monotonic()
+        try:
+            with RecordingReader(self.path) as reader:
+                start_offset = None
+                if self.first_frame is not None:
+                    start_offset = reader.seek_frame(self.first_frame)
+                elif self.start_time is not None:
+                    start_offset = reader.seek_time(self.start_time)
+                if start_offset is None and (self.first_frame is not None or self.start_time is not None):
+                    # the recording ends before the requested start
+                    return self.get_stats()
+                while not self.__stop.is_set():
+                    self.__replay_once(reader, start_offset)
+                    self.loops += 1
+                    if not self.loop:
+                        break
+        finally:
+            self.elapsed = time.monotonic() - start
+            self.__finished.set()
+        return self.get_stats()
+
+    def __replay_once(self, reader, start_offset):
+        client = self.client
+        speed = self.speed
+        first_frame = self.first_frame
+        last_frame = self.last_frame
+        # (recorded monotonic_ns, local monotonic time) of the first frame in range
+        origin = None
+        records = reader.records(start_offset)
+        if start_offset is not None:
+            records = itertools.chain(reader.context_records(start_offset), records)
+        for channel, message_id, monotonic_ns, time_ns, data in records:
+            if self.__stop.is_set():
+                return
+            is_frame = channel == DATA_CHANNEL and message_id == NAT_FRAMEOFDATA
+            if is_frame and (first_frame is not None or last_frame is not None):
+                frame_number = frame_number_of(data)
+                if first_frame is not None and frame_number < first_frame:
+                    continue
+                if last_frame is not None and frame_number > last_frame:
+                    # frame numbers only increase within a recording
+                    return
+            if speed:
+                if origin is None:
+                    # everything before the first frame is fed right away
+                    if is_frame:
+                        origin = (monotonic_ns, time.monotonic())
+                else:
+                    due = origin[1] + (monotonic_ns - origin[0]) / 1e9 / speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        if self.__stop.wait(delay):
+                            return
+                    elif -delay > self.max_lag:
+                        self.max_lag = -delay
+            if channel == DATA_CHANNEL:
+                client.process_datagram(data, time_ns)
+            else:
+                client.process_command_datagram(data)
+            self.records += 1
+            self.bytes += len(data)
+            if is_frame:
+                self.frames += 1
+
+    def wait(self, timeout=None):
+        """Block until the replay finished. Returns False on timeout."""
+        return self.__finished.wait(timeout)
+
+    def is_running(self):
+        return self.replay_thread is not None and self.replay_thread.is_alive()
+
+    def stop(self):
+        self.__stop.set()
+        if self.replay_thread is not None and self.replay_thread is not threading.current_thread():
+            self.replay_thread.join()
+        self.replay_thread = None
+
+    def get_stats(self):
+        stats = {}
+        stats["records"] = self.records
+        stats["frames"] = self.frames
+        stats["bytes"] = self.bytes
+        stats["loops"] = self.loops
+        stats["max_lag"] = self.max_lag
+        stats["elapsed"] = self.elapsed
+        stats["frames_per_second"] = self.frames / self.elapsed if self.elapsed > 0 else 0.0
+        return stats
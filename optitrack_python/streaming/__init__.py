@@ -1,4 +1,51 @@
 # Make modules available at the package level
-from .NatNetClient import NatNetClient
+#
+# The description and frame classes are star-imported as before. The client
+# classes load on first use; most of them share their module's name, and the
+# import system binds a submodule to that name in the package once it is loaded
+# (by any import of it, e.g. the client importing BackgroundRecorder), so the
+# package binds the class in its place.
+import importlib
+import sys
+import types
+
 from .DataDescriptions import *
 from .MoCapData import *
+
+_lazy_classes = {
+    "NatNetClient": ".NatNetClient",
+    "MultiServerClient": ".MultiServerClient",
+    "FramePoller": ".FramePoller",
+    "RecordingWriter": ".Recording",
+    "RecordingReader": ".Recording",
+    "RecordingReplay": ".RecordingReplay",
+    "FlightRecorder": ".FlightRecorder",
+    "BackgroundRecorder": ".BackgroundRecorder",
+    "ArchiveWriter": ".Archive",
+    "ArchiveReader": ".Archive",
+    "PcapReader": ".Pcap",
+}
+
+
+class _StreamingPackage(types.ModuleType):
+    def __setattr__(self, name, value):
+        if (isinstance(value, types.ModuleType) and _lazy_classes.get(name) == "." + name
+                and value.__name__ == self.__name__ + "." + name):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _StreamingPackage
+
+
+def __getattr__(name):
+    module_name = _lazy_classes.get(name)
+    if module_name is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_classes))
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+import time
+
+# Add the parent directory to the path to import optitrack_python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optitrack_python.streaming.Archive import convert_recording, CHUNK_FRAMES, COMPRESSIONS, FILE_EXTENSION
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a raw recording into a compressed columnar archive')
+    parser.add_argument('recording', help='Recording to convert (see set_record_streaming)')
+    parser.add_argument('archive', nargs='?', help='Archive to write (default: the recording with %s)' % FILE_EXTENSION)
+    parser.add_argument('--chunk-frames', type=int, default=CHUNK_FRAMES, help='Frames per chunk (default: %d)' % CHUNK_FRAMES)
+    parser.add_argument('--precision', type=float, help='Quantize positions and rotations to multiples of this, e.g. 1e-5 (default: lossless)')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='zlib', help='Compression (default: zlib)')
+    parser.add_argument('--level', type=int, help='Compression level or lzma preset')
+    args = parser.parse_args()
+
+    archive = args.archive or os.path.splitext(args.recording)[0] + FILE_EXTENSION
+    start = time.monotonic()
+    stats = convert_recording(args.recording, archive, chunk_frames=args.chunk_frames, precision=args.precision,
+                              compression=args.compression, level=args.level)
+    elapsed = time.monotonic() - start
+    recording_size = os.path.getsize(args.recording)
+    print("%s: %d frames in %d chunks, %.1f MB -> %.1f MB (%.1fx smaller) in %.1f s" % (
+        archive, stats["frames"], stats["chunks"], recording_size / 1e6, stats["bytes_written"] / 1e6,
+        recording_size / max(stats["bytes_written"], 1), elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+
+# Add the parent directory to the path to import optitrack_python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optitrack_python.batch import run_batch, JOBS, UNIT_FRAMES
+from optitrack_python.streaming.Archive import COMPRESSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index, summarize and archive all recordings in a directory in parallel')
+    parser.add_argument('input', help='Directory with recordings (*.natrec), searched recursively')
+    parser.add_argument('output', help='Directory for summaries, archives and the batch state')
+    parser.add_argument('--jobs', nargs='+', choices=JOBS, default=list(JOBS), help='Jobs to run (default: all)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--unit-frames', type=int, default=UNIT_FRAMES, help='Frames per work unit (default: %d)' % UNIT_FRAMES)
+    parser.add_argument('--precision', type=float, help='Quantize archived positions and rotations to multiples of this (default: lossless)')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='zlib', help='Archive compression (default: zlib)')
+    parser.add_argument('--force', action='store_true', help='Redo outputs that are up to date')
+    args = parser.parse_args()
+
+    def progress(done, total, recording, job):
+        print("\r[%d/%d] %s %s\033[K" % (done, total, job, recording), end="", flush=True)
+
+    archive_options = {"precision": args.precision, "compression": args.compression}
+    report = run_batch(args.input, args.output, jobs=args.jobs, workers=args.workers, unit_frames=args.unit_frames,
+                       archive_options=archive_options, force=args.force, progress=progress)
+    print()
+    print("%d recordings, %d up to date, %d outputs written, %d work units in %.1f s: %.1f MB/s, %.0f frames/s" % (
+        report["recordings"], report["up_to_date"], report["outputs"], report["units"], report["elapsed"],
+        report["mb_per_second"], report["frames_per_second"]))
+    for pid, worker in sorted(report["workers"].items()):
+        print("  worker %6d: %3d units, %7.1f MB/s, %8.0f frames/s" % (
+            pid, worker["units"], worker["mb_per_second"], worker["frames_per_second"]))
+    for error in report["errors"]:
+        print("ERROR: %s (%s): %s" % (error["recording"], error["job"], error["error"]))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+import time
+
+# Add the parent directory to the path to import optitrack_python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optitrack_python.export import export_recording
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the rigid bodies of a recording to NumPy .npy arrays')
+    parser.add_argument('recording', help='Recording to export (see set_record_streaming)')
+    parser.add_argument('directory', help='Directory to write the arrays and manifest.json to')
+    parser.add_argument('--rigid-bodies', nargs='+', help='Only export these rigid bodies (default: all)')
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print("\r%d/%d frames" % (done, total), end="", flush=True)
+
+    rigid_bodies = args.rigid_bodies
+    if rigid_bodies is not None:
+        # names or streaming ids
+        rigid_bodies = rigid_bodies + [int(name) for name in rigid_bodies if name.isdigit()]
+
+    start = time.monotonic()
+    manifest = export_recording(args.recording, args.directory, rigid_bodies=rigid_bodies, progress=progress)
+    print("\n%s: %d frames, %d rigid bodies in %.1f s" % (
+        args.directory, manifest["frames"], len(manifest["rigid_bodies"]), time.monotonic() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,8 @@ def main():
     parser.add_argument('--rigid-body', default='B', help='Rigid body name (default: B)')
     parser.add_argument('--rate', type=float, default=100.0, help='Sampling rate in Hz (default: 100)')
     parser.add_argument('--test-mode', action='store_true', help='Send random values within output range instead of real data')
+    parser.add_argument('--replay', help='Replay this recording (see set_record_streaming) in a loop instead of connecting to Motive')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay speed, 0 for as fast as possible (default: 1.0)')
     args = parser.parse_args()
     test_mode = args.test_mode
     
@@ -35,19 +37,16 @@ def main():
     
     # Setup OptiTrack connection
     print("Connecting to OptiTrack...")
-    motive = MotiveReceiver(server_ip="10.40.49.47")
+    if args.replay:
+        motive = MotiveReceiver(server_ip="10.40.49.47", do_mock_streaming=True, fn_mock=args.replay,
+                                mock_speed=args.replay_speed, mock_loop=True)
+    else:
+        motive = MotiveReceiver(server_ip="10.40.49.47")
     
     print("Waiting for data connection...")
-    time.sleep(1)
-    
-    # Test basic connection
-    print("Testing basic connection...")
-    for i in range(50):
+    if motive.wait_until_ready(timeout=6.0):
         latest_data = motive.get_last()
-        if latest_data:
-            print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
-            break
-        time.sleep(0.1)
+        print(f"✓ Connection established! Frame ID: {latest_data['frame_id']}")
     else:
         print("✗ No data received. Check OptiTrack connection.")
         motive.stop()
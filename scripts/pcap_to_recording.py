@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+# Add the parent directory to the path to import optitrack_python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optitrack_python.streaming.Pcap import convert_pcap, DEFAULT_COMMAND_PORT, DEFAULT_DATA_PORT
+from optitrack_python.streaming.Recording import FILE_EXTENSION
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the NatNet traffic of a pcap/pcapng capture into a recording')
+    parser.add_argument('capture', help='Capture file, e.g. from tcpdump -i eth0 -w capture.pcap udp port 1510 or udp port 1511')
+    parser.add_argument('recording', nargs='?', help='Recording to write (default: the capture with %s)' % FILE_EXTENSION)
+    parser.add_argument('--server-ip', help='Only keep the traffic of this Motive server (default: all)')
+    parser.add_argument('--command-port', type=int, default=DEFAULT_COMMAND_PORT, help='NatNet command port (default: %d)' % DEFAULT_COMMAND_PORT)
+    parser.add_argument('--data-port', type=int, default=DEFAULT_DATA_PORT, help='NatNet data port (default: %d)' % DEFAULT_DATA_PORT)
+    args = parser.parse_args()
+
+    recording = args.recording or os.path.splitext(args.capture)[0] + FILE_EXTENSION
+    stats = convert_pcap(args.capture, recording, command_port=args.command_port, data_port=args.data_port,
+                         server_address=args.server_ip)
+    print("%s: %d NatNet datagrams from %d packets (%d reassembled, %d truncated, %d incomplete), %.1f s" % (
+        recording, stats["datagrams"], stats["packets"], stats["reassembled"], stats["truncated"],
+        stats["fragments_dropped"], stats["duration"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,8 @@ def main():
     parser.add_argument('--rigid-bodies', nargs='+', default=['A','B','C','D'], help='Rigid body names (default: A B C D)')
     parser.add_argument('--rate', type=float, default=100.0, help='Sampling rate in Hz (default: 100)')
     parser.add_argument('--test-mode', action='store_true', help='Send random values within output range instead of real data')
+    parser.add_argument('--replay', help='Replay this recording (see set_record_streaming) in a loop instead of connecting to Motive')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay speed, 0 for as fast as possible (default: 1.0)')
     parser.add_argument('--server-ip', default='10.40.49.47', help='OptiTrack server IP (default: 10.40.49.47)')
     parser.add_argument('--scale', action='store_true', help='Scale the data to 0-1 range (default: False)')
     args = parser.parse_args()
@@ -37,16 +39,16 @@ def main():
     sleep_time = 1.0 / args.rate
 
     print("Connecting to OptiTrack...")
-    motive = MotiveReceiver(server_ip=args.server_ip)
-    time.sleep(1)
+    if args.replay:
+        motive = MotiveReceiver(server_ip=args.server_ip, do_mock_streaming=True, fn_mock=args.replay,
+                                mock_speed=args.replay_speed, mock_loop=True)
+    else:
+        motive = MotiveReceiver(server_ip=args.server_ip)
 
     print("Testing basic connection...")
-    for i in range(50):
+    if motive.wait_until_ready(timeout=6.0):
         latest = motive.get_last()
-        if latest:
-            print(f"✓ Connection established! Frame ID: {latest['frame_id']}")
-            break
-        time.sleep(0.1)
+        print(f"✓ Connection established! Frame ID: {latest['frame_id']}")
     else:
         print("✗ No data received. Check OptiTrack connection.")
         motive.stop()
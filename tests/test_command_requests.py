@@ -0,0 +1,61 @@
+import time
+
+from optitrack_python.streaming.CommandRequests import RequestTracker
+
+RESPONSE_ID = 3
+
+
+def submit(tracker, sends, name, timeout=1.0, retries=0):
+    return tracker.submit(lambda: sends.append(name), RESPONSE_ID, timeout=timeout, retries=retries)
+
+
+def test_answers_resolve_requests_in_order():
+    tracker = RequestTracker()
+    sends = []
+    first = submit(tracker, sends, "first")
+    second = submit(tracker, sends, "second")
+    assert tracker.resolve(RESPONSE_ID, 1)
+    assert tracker.resolve(RESPONSE_ID, 2)
+    assert (first.result(0), second.result(0)) == (1, 2)
+    assert not tracker.has_pending(RESPONSE_ID)
+
+
+def test_cancelled_request_leaves_the_queue():
+    tracker = RequestTracker()
+    sends = []
+    cancelled = submit(tracker, sends, "cancelled")
+    assert cancelled.cancel()
+    assert not tracker.has_pending(RESPONSE_ID)
+    following = submit(tracker, sends, "following")
+    assert tracker.resolve(RESPONSE_ID, "answer")
+    assert following.result(0) == "answer"
+
+
+def test_cancelled_request_with_pending_retry_is_not_resent():
+    tracker = RequestTracker()
+    sends = []
+    cancelled = submit(tracker, sends, "cancelled", timeout=0.05, retries=2)
+    cancelled.cancel()
+    time.sleep(0.15)
+    assert sends == ["cancelled"]
+
+
+def test_late_answer_to_a_retried_request_is_discarded():
+    tracker = RequestTracker()
+    sends = []
+    retried = submit(tracker, sends, "retried", timeout=0.05, retries=2)
+    time.sleep(0.08)
+    following = submit(tracker, sends, "following")
+    assert sends == ["retried", "retried", "following"]
+    tracker.resolve(RESPONSE_ID, "first send")
+    assert not tracker.resolve(RESPONSE_ID, "resend")
+    tracker.resolve(RESPONSE_ID, "following")
+    assert (retried.result(0), following.result(0)) == ("first send", "following")
+
+
+def test_unanswered_request_times_out():
+    tracker = RequestTracker()
+    sends = []
+    request = submit(tracker, sends, "request", timeout=0.02, retries=1)
+    assert isinstance(request.exception(1.0), TimeoutError)
+    assert sends == ["request", "request"]